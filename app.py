@@ -1,12 +1,6 @@
-from climbunity_app.extensions import app, db
-from climbunity_app.main.routes import main
-from climbunity_app.auth.routes import auth
+from climbunity_app import create_app
 
-app.register_blueprint(main)
-app.register_blueprint(auth)
-
-with app.app_context():
-    db.create_all()
+app = create_app()
 
 if __name__ == "__main__":
     app.run(debug=True, port=5002)
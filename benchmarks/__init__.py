@@ -0,0 +1 @@
+"""Ad-hoc performance benchmarks, run each with `python -m benchmarks.<name>`."""
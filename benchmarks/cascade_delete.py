@@ -0,0 +1,94 @@
+"""Compare the old per-row venue delete loop with the set-based cascade.
+
+    python -m benchmarks.cascade_delete --routes 300 --ascents-per-route 20
+
+Seeds an identical venue for each strategy and times deleting it. Uses
+DATABASE_URL when it is set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+
+def legacy_delete_venue(venue_id):
+    """The delete_venue view body before the set-based cascade, kept for comparison."""
+    from climbunity_app.extensions import db
+    from climbunity_app.models import Route, Venue
+    venue = Venue.query.get(venue_id)
+    for appointment in venue.booked_appointments:
+        db.session.delete(appointment)
+        db.session.commit()
+    routes = Route.query.filter_by(venue_id=venue.id).all()
+    for route in routes:
+        for ascent in route.ascents_on_route:
+            db.session.delete(ascent)
+            db.session.commit()
+        db.session.delete(route)
+        db.session.commit()
+    db.session.delete(venue)
+    db.session.commit()
+
+def seed_venue(user_id, routes, ascents_per_route, appointments):
+    """Insert one venue with its routes, ascents and appointments, returning its id."""
+    from climbunity_app.extensions import db
+    from climbunity_app.models import Appointment, Ascent, Route, RouteStats, Venue
+    venue = Venue(name='Benchmark Gym', address='1 Benchmark Way')
+    db.session.add(venue)
+    db.session.commit()
+    db.session.bulk_insert_mappings(Route, [
+        dict(venue_id=venue.id, setter_id=user_id, name=f'Route {n}', grade='5.10a')
+        for n in range(routes)
+    ])
+    route_ids = [row.id for row in db.session.query(Route.id).filter_by(venue_id=venue.id)]
+    db.session.bulk_insert_mappings(RouteStats, [dict(route_id=route_id) for route_id in route_ids])
+    db.session.bulk_insert_mappings(Ascent, [
+        dict(user_id=user_id, route_id=route_id, send_rating=3)
+        for route_id in route_ids for _ in range(ascents_per_route)
+    ])
+    db.session.bulk_insert_mappings(Appointment, [
+        dict(created_by=user_id, venue_id=venue.id, appointment_datetime=datetime(2030, 1, 1, 18))
+        for _ in range(appointments)
+    ])
+    db.session.commit()
+    return venue.id
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--routes', type=int, default=300)
+    parser.add_argument('--ascents-per-route', type=int, default=20)
+    parser.add_argument('--appointments', type=int, default=50)
+    args = parser.parse_args()
+
+    if not os.getenv('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = f'sqlite:///{tempfile.mkdtemp()}/cascade_delete.db'
+
+    from climbunity_app import create_app
+    from climbunity_app.extensions import db
+    from climbunity_app.models import User
+    from climbunity_app.deletes import delete_venue_cascade
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        user = User(username='benchmark', password='x', email='bench@example.com',
+            first_name='Bench', last_name='Mark', address='here', has_gear=True)
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+        rows = args.routes * (1 + args.ascents_per_route) + args.appointments
+        print(f'{app.config["SQLALCHEMY_DATABASE_URI"]}: {rows} rows per venue')
+        for label, delete in [('per-row loop', legacy_delete_venue), ('set-based cascade', delete_venue_cascade)]:
+            venue_id = seed_venue(user_id, args.routes, args.ascents_per_route, args.appointments)
+            db.session.expunge_all()
+            start = time.perf_counter()
+            delete(venue_id)
+            elapsed = time.perf_counter() - start
+            print(f'{label:>18}: {elapsed * 1000:9.1f} ms')
+
+        db.session.delete(User.query.get(user_id))
+        db.session.commit()
+
+if __name__ == '__main__':
+    main()
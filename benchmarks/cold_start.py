@@ -0,0 +1,87 @@
+"""Time a cold start: importing the package, building the app, a first request and importing the tests.
+
+    python -m benchmarks.cold_start --runs 5
+
+Each stage runs --runs times, each in a fresh interpreter, and is timed from
+launch to exit, so interpreter startup is included just as it is for a gunicorn
+worker or a test run. DATABASE_URL points at a port nothing listens on: a
+stage that touches the database fails instead of being timed. The median of
+each stage is checked against its budget (BUDGETS, in ms, or --budget
+stage=ms) and the exit status is 1 when any is over, so CI can run it.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# a refused connection, so any query at startup shows up as a failed stage
+NO_DATABASE = 'postgresql://climbunity@127.0.0.1:9/climbunity'
+
+STAGES = {
+    'import': 'import climbunity_app',
+    'create_app': 'from climbunity_app import create_app; create_app()',
+    'worker_boot': 'import app', # what gunicorn does in app:app
+    'first_request': 'from climbunity_app import create_app\n'
+        'assert create_app().test_client().get("/healthz").status_code == 200',
+    'test_import': 'import climbunity_app.main.tests, climbunity_app.auth.tests, '
+        'climbunity_app.ops.tests, climbunity_app.api.tests',
+}
+BUDGETS = {
+    'import': 600,
+    'create_app': 2000,
+    'worker_boot': 2000,
+    'first_request': 2200,
+    'test_import': 3000,
+}
+
+def run_stage(code, runs):
+    """Wall-clock seconds of `runs` fresh interpreters running `code`."""
+    environment = dict(os.environ, DATABASE_URL=NO_DATABASE, DATABASE_REPLICA_URLS='')
+    environment.setdefault('SECRET_KEY', 'benchmark')
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code], env=environment, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed')
+        timings.append(elapsed)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per stage')
+    parser.add_argument('--budget', action='append', default=[], metavar='STAGE=MS',
+        help=f'override a budget, stages: {", ".join(STAGES)}')
+    args = parser.parse_args()
+    budgets = dict(BUDGETS)
+    for override in args.budget:
+        stage, _, ms = override.partition('=')
+        if stage not in STAGES or not ms.isdigit():
+            parser.error(f'--budget takes STAGE=MS with a stage from {", ".join(STAGES)}, not {override!r}')
+        budgets[stage] = int(ms)
+
+    baseline = statistics.median(run_stage('pass', args.runs))
+    print(f'python startup alone: {baseline * 1000:.0f} ms (included below)\n')
+    print(f'{"stage":14s} {"median":>9s} {"max":>9s} {"budget":>9s}')
+    over = []
+    for stage, code in STAGES.items():
+        try:
+            timings = run_stage(code, args.runs)
+        except RuntimeError as error:
+            print(f'{stage:14s} failed: {error}')
+            over.append(stage)
+            continue
+        median = statistics.median(timings) * 1000
+        verdict = '' if median <= budgets[stage] else '  OVER'
+        if verdict:
+            over.append(stage)
+        print(f'{stage:14s} {median:7.0f}ms {max(timings) * 1000:7.0f}ms {budgets[stage]:7d}ms{verdict}')
+    if over:
+        print(f'\nover budget: {", ".join(over)}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""Load every main and auth endpoint over a seeded dataset and write the results as JSON.
+
+    python -m benchmarks.endpoints --scale 100k --concurrency 8 --requests 400 --output results.json
+
+Seeds a database with `flask seed`'s generator (DATABASE_URL when it is set,
+otherwise a throwaway SQLite file), dated up to today so the leaderboards' 30
+and 7 day windows aren't empty, then drives one endpoint at a time from
+`--concurrency` threads, each an in-process test client logged in as its own
+seeded climber (anonymous for the `anon` scenarios, which the page cache
+serves). Every scenario sends `--requests` requests in total; rows the
+deleting endpoints remove are created up front, outside the timings.
+
+For each endpoint it records p50/p95/p99 latency, requests/sec, responses
+that weren't the expected status, and the mean/max number of SQL statements
+from the X-DB-Statements header. `--output` writes all of it with the git
+commit, database dialect and dataset size; `--compare` prints the change
+against an earlier results file, so runs on two commits can be diffed:
+
+    git checkout main && python -m benchmarks.endpoints --output before.json
+    git checkout my-branch && python -m benchmarks.endpoints --compare before.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from itertools import count
+
+from benchmarks.http_throughput import percentile
+
+class Scenario(object):
+    """One endpoint: `path(context)` and `data(context)` build each request, `expect` is a success."""
+
+    def __init__(self, name, method, path, data=None, expect=200, anonymous=False):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+        self.expect = expect
+        self.anonymous = anonymous
+
+class ThreadContext(object):
+    """A load thread's clients and the rows it works on; `take` hands out prepared ids in turn."""
+
+    def __init__(self, index, user_id, client, anonymous_client, prepared, rows):
+        self.index = index
+        self.user_id = user_id
+        self.client = client
+        self.anonymous_client = anonymous_client
+        self.prepared = prepared
+        self.rows = rows
+        self.projects = []
+        self.sequence = count()
+
+    def take(self, name):
+        return self.prepared[name].pop()
+
+    def route(self):
+        routes = self.rows['routes']
+        return routes[next(self.sequence) * 7919 % len(routes)] # a stride through every route
+
+def venue_form(context):
+    return dict(name=f'Benchmark Gym {context.index}', address='1 Benchmark Way', open_hours='6am - 11pm',
+        description='Edited by the benchmark')
+
+def route_form(context):
+    return dict(name=f'Benchmark Route {context.index}', venue_id=context.rows['venue'], setter_id=context.user_id,
+        grade='V4', photo_url='', route_set_date=str(date.today()),
+        route_takedown_date=str(date.today() + timedelta(days=60)), route_styles=['1'], route_tags=['1', '2'])
+
+def signup_form(context):
+    number = next(context.rows['signups'])
+    return dict(username=f'newclimber{number}', password='climbunity', email=f'newclimber{number}@example.com',
+        first_name='New', last_name='Climber', address='1 Benchmark Way', climber_styles=['1'])
+
+def add_project(context):
+    route_id = context.route()
+    context.projects.append(route_id)
+    return f'/add_to_project_list/{route_id}'
+
+SCENARIOS = [
+    Scenario('GET / (anon)', 'GET', lambda c: '/', anonymous=True),
+    Scenario('GET /', 'GET', lambda c: '/'),
+    Scenario('GET /venue/<id> (anon)', 'GET', lambda c: f'/venue/{c.rows["venue"]}', anonymous=True),
+    Scenario('GET /venue/<id>', 'GET', lambda c: f'/venue/{c.rows["venue"]}'),
+    Scenario('GET /route/<id> (anon)', 'GET', lambda c: f'/route/{c.route()}', anonymous=True),
+    Scenario('GET /route/<id>', 'GET', lambda c: f'/route/{c.route()}'),
+    Scenario('GET /routes/search', 'GET', lambda c: '/routes/search?scale=boulder&min_grade=V3&max_grade=V6&tag=1'),
+    Scenario('GET /leaderboard', 'GET', lambda c: '/leaderboard?board=hardest_boulder'),
+    Scenario('GET /venue/<id>/leaderboard', 'GET', lambda c: f'/venue/{c.rows["venue"]}/leaderboard?window=30d'),
+    Scenario('GET /users (anon)', 'GET', lambda c: '/users', anonymous=True),
+    Scenario('GET /users', 'GET', lambda c: '/users'),
+    Scenario('GET /profile/<id> (own)', 'GET', lambda c: f'/profile/{c.user_id}'),
+    Scenario('GET /profile/<id> (other)', 'GET', lambda c: f'/profile/{c.rows["busiest_user"]}'),
+    Scenario('GET /profile/<id>/ascents', 'GET', lambda c: f'/profile/{c.rows["busiest_user"]}/ascents'),
+    Scenario('GET /edit_profile/<id>', 'GET', lambda c: f'/edit_profile/{c.user_id}'),
+    Scenario('POST /edit_profile/<id>', 'POST', lambda c: f'/edit_profile/{c.user_id}',
+        lambda c: dict(first_name='Climber', last_name=str(c.user_id), address='2 Chalk Street',
+            climber_styles=['1', '2'], has_gear='y')),
+    Scenario('GET /new_venue', 'GET', lambda c: '/new_venue'),
+    Scenario('POST /new_venue', 'POST', lambda c: '/new_venue', venue_form, expect=302),
+    Scenario('POST /venue/<id>', 'POST', lambda c: f'/venue/{c.take("venues")}', venue_form, expect=302),
+    Scenario('GET /new_route', 'GET', lambda c: '/new_route'),
+    Scenario('POST /new_route', 'POST', lambda c: '/new_route', route_form, expect=302),
+    Scenario('POST /route/<id>', 'POST', lambda c: f'/route/{c.route()}', route_form, expect=302),
+    Scenario('POST /add_to_project_list/<id>', 'POST', add_project, expect=302),
+    Scenario('POST /remove_from_project_list/<id>', 'POST',
+        lambda c: f'/remove_from_project_list/{c.projects.pop()}', expect=302),
+    Scenario('GET /log_ascent/<id>', 'GET', lambda c: f'/log_ascent/{c.route()}'),
+    Scenario('POST /log_ascent/<id>', 'POST', lambda c: f'/log_ascent/{c.route()}',
+        lambda c: dict(ascent_date=str(date.today()), ascent_type='REDPOINT', rating='4', comments='Benchmark send'),
+        expect=302),
+    Scenario('POST /delete_ascent/<id>', 'POST', lambda c: f'/delete_ascent/{c.take("ascents")}', expect=302),
+    Scenario('GET /new_appointment', 'GET', lambda c: '/new_appointment'),
+    Scenario('POST /new_appointment', 'POST', lambda c: '/new_appointment',
+        lambda c: dict(appointment_datetime=(datetime.now() + timedelta(days=7)).strftime('%Y-%m-%dT%H:%M'),
+            venue_id=c.rows['venue'], additional_guests=[str(c.rows['busiest_user'])]), expect=302),
+    Scenario('POST /join_appointment/<id>', 'POST', lambda c: f'/join_appointment/{c.take("appointments")}',
+        expect=302),
+    Scenario('POST /delete_appointment/<id>', 'POST',
+        lambda c: f'/delete_appointment/{c.take("appointments_to_delete")}', expect=302),
+    Scenario('POST /delete_route/<id>', 'POST', lambda c: f'/delete_route/{c.take("routes")}', expect=302),
+    Scenario('POST /delete_venue/<id>', 'POST', lambda c: f'/delete_venue/{c.take("venues_to_delete")}',
+        expect=302),
+    Scenario('GET /signup', 'GET', lambda c: '/signup', anonymous=True),
+    Scenario('POST /signup', 'POST', lambda c: '/signup', signup_form, expect=302, anonymous=True),
+    Scenario('GET /login', 'GET', lambda c: '/login', anonymous=True),
+    Scenario('POST /login', 'POST', lambda c: '/login',
+        lambda c: dict(username=f'climber{c.user_id}', password='climbunity'), expect=302, anonymous=True),
+    Scenario('GET /logout', 'GET', lambda c: '/logout', expect=302),
+]
+
+def prepare(per_thread, user_ids):
+    """Rows for the writing scenarios, `per_thread` of each for every thread's user; {name: [ids] per thread}."""
+    from climbunity_app.extensions import db
+    from climbunity_app.models import Appointment, Ascent, Route, RouteStats, Venue
+    venue = Venue.query.order_by(Venue.id).first()
+    prepared = [{} for _ in user_ids]
+    for index, user_id in enumerate(user_ids):
+        rows = dict(
+            venues=[Venue(name=f'Edited Gym {user_id}-{n}', address='1 Benchmark Way') for n in range(per_thread)],
+            venues_to_delete=[Venue(name=f'Doomed Gym {user_id}-{n}', address='1 Benchmark Way')
+                for n in range(per_thread)],
+            routes=[Route(venue_id=venue.id, name=f'Doomed Route {user_id}-{n}', grade='V2', stats=RouteStats())
+                for n in range(per_thread)],
+            appointments=[Appointment(created_by=user_ids[index - 1], venue_id=venue.id,
+                appointment_datetime=datetime.now() + timedelta(days=3)) for _ in range(per_thread)],
+            appointments_to_delete=[Appointment(created_by=user_id, venue_id=venue.id,
+                appointment_datetime=datetime.now() + timedelta(days=3)) for _ in range(per_thread)],
+        )
+        for instances in rows.values():
+            db.session.add_all(instances)
+        db.session.flush()
+        ascents = [Ascent(user_id=user_id, route_id=route.id, send_date=date.today(), send_type='SEND')
+            for route in rows['routes']]
+        db.session.add_all(ascents)
+        db.session.flush()
+        rows['ascents'] = ascents
+        prepared[index] = {name: [instance.id for instance in instances] for name, instances in rows.items()}
+    db.session.commit()
+    return prepared
+
+def run_scenario(scenario, contexts, per_thread):
+    latencies, statements, statuses = [], [], {}
+    lock = threading.Lock()
+
+    def drive(context):
+        client = context.anonymous_client if scenario.anonymous else context.client
+        for _ in range(per_thread):
+            path = scenario.path(context)
+            data = scenario.data(context) if scenario.data else None
+            start = time.perf_counter()
+            if scenario.method == 'GET':
+                response = client.get(path)
+            else:
+                response = client.post(path, data=data)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if 'X-DB-Statements' in response.headers:
+                    statements.append(int(response.headers['X-DB-Statements']))
+
+    threads = [threading.Thread(target=drive, args=(context,)) for context in contexts]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return dict(
+        requests=len(latencies),
+        errors=sum(number for status, number in statuses.items() if status != scenario.expect),
+        statuses={str(status): number for status, number in sorted(statuses.items())},
+        requests_per_sec=round(len(latencies) / wall, 1),
+        p50_ms=round(percentile(latencies, 0.50) * 1000, 2),
+        p95_ms=round(percentile(latencies, 0.95) * 1000, 2),
+        p99_ms=round(percentile(latencies, 0.99) * 1000, 2),
+        queries_mean=round(statistics.mean(statements), 1) if statements else None,
+        queries_max=max(statements) if statements else None,
+    )
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    print(f'\nchange against {baseline["meta"]["commit"]} ({baseline["meta"]["dataset"]["ascents"]} ascents)')
+    for name, result in results['endpoints'].items():
+        before = baseline['endpoints'].get(name)
+        if before is None:
+            continue
+        p95 = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+        queries = ''
+        if result['queries_max'] is not None and before['queries_max'] is not None:
+            queries = f'{result["queries_max"] - before["queries_max"]:+d} queries'
+        print(f'  {name:38s} p95 {p95:+7.1f}%  {queries}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', default='10k', help='1k, 10k, 100k or 1m ascents')
+    parser.add_argument('--ascents', type=int, help='exact number of ascents, overrides --scale')
+    parser.add_argument('--seed', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint, over all threads')
+    parser.add_argument('--rounds', type=int, help='BCRYPT_LOG_ROUNDS, the app default when left out')
+    parser.add_argument('--output', help='write the results here as JSON')
+    parser.add_argument('--compare', help='an earlier --output file to print the change against')
+    args = parser.parse_args()
+
+    if not os.getenv('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tempfile.mkdtemp(), "bench.db")}'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    from climbunity_app import create_app
+    from climbunity_app.extensions import db
+    from climbunity_app.seeding import SCALES, SEED_PASSWORD, seed_database
+    from climbunity_app.models import Ascent, Route
+    from sqlalchemy import func
+
+    app = create_app()
+    app.config.update(WTF_CSRF_ENABLED=False, QUERY_STATS_HEADERS=True,
+        SQLALCHEMY_DATABASE_URI=os.environ['DATABASE_URL'])
+    app.logger.disabled = True # failing requests are counted as errors instead of printing tracebacks
+    if args.rounds is not None:
+        app.config['BCRYPT_LOG_ROUNDS'] = args.rounds
+    ascents = args.ascents or SCALES[args.scale]
+    per_thread = max(1, args.requests // args.concurrency)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        started = time.perf_counter()
+        size = seed_database(ascents, seed=args.seed, today=date.today()) # recent sends for the 30d/7d boards
+        seeded = time.perf_counter() - started
+        print(f'seeded {size["ascents"]} ascents ({size["users"]} users, {size["routes"]} routes) in {seeded:.1f}s')
+        user_ids = list(range(1, args.concurrency + 1))
+        rows = dict(
+            venue=1,
+            routes=[route_id for route_id, in db.session.query(Route.id).filter(Route.venue_id == 1).order_by(Route.id)],
+            busiest_user=db.session.query(Ascent.user_id).group_by(Ascent.user_id)
+                .order_by(func.count().desc(), Ascent.user_id).first()[0],
+            signups=count(),
+        )
+        prepared = prepare(per_thread, user_ids)
+        dialect = db.engine.dialect.name
+
+    contexts = []
+    for index, user_id in enumerate(user_ids):
+        client = app.test_client()
+        client.post('/login', data=dict(username=f'climber{user_id}', password=SEED_PASSWORD))
+        contexts.append(ThreadContext(index, user_id, client, app.test_client(), prepared[index], rows))
+
+    endpoints = {}
+    print(f'{args.concurrency} threads, {per_thread * args.concurrency} requests per endpoint')
+    print(f'  {"endpoint":38s} {"req/s":>8s} {"p50":>8s} {"p95":>8s} {"p99":>8s} {"queries":>8s} {"errors":>6s}')
+    for scenario in SCENARIOS:
+        result = endpoints[scenario.name] = run_scenario(scenario, contexts, per_thread)
+        queries = f'{result["queries_mean"]:.1f}' if result['queries_mean'] is not None else '-'
+        print(f'  {scenario.name:38s} {result["requests_per_sec"]:8.1f} {result["p50_ms"]:8.1f} '
+            f'{result["p95_ms"]:8.1f} {result["p99_ms"]:8.1f} {queries:>8s} {result["errors"]:6d}')
+
+    results = dict(
+        meta=dict(commit=git_commit(), dialect=dialect, dataset=size, seed=args.seed,
+            concurrency=args.concurrency, requests_per_endpoint=per_thread * args.concurrency,
+            seed_seconds=round(seeded, 1), run_at=datetime.now().isoformat(timespec='seconds')),
+        endpoints=endpoints,
+    )
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+        print(f'wrote {args.output}')
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Measure requests per second against a running Climbunity server.
+
+    python -m benchmarks.http_throughput --url http://localhost:5002/ --concurrency 32 --duration 20
+
+Keeps `--concurrency` requests in flight for `--duration` seconds and prints
+throughput and latency percentiles, so the gunicorn worker modes can be
+compared on the same machine (see the README).
+"""
+import argparse
+import threading
+import time
+import urllib.error
+import urllib.request
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def worker(url, deadline, latencies, errors, lock):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                response.read()
+            ok = True
+        except (urllib.error.URLError, OSError):
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors.append(elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5002/')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    latencies, errors, lock = [], [], threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    threads = [
+        threading.Thread(target=worker, args=(args.url, deadline, latencies, errors, lock))
+        for _ in range(args.concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    print(f'{args.url} with {args.concurrency} concurrent clients for {wall:.1f}s')
+    print(f'  requests/sec: {len(latencies) / wall:10.1f}')
+    print(f'  errors:       {len(errors):10d}')
+    for label, fraction in [('p50', 0.50), ('p95', 0.95), ('p99', 0.99)]:
+        print(f'  {label} latency:  {percentile(latencies, fraction) * 1000:8.1f} ms')
+
+if __name__ == '__main__':
+    main()
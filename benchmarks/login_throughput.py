@@ -0,0 +1,93 @@
+"""Measure logins per second and what a login storm does to other pages.
+
+    python -m benchmarks.login_throughput --logins 8 --duration 10 --workers 2
+
+Runs the app in-process on a temporary SQLite file. `--logins` threads post
+to /login as fast as they can while one more thread keeps fetching the
+homepage; compare the homepage latency with different --workers/--queue
+settings (BCRYPT_WORKERS/BCRYPT_QUEUE_SIZE) to see how much room the bounded
+hashing pool leaves for everything else.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks.http_throughput import percentile
+
+def run(client_factory, path, data, deadline, latencies, statuses, lock):
+    client = client_factory()
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        if data is None:
+            response = client.get(path)
+        else:
+            response = client.post(path, data=data)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=8, help='concurrent login clients')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=2, help='BCRYPT_WORKERS')
+    parser.add_argument('--queue', type=int, default=8, help='BCRYPT_QUEUE_SIZE')
+    parser.add_argument('--rounds', type=int, default=12, help='BCRYPT_LOG_ROUNDS')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(directory, "bench.db")}'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    from climbunity_app import create_app
+    from climbunity_app.extensions import db, bcrypt
+    from climbunity_app.models import User
+
+    app = create_app()
+    app.config.update(
+        WTF_CSRF_ENABLED=False,
+        SQLALCHEMY_DATABASE_URI=os.environ['DATABASE_URL'],
+        BCRYPT_WORKERS=args.workers,
+        BCRYPT_QUEUE_SIZE=args.queue,
+        BCRYPT_LOG_ROUNDS=args.rounds,
+    )
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(User(
+            username='bench', email='bench@example.com', first_name='Bench', last_name='User',
+            address='1 Crag Rd', has_gear=True,
+            password=bcrypt.generate_password_hash('password123', args.rounds).decode('utf-8')))
+        db.session.commit()
+
+    login = {'username': 'bench', 'password': 'password123'}
+    login_latencies, page_latencies = [], []
+    login_statuses, page_statuses = {}, {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    threads = [
+        threading.Thread(target=run, args=(app.test_client, '/login', login, deadline, login_latencies, login_statuses, lock))
+        for _ in range(args.logins)
+    ]
+    threads.append(threading.Thread(target=run, args=(app.test_client, '/', None, deadline, page_latencies, page_statuses, lock)))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    login_latencies.sort()
+    page_latencies.sort()
+    print(f'{args.logins} login clients, {args.workers} bcrypt workers, queue {args.queue}, cost {args.rounds}, {wall:.1f}s')
+    print(f'  logins/sec:        {login_statuses.get(302, 0) / wall:8.1f}')
+    print(f'  shed (503):        {login_statuses.get(503, 0):8d}')
+    print(f'  login p95:         {percentile(login_latencies, 0.95) * 1000:8.1f} ms')
+    print(f'  homepage requests: {len(page_latencies):8d}')
+    for label, fraction in [('p50', 0.50), ('p95', 0.95), ('p99', 0.99)]:
+        print(f'  homepage {label}:      {percentile(page_latencies, fraction) * 1000:8.1f} ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Time building the partner index and top-k partner lookups over many climbers.
+
+    python -m benchmarks.partner_matching --users 100000 --ascents-per-user 20
+
+Seeds users (with styles and gear), venues, routes and ascents in bulk, builds
+the partner index once, then times suggest_partners for a sample of users and
+prints the median and worst time. Uses DATABASE_URL when it is set, otherwise
+a throwaway SQLite file.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+GRADES = ['V0', 'V2', 'V3', 'V4', 'V5', 'V7', '5.9', '5.10a', '5.10c', '5.11a', '5.11d', '5.12b']
+CHUNK = 10000
+
+def seed(users, venues, routes, styles, ascents_per_user):
+    from climbunity_app.extensions import db
+    from climbunity_app.grades import parse_grade
+    from climbunity_app.models import Ascent, Route, SendType, Style, User, Venue, user_styles_table
+    rng = random.Random(14)
+    db.session.bulk_insert_mappings(Venue, [dict(name=f'Gym {n}', address='1 Benchmark Way') for n in range(venues)])
+    db.session.bulk_insert_mappings(Style, [dict(style=f'style{n}') for n in range(styles)])
+    db.session.commit()
+    parsed = {grade: parse_grade(grade) for grade in GRADES}
+    route_venues = [rng.randint(1, venues) for _ in range(routes)]
+    venue_routes = {}
+    for route_id, venue_id in enumerate(route_venues, 1):
+        venue_routes.setdefault(venue_id, []).append(route_id)
+    for start in range(0, routes, CHUNK):
+        grades = [rng.choice(GRADES) for _ in range(start, min(start + CHUNK, routes))]
+        db.session.execute(Route.__table__.insert(), [dict(
+            id=start + n + 1, venue_id=route_venues[start + n], name=f'Route {start + n + 1}', grade=grade,
+            grade_scale=parsed[grade].scale, grade_difficulty=parsed[grade].difficulty,
+        ) for n, grade in enumerate(grades)])
+    db.session.commit()
+    home_venues = list(venue_routes)
+    for start in range(0, users, CHUNK):
+        ids = range(start + 1, min(start + CHUNK, users) + 1)
+        db.session.execute(User.__table__.insert(), [dict(
+            id=id, username=f'climber{id}', password='x', email=f'climber{id}@example.com',
+            first_name='Bench', last_name='Mark', address='1 Benchmark Way', has_gear=rng.random() < 0.5,
+        ) for id in ids])
+        db.session.execute(user_styles_table.insert(), [
+            dict(user_id=id, style_id=style_id)
+            for id in ids for style_id in rng.sample(range(1, styles + 1), rng.randint(1, 3))
+        ])
+        # climbers mostly stick to a home venue's routes
+        homes = {id: venue_routes[rng.choice(home_venues)] for id in ids}
+        db.session.execute(Ascent.__table__.insert(), [
+            dict(user_id=id, send_type=SendType.REDPOINT.name,
+                route_id=rng.choice(homes[id]) if rng.random() < 0.8 else rng.randint(1, routes))
+            for id in ids for _ in range(rng.randint(0, ascents_per_user))
+        ])
+        db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--venues', type=int, default=200)
+    parser.add_argument('--routes', type=int, default=20000)
+    parser.add_argument('--styles', type=int, default=6)
+    parser.add_argument('--ascents-per-user', type=int, default=20)
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    if not os.getenv('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = f'sqlite:///{tempfile.mkdtemp()}/partner_matching.db'
+
+    from climbunity_app import create_app
+    from climbunity_app.extensions import db
+    from climbunity_app.partners import partner_index, suggest_partners
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        seed(args.users, args.venues, args.routes, args.styles, args.ascents_per_user)
+        print(f'{app.config["SQLALCHEMY_DATABASE_URI"]}: seeded {args.users} climbers in {time.perf_counter() - started:.1f}s')
+
+        started = time.perf_counter()
+        index = partner_index()
+        megabytes = sum(array.nbytes for array in
+            (index.user_ids, index.has_gear, index.style_bits, index.grades,
+             index.venue_rows, index.venue_offsets, index.row_venues, index.row_offsets)) / 2**20
+        print(f'built index of {len(index)} climbers in {time.perf_counter() - started:.2f}s ({megabytes:.1f} MB)')
+
+        rng = random.Random(1)
+        for label, style_id in [('top-k', None), ('top-k, one style', 1)]:
+            timings = []
+            for user_id in rng.sample(range(1, args.users + 1), min(args.lookups, args.users)):
+                start = time.perf_counter()
+                suggest_partners(user_id, args.top, style_id)
+                timings.append((time.perf_counter() - start) * 1000)
+            print(f'{label:18} median {statistics.median(timings):6.2f} ms   max {max(timings):6.2f} ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Time the route recommendation batch job, an incremental refresh and the page reads.
+
+    python -m benchmarks.recommendations --users 50000 --routes 20000 --ascents-per-user 30
+
+Seeds climbers, routes, rated ascents and project lists in bulk, then times
+`rebuild_recommendations`, a refresh after a handful of new ascents, and the
+queries the route and profile pages run. Uses DATABASE_URL when it is set,
+otherwise a throwaway SQLite file.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+CHUNK = 10000
+
+def seed(users, venues, routes, ascents_per_user):
+    from climbunity_app.extensions import db
+    from climbunity_app.models import Ascent, Route, User, Venue, project_lists_table
+    rng = random.Random(15)
+    db.session.bulk_insert_mappings(Venue, [dict(name=f'Gym {n}', address='1 Benchmark Way') for n in range(venues)])
+    db.session.execute(Route.__table__.insert(), [
+        dict(id=id, venue_id=rng.randint(1, venues), name=f'Route {id}', grade='V4') for id in range(1, routes + 1)
+    ])
+    db.session.commit()
+    # popular routes get climbed a lot more than the rest
+    weights = [1 / rank for rank in range(1, routes + 1)]
+    for start in range(0, users, CHUNK):
+        ids = range(start + 1, min(start + CHUNK, users) + 1)
+        db.session.execute(User.__table__.insert(), [dict(
+            id=id, username=f'climber{id}', password='x', email=f'climber{id}@example.com',
+            first_name='Bench', last_name='Mark', address='1 Benchmark Way', has_gear=True,
+        ) for id in ids])
+        climbed = {id: set(rng.choices(range(1, routes + 1), weights, k=rng.randint(1, ascents_per_user))) for id in ids}
+        db.session.execute(Ascent.__table__.insert(), [
+            dict(user_id=id, route_id=route_id, send_rating=rng.choice([None, 2, 3, 4, 5]))
+            for id in ids for route_id in climbed[id]
+        ])
+        db.session.execute(project_lists_table.insert(), [
+            dict(user_id=id, route_id=rng.randint(1, routes)) for id in ids if rng.random() < 0.3
+        ])
+        db.session.commit()
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), max(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--venues', type=int, default=100)
+    parser.add_argument('--routes', type=int, default=10000)
+    parser.add_argument('--ascents-per-user', type=int, default=30)
+    parser.add_argument('--new-ascents', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    if not os.getenv('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = f'sqlite:///{tempfile.mkdtemp()}/recommendations.db'
+
+    from climbunity_app import create_app
+    from climbunity_app.extensions import db
+    from climbunity_app.models import Ascent
+    from climbunity_app.recommendations import (queue_recommendation_refresh, rebuild_recommendations,
+        recommended_routes, refresh_recommendations, similar_routes)
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        seed(args.users, args.venues, args.routes, args.ascents_per_user)
+        db.session.execute('ANALYZE')
+        db.session.commit()
+        print(f'{app.config["SQLALCHEMY_DATABASE_URI"]}: seeded {Ascent.query.count()} ascents in {time.perf_counter() - started:.1f}s')
+
+        started = time.perf_counter()
+        routes = rebuild_recommendations()
+        print(f'rebuild: {routes} routes in {time.perf_counter() - started:.1f}s')
+
+        rng = random.Random(1)
+        for _ in range(args.new_ascents):
+            ascent = Ascent(user_id=rng.randint(1, args.users), route_id=rng.randint(1, args.routes), send_rating=5)
+            db.session.add(ascent)
+            db.session.flush()
+            queue_recommendation_refresh(ascent.route_id)
+        db.session.commit()
+        started = time.perf_counter()
+        routes = refresh_recommendations()
+        print(f'refresh after {args.new_ascents} ascents: {routes} routes in {time.perf_counter() - started:.1f}s')
+
+        limit = app.config['RECOMMENDATIONS_SHOWN']
+        route_page = timed(lambda: similar_routes(rng.randint(1, args.routes), limit), args.repeat)
+        profile = timed(lambda: recommended_routes(rng.randint(1, args.users), limit), args.repeat)
+        print(f'route page read:   median {route_page[0]:6.1f} ms   max {route_page[1]:6.1f} ms')
+        print(f'profile page read: median {profile[0]:6.1f} ms   max {profile[1]:6.1f} ms')
+
+if __name__ == '__main__':
+    main()
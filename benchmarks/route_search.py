@@ -0,0 +1,106 @@
+"""Time route search and facet queries over a large seeded catalogue.
+
+    python -m benchmarks.route_search --routes 500000 --tags-per-route 3
+
+Seeds venues, styles, tags and routes (with stats and tag/style associations)
+in bulk, then runs a mix of searches and prints the median and worst time of
+each. Uses DATABASE_URL when it is set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+
+GRADES = ['V0', 'V1', 'V2', 'V3', 'V4', 'V5', 'V6', 'V7', '5.9', '5.10a', '5.10c', '5.11a', '5.11d', '5.12b']
+CHUNK = 10000
+
+def seed(routes, venues, tags, styles, tags_per_route):
+    from climbunity_app.extensions import db
+    from climbunity_app.grades import parse_grade
+    from climbunity_app.models import Route, RouteStats, Style, Tag, Venue, route_styles_table, route_tags_table
+    rng = random.Random(12)
+    db.session.bulk_insert_mappings(Venue, [dict(name=f'Gym {n}', address='1 Benchmark Way') for n in range(venues)])
+    db.session.bulk_insert_mappings(Tag, [dict(tag=f'tag{n}') for n in range(tags)])
+    db.session.bulk_insert_mappings(Style, [dict(style=f'style{n}') for n in range(styles)])
+    db.session.commit()
+    first_set_date = date(2020, 1, 1)
+    parsed = {grade: parse_grade(grade) for grade in GRADES}
+    for start in range(0, routes, CHUNK):
+        ids = range(start + 1, min(start + CHUNK, routes) + 1)
+        grades = [rng.choice(GRADES) for _ in ids]
+        db.session.execute(Route.__table__.insert(), [dict(
+            id=id, venue_id=rng.randint(1, venues), name=f'Route {id}', grade=grade,
+            grade_scale=parsed[grade].scale, grade_difficulty=parsed[grade].difficulty,
+            route_set_date=first_set_date + timedelta(days=rng.randint(0, 1500)),
+        ) for id, grade in zip(ids, grades)])
+        db.session.execute(RouteStats.__table__.insert(), [dict(
+            route_id=id, ascent_count=rng.randint(0, 40), rating_average=round(rng.uniform(0, 5), 2),
+        ) for id in ids])
+        db.session.execute(route_tags_table.insert(), [
+            dict(route_id=id, tag_id=tag_id)
+            for id in ids for tag_id in rng.sample(range(1, tags + 1), tags_per_route)
+        ])
+        db.session.execute(route_styles_table.insert(), [
+            dict(route_id=id, style_id=rng.randint(1, styles)) for id in ids
+        ])
+        db.session.commit()
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), max(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--routes', type=int, default=100000)
+    parser.add_argument('--venues', type=int, default=200)
+    parser.add_argument('--tags', type=int, default=30)
+    parser.add_argument('--styles', type=int, default=6)
+    parser.add_argument('--tags-per-route', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if not os.getenv('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = f'sqlite:///{tempfile.mkdtemp()}/route_search.db'
+
+    from climbunity_app import create_app
+    from climbunity_app.extensions import db
+    from climbunity_app.search import search_routes, search_facets
+
+    app = create_app()
+    app.config['ROUTE_FACETS_CACHE_SECONDS'] = 0 # time the counting queries, not the cache
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        seed(args.routes, args.venues, args.tags, args.styles, args.tags_per_route)
+        db.session.execute('ANALYZE')
+        db.session.commit()
+        print(f'{app.config["SQLALCHEMY_DATABASE_URI"]}: seeded {args.routes} routes in {time.perf_counter() - started:.1f}s')
+
+        empty = dict(venue_id=None, style_ids=[], tag_ids=[], grades=[],
+            grade_scale=None, min_difficulty=None, max_difficulty=None)
+        cases = [
+            ('everything, by rating', dict(empty), 'rating'),
+            ('everything, newest', dict(empty), 'newest'),
+            ('one venue', dict(empty, venue_id=7), 'rating'),
+            ('one tag', dict(empty, tag_ids=[3]), 'rating'),
+            ('two tags (all of)', dict(empty, tag_ids=[3, 5]), 'rating'),
+            ('styles (any of) + grades', dict(empty, style_ids=[1, 2], grades=['V4', 'V5']), 'newest'),
+            ('venue + tag + grade', dict(empty, venue_id=7, tag_ids=[3], grades=['V4']), 'rating'),
+            ('boulders V3-V5, hardest', dict(empty, grade_scale='boulder', min_difficulty=3, max_difficulty=5), 'hardest'),
+            ('sport 5.11+, by rating', dict(empty, grade_scale='sport', min_difficulty=11), 'rating'),
+        ]
+        print(f'{"":28} {"page median":>12} {"page max":>9} {"facets median":>14} {"facets max":>11}')
+        for label, filters, sort in cases:
+            page = timed(lambda: search_routes(filters, sort, limit=20), args.repeat)
+            facets = timed(lambda: search_facets(filters), args.repeat)
+            print(f'{label:28} {page[0]:9.1f} ms {page[1]:6.1f} ms {facets[0]:11.1f} ms {facets[1]:8.1f} ms')
+
+if __name__ == '__main__':
+    main()
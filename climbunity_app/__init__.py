@@ -0,0 +1,47 @@
+"""Climbunity, built with `create_app()`.
+
+Importing the package (or climbunity_app.extensions) only creates unbound
+extensions: no app, no models, no database connection. `create_app` binds them
+to a new app and registers the blueprints, still without a round trip to the
+database; the schema is created by `flask create-db`, not at startup.
+"""
+from flask import Flask
+from climbunity_app.config import Config
+
+def create_app(config=None):
+    """A new Climbunity app, with Config overridden by `config` (a mapping or a settings object)."""
+    from climbunity_app.extensions import bcrypt, db, login_manager
+    from climbunity_app.cache import page_cache
+    from climbunity_app.fragments import fragment_cache
+    from climbunity_app.metrics import init_request_metrics
+    from climbunity_app.querystats import init_query_stats
+    from climbunity_app.replicas import init_replicas
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+
+    db.init_app(app)
+    login_manager.init_app(app)
+    bcrypt.init_app(app)
+    init_query_stats(app)
+    init_request_metrics(app)
+    page_cache.init_app(app)
+    fragment_cache.init_app(app)
+    init_replicas(app)
+
+    # the views (and the models they import) load with the first app, not with the package
+    from climbunity_app.main.routes import main
+    from climbunity_app.auth.routes import auth
+    from climbunity_app.ops.routes import ops
+    from climbunity_app.api.routes import api
+    from climbunity_app.commands import commands
+    app.register_blueprint(main)
+    app.register_blueprint(auth)
+    app.register_blueprint(ops)
+    app.register_blueprint(api)
+    app.register_blueprint(commands)
+    return app
@@ -0,0 +1,87 @@
+from flask import Blueprint, request, jsonify
+from flask_login import login_required, current_user
+from sqlalchemy import func
+from climbunity_app.extensions import db
+from climbunity_app.models import User, Venue
+from climbunity_app.pagination import encode_cursor, decode_cursor, seek
+from climbunity_app.partners import partner_suggestions
+from climbunity_app.search import search_args, search_routes, search_facets
+
+api = Blueprint("api", __name__, url_prefix='/api')
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+def requested_limit():
+    """`?limit=`, clamped to 1..MAX_LIMIT."""
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+    return max(1, min(limit or DEFAULT_LIMIT, MAX_LIMIT))
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def prefix_search(model, column):
+    """One page of `model` rows whose `column` starts with `?q=`, case-insensitively.
+
+    Filters and sorts on lower(column), which the model indexes, and pages with
+    a keyset cursor on (lower(column), id). Returns the JSON response.
+    """
+    key = func.lower(column)
+    query = db.session.query(model.id, column.label('label'), key.label('sort_key')) \
+        .order_by(key, model.id)
+    prefix = request.args.get('q', '').strip().lower()
+    if prefix:
+        query = query.filter(key.like(escape_like(prefix) + '%', escape='\\'))
+    cursor = decode_cursor(request.args.get('cursor'), str, int)
+    rows, has_more = seek(query, [key, model.id], cursor, requested_limit())
+    return jsonify(
+        results=[{'id': row.id, 'label': row.label} for row in rows],
+        next_cursor=encode_cursor(rows[-1].sort_key, rows[-1].id) if has_more else None,
+    )
+
+@api.route('/users/search')
+@login_required
+def search_users():
+    return prefix_search(User, User.username)
+
+@api.route('/venues/search')
+def search_venues():
+    return prefix_search(Venue, Venue.name)
+
+@api.route('/partners')
+@login_required
+def suggested_partners():
+    """The current user's best partner matches, optionally only climbers of `?style=`."""
+    suggestions = partner_suggestions(current_user.id, requested_limit(), request.args.get('style', type=int))
+    return jsonify(results=[{
+        'id': user.id,
+        'username': user.username,
+        'has_gear': user.has_gear,
+        'score': round(score, 3),
+        'shared_styles': shared_styles,
+        'shared_venues': shared_venues,
+    } for user, score, shared_styles, shared_venues in suggestions])
+
+@api.route('/routes/search')
+def search_route_list():
+    """Route search as JSON; the first page (no cursor) also carries facet counts."""
+    filters, sort = search_args(request.args)
+    cursor = request.args.get('cursor')
+    rows, next_cursor = search_routes(filters, sort, cursor, requested_limit())
+    results = [{
+        'id': row.Route.id,
+        'name': row.Route.name,
+        'grade': row.Route.grade,
+        'venue_id': row.Route.venue_id,
+        'venue_name': row.venue_name,
+        'route_set_date': row.Route.route_set_date.isoformat() if row.Route.route_set_date else None,
+        'rating': round(row.rating_average, 1),
+        'ascent_count': row.ascent_count,
+    } for row in rows]
+    body = {'results': results, 'next_cursor': next_cursor}
+    if not cursor:
+        body['facets'] = {
+            name: [dict(row._asdict()) for row in counts]
+            for name, counts in search_facets(filters).items()
+        }
+    return jsonify(body)
@@ -0,0 +1,336 @@
+import unittest
+from datetime import date, datetime
+
+from climbunity_app import create_app
+from climbunity_app.extensions import db, bcrypt
+from climbunity_app.cache import page_cache
+from climbunity_app.fragments import fragment_cache
+from climbunity_app.lookups import reset_lookups
+import numpy as np
+from climbunity_app.models import User, Venue, Route, RouteStats, Style, Tag, Ascent, SendType, Appointment
+from climbunity_app.testing import assert_max_queries
+from climbunity_app import search, partners
+
+"""
+Run these tests with the command:
+python3 -m unittest discover
+"""
+
+#################################################
+# Setup
+#################################################
+
+app = create_app()
+
+def login(client, username, password):
+    return client.post('/login', data=dict(
+        username=username,
+        password=password
+    ), follow_redirects=True)
+
+def create_users(*usernames):
+    password_hash = bcrypt.generate_password_hash('password123', 4).decode('utf-8')
+    for username in usernames:
+        db.session.add(User(
+            username=username,
+            password=password_hash,
+            email=f'{username}@test.com',
+            first_name='Test',
+            last_name='User',
+            address='123 Test. St',
+            has_gear=True
+        ))
+    db.session.commit()
+
+def create_venues(*names):
+    for name in names:
+        db.session.add(Venue(name=name, address='123 Crag Rd'))
+    db.session.commit()
+
+def create_route(venue_id, name, grade, rating=0, set_date=None, styles=(), tags=()):
+    route = Route(venue_id=venue_id, name=name, grade=grade, route_set_date=set_date,
+        stats=RouteStats(rating_average=rating, ascent_count=1 if rating else 0))
+    route.possible_route_styles.extend(styles)
+    route.route_tags.extend(tags)
+    db.session.add(route)
+    db.session.commit()
+    return route
+
+def create_search_fixture():
+    create_venues('Mesa Rim', 'Rock Oasis')
+    crimpy, slab = Tag(tag='crimpy'), Tag(tag='slab')
+    boulder, sport = Style(style='boulder'), Style(style='sport')
+    db.session.add_all([crimpy, slab, boulder, sport])
+    db.session.commit()
+    create_route(1, 'Crimp Slab', 'V4', 4.5, date(2023, 5, 1), [boulder], [crimpy, slab])
+    create_route(1, 'Just Crimps', 'V4', 3.0, date(2023, 6, 1), [boulder], [crimpy])
+    create_route(1, 'Slab Sport', '5.10a', 2.0, None, [sport], [slab])
+    create_route(2, 'Elsewhere', 'V5', 5.0, date(2023, 1, 1), [boulder], [crimpy, slab])
+    return crimpy.id, slab.id, boulder.id, sport.id
+
+def create_partner_fixture():
+    """me1 climbs V4s at Mesa Rim without gear; alex is the obvious match, bob boulders elsewhere, carl only does sport."""
+    create_users('me1', 'alex', 'bob', 'carl')
+    create_venues('Mesa Rim', 'Rock Oasis')
+    boulder, sport = Style(style='boulder'), Style(style='sport')
+    db.session.add_all([boulder, sport])
+    db.session.commit()
+    users = {user.username: user for user in User.query}
+    users['me1'].has_gear = False
+    users['bob'].has_gear = False
+    for username in ['me1', 'alex', 'bob']:
+        users[username].user_does_styles.append(boulder)
+    users['carl'].user_does_styles.append(sport)
+    db.session.commit()
+    mesa_v4 = create_route(1, 'Mesa V4', 'V4').id
+    oasis_v9 = create_route(2, 'Oasis V9', 'V9').id
+    mesa_sport = create_route(1, 'Mesa Sport', '5.12a').id
+    for username, route_id in [('me1', mesa_v4), ('alex', mesa_v4), ('bob', oasis_v9), ('carl', mesa_sport)]:
+        db.session.add(Ascent(user_id=users[username].id, route_id=route_id, send_type=SendType.FLASH))
+    db.session.commit()
+    return boulder.id, sport.id
+
+def route_names(response):
+    return [result['name'] for result in response.get_json()['results']]
+
+#################################################
+# Tests
+#################################################
+
+class ApiTests(unittest.TestCase):
+    """Tests for the typeahead search endpoints and the fields that use them."""
+
+    def setUp(self):
+        """Executed prior to each test."""
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        app.config['BCRYPT_LOG_ROUNDS'] = 4
+        self.app = app.test_client()
+        self.context = app.app_context()
+        self.context.push()
+        search._facet_cache.clear()
+        partners._index['current'] = None
+        db.drop_all()
+        db.create_all()
+        page_cache.clear()
+        fragment_cache.clear()
+        reset_lookups()
+
+    def tearDown(self):
+        app.config['BCRYPT_LOG_ROUNDS'] = 12
+        self.context.pop()
+
+    def test_venue_search_prefix_is_case_insensitive(self):
+        create_venues('Bouldering Project', 'boulder barn', 'Mesa Rim', 'The Boulder Field')
+        response = self.app.get('/api/venues/search?q=BOULD')
+        self.assertEqual(response.status_code, 200)
+        labels = [result['label'] for result in response.get_json()['results']]
+        self.assertEqual(labels, ['boulder barn', 'Bouldering Project'])
+
+    def test_venue_search_pages_with_cursor(self):
+        create_venues(*[f'Crag {number:02d}' for number in range(7)])
+        seen = []
+        cursor = None
+        while True:
+            url = '/api/venues/search?q=crag&limit=3' + (f'&cursor={cursor}' if cursor else '')
+            page = self.app.get(url).get_json()
+            self.assertLessEqual(len(page['results']), 3)
+            seen.extend(result['label'] for result in page['results'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, [f'Crag {number:02d}' for number in range(7)])
+
+    def test_search_treats_like_wildcards_literally(self):
+        create_venues('100% Rock', '100 Walls')
+        labels = [result['label'] for result in self.app.get('/api/venues/search?q=100%25').get_json()['results']]
+        self.assertEqual(labels, ['100% Rock'])
+
+    def test_search_limit_is_capped(self):
+        create_venues(*[f'Gym {number:03d}' for number in range(60)])
+        page = self.app.get('/api/venues/search?limit=1000').get_json()
+        self.assertEqual(len(page['results']), 50)
+        self.assertIsNotNone(page['next_cursor'])
+
+    def test_user_search_requires_login(self):
+        create_users('me1', 'alex', 'alice')
+        response = self.app.get('/api/users/search?q=al')
+        self.assertEqual(response.status_code, 302)
+        login(self.app, 'me1', 'password123')
+        with assert_max_queries(self, 2):
+            response = self.app.get('/api/users/search?q=al')
+        labels = [result['label'] for result in response.get_json()['results']]
+        self.assertEqual(labels, ['alex', 'alice'])
+
+    def test_route_form_does_not_render_every_user(self):
+        create_users('me1', *[f'climber{number}' for number in range(30)])
+        create_venues('Mesa Rim')
+        login(self.app, 'me1', 'password123')
+        response = self.app.get('/new_route')
+        response_text = response.get_data(as_text=True)
+        self.assertIn('data-search-url="/api/users/search"', response_text)
+        self.assertNotIn('climber7', response_text)
+
+    def test_route_form_validates_submitted_ids(self):
+        create_users('me1')
+        create_venues('Mesa Rim')
+        login(self.app, 'me1', 'password123')
+        post_data = {
+            'venue_id': 99,
+            'setter_id': 1,
+            'name': "Sleepwalker",
+            'grade': "V16",
+        }
+        response = self.app.post('/new_route', data=post_data)
+        self.assertIn('Not a valid choice', response.get_data(as_text=True))
+        self.assertEqual(Route.query.count(), 0)
+
+        post_data['venue_id'] = 1
+        self.app.post('/new_route', data=post_data)
+        route = Route.query.one()
+        self.assertEqual((route.venue_id, route.setter_id), (1, 1))
+
+    def test_appointment_guests_checked_with_one_query(self):
+        create_users('me1', 'alex', 'alice', 'bob')
+        create_venues('Mesa Rim')
+        login(self.app, 'me1', 'password123')
+        with app.test_request_context('/new_appointment', method='POST',
+                data={'additional_guests': ['2', '3', '4', '3']}):
+            from climbunity_app.main.forms import AppointmentForm
+            form = AppointmentForm()
+            with assert_max_queries(self, 1):
+                form.additional_guests.validate(form)
+            self.assertEqual([user.username for user in form.additional_guests.data], ['alex', 'alice', 'bob'])
+
+        with app.test_request_context('/new_appointment', method='POST',
+                data={'additional_guests': ['2', '42']}):
+            form = AppointmentForm()
+            self.assertFalse(form.additional_guests.validate(form))
+
+    def test_route_search_filters(self):
+        crimpy, slab, boulder, sport = create_search_fixture()
+        self.assertEqual(route_names(self.app.get('/api/routes/search')),
+            ['Elsewhere', 'Crimp Slab', 'Just Crimps', 'Slab Sport'])
+        self.assertEqual(route_names(self.app.get('/api/routes/search?venue=1')),
+            ['Crimp Slab', 'Just Crimps', 'Slab Sport'])
+        # tags are all-of
+        self.assertEqual(route_names(self.app.get(f'/api/routes/search?venue=1&tag={crimpy}&tag={slab}')),
+            ['Crimp Slab'])
+        # styles are any-of
+        self.assertEqual(route_names(self.app.get(f'/api/routes/search?venue=1&style={boulder}&style={sport}')),
+            ['Crimp Slab', 'Just Crimps', 'Slab Sport'])
+        self.assertEqual(route_names(self.app.get('/api/routes/search?grade=V4,V5&sort=newest')),
+            ['Just Crimps', 'Crimp Slab', 'Elsewhere'])
+
+    def test_route_search_pages_with_cursor(self):
+        create_search_fixture()
+        for sort in ['rating', 'newest']:
+            names, cursor = [], None
+            while True:
+                url = f'/api/routes/search?sort={sort}&limit=1' + (f'&cursor={cursor}' if cursor else '')
+                page = self.app.get(url).get_json()
+                names.extend(result['name'] for result in page['results'])
+                cursor = page['next_cursor']
+                if not cursor:
+                    break
+            self.assertEqual(names, route_names(self.app.get(f'/api/routes/search?sort={sort}')))
+            self.assertEqual(len(names), 4)
+
+    def test_route_search_facets(self):
+        crimpy, slab, boulder, sport = create_search_fixture()
+        facets = self.app.get('/api/routes/search?venue=1').get_json()['facets']
+        self.assertEqual([(tag['label'], tag['count']) for tag in facets['tags']], [('crimpy', 2), ('slab', 2)])
+        self.assertEqual([(style['label'], style['count']) for style in facets['styles']], [('boulder', 2), ('sport', 1)])
+        self.assertEqual([(grade['label'], grade['count']) for grade in facets['grades']], [('V4', 2), ('5.10a', 1)])
+        page = self.app.get('/api/routes/search?venue=1&cursor=' + self.app.get('/api/routes/search?limit=1').get_json()['next_cursor'])
+        self.assertNotIn('facets', page.get_json())
+
+    def test_route_search_page(self):
+        crimpy, slab, boulder, sport = create_search_fixture()
+        with assert_max_queries(self, 8):
+            response = self.app.get(f'/routes/search?venue=1&tag={crimpy}')
+        self.assertEqual(response.status_code, 200)
+        response_text = response.get_data(as_text=True)
+        self.assertIn('Crimp Slab', response_text)
+        self.assertIn('Just Crimps', response_text)
+        self.assertNotIn('Elsewhere', response_text)
+        self.assertIn(f'tag={crimpy}&amp;tag={slab}', response_text)
+
+    def test_route_search_by_grade_range(self):
+        create_search_fixture()
+        create_route(1, 'Font Problem', 'f7A', 1.0)
+        create_route(1, 'Sandbag', 'hard', 1.0)
+        # a French bound picks the sport scale, in any grading system
+        self.assertEqual(route_names(self.app.get('/api/routes/search?min_grade=6a&max_grade=5.11a')),
+            ['Slab Sport'])
+        self.assertEqual(route_names(self.app.get('/api/routes/search?min_grade=V4&sort=hardest')),
+            ['Font Problem', 'Elsewhere', 'Just Crimps', 'Crimp Slab'])
+        self.assertEqual(route_names(self.app.get('/api/routes/search?scale=boulder&max_grade=V5&sort=easiest')),
+            ['Crimp Slab', 'Just Crimps', 'Elsewhere'])
+        # difficulty sorts page on (grade_difficulty, id) and skip unparsed grades
+        names, cursor = [], None
+        while True:
+            page = self.app.get('/api/routes/search?sort=easiest&limit=2' + (f'&cursor={cursor}' if cursor else '')).get_json()
+            names.extend(result['name'] for result in page['results'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(names, ['Crimp Slab', 'Just Crimps', 'Elsewhere', 'Font Problem', 'Slab Sport'])
+
+    def test_popcount(self):
+        words = np.array([[0, 1], [2**64 - 1, 0b1011]], dtype=np.uint64)
+        self.assertEqual(partners.popcount(words).tolist(), [1, 67])
+
+    def test_partner_suggestions_rank_by_overlap(self):
+        boulder, sport = create_partner_fixture()
+        me1 = User.query.filter_by(username='me1').one().id
+        with app.app_context():
+            suggestions = partners.suggest_partners(me1, limit=3)
+            # only climbers of a style
+            sport_climbers = partners.suggest_partners(me1, style_id=sport)
+        usernames = [User.query.get(user_id).username for user_id, *_ in suggestions]
+        self.assertEqual(usernames, ['alex', 'bob', 'carl'])
+        alex = suggestions[0]
+        self.assertEqual(alex[2:], (1, 1)) # one shared style, one shared venue
+        self.assertLessEqual(alex[1], 1)
+        self.assertEqual([user_id for user_id, *_ in sport_climbers], [User.query.filter_by(username='carl').one().id])
+
+    def test_partner_venues_include_appointments(self):
+        create_partner_fixture()
+        users = {user.username: user for user in User.query}
+        appointment = Appointment(created_by=users['bob'].id, venue_id=1, appointment_datetime=datetime(2023, 5, 1, 18))
+        appointment.appointment_attendants.append(users['bob'])
+        db.session.add(appointment)
+        db.session.commit()
+        me1, bob = users['me1'].id, users['bob'].id
+        with app.app_context():
+            suggestions = {user_id: shared_venues for user_id, _, _, shared_venues in partners.suggest_partners(me1)}
+        self.assertEqual(suggestions[bob], 1)
+
+    def test_partner_index_is_reused(self):
+        create_partner_fixture()
+        me1 = User.query.filter_by(username='me1').one().id
+        with app.app_context():
+            partners.suggest_partners(me1)
+            with assert_max_queries(self, 0):
+                partners.suggest_partners(me1)
+            self.assertEqual(partners.suggest_partners(12345), [])
+
+    def test_partners_api_and_profile(self):
+        create_partner_fixture()
+        self.assertEqual(self.app.get('/api/partners').status_code, 302)
+        login(self.app, 'me1', 'password123')
+        results = self.app.get('/api/partners?limit=2').get_json()['results']
+        self.assertEqual([result['username'] for result in results], ['alex', 'bob'])
+        self.assertEqual(results[0]['shared_venues'], 1)
+        for style in ('-1', '-100', '1000'): # ids that aren't styles, negative ones included
+            response = self.app.get(f'/api/partners?style={style}')
+            self.assertEqual((response.status_code, response.get_json()['results']), (200, []))
+        response_text = self.app.get('/profile/1').get_data(as_text=True)
+        self.assertIn('Suggested Climbing Partners', response_text)
+        self.assertIn('<a href="/profile/2">alex</a>', response_text)
+        self.assertNotIn('Suggested Climbing Partners', self.app.get('/profile/2').get_data(as_text=True))
+        # the edit page renders the same profile, suggestions included
+        self.assertIn('<a href="/profile/2">alex</a>', self.app.get('/edit_profile/1').get_data(as_text=True))
@@ -0,0 +1,88 @@
+"""Set semantics for the many-to-many association tables.
+
+Every association table has a composite primary key, so a pair can only be
+linked once. Appending to a relationship collection doesn't know that and
+would insert the pair again, so the views change links through these
+helpers instead: each reads the ids currently linked with one query on the
+association table and issues only the INSERTs and DELETEs for the difference.
+
+Databases created before the primary keys existed may hold duplicate (or
+half-NULL) rows; `flask dedupe-associations` rebuilds those tables with their
+primary keys, keeping one row per pair.
+"""
+from sqlalchemy import and_, inspect, select
+from climbunity_app.extensions import db
+from climbunity_app.models import (appointment_guest_lists, project_lists_table, route_styles_table,
+    route_tags_table, user_styles_table)
+
+ASSOCIATION_TABLES = [user_styles_table, project_lists_table, route_styles_table, route_tags_table,
+    appointment_guest_lists]
+INSERT_CHUNK = 10000
+
+def _link_columns(instance, name):
+    """(relationship, owner id, owner column, target key, target column) for `instance.<name>`."""
+    relationship = inspect(instance).mapper.relationships[name]
+    (owner_key, owner_column), = relationship.synchronize_pairs
+    (target_key, target_column), = relationship.secondary_synchronize_pairs
+    return relationship, getattr(instance, owner_key.key), owner_column, target_key, target_column
+
+def _change_links(instance, name, targets, remove_others):
+    relationship, owner_id, owner_column, target_key, target_column = _link_columns(instance, name)
+    targets = {getattr(target, target_key.key): target for target in targets}
+    table = relationship.secondary
+    linked = {target_id for target_id, in db.session.query(target_column).filter(owner_column == owner_id)}
+    added = sorted(set(targets) - linked)
+    removed = sorted(linked - set(targets)) if remove_others else []
+    if removed:
+        db.session.execute(table.delete().where(and_(owner_column == owner_id, target_column.in_(removed))))
+    if added:
+        db.session.execute(table.insert(), [{owner_column.key: owner_id, target_column.key: target_id}
+            for target_id in added])
+    # the collections on both sides no longer match the table
+    db.session.expire(instance, [name])
+    if relationship.back_populates:
+        for target_id in added:
+            if targets[target_id] in db.session:
+                db.session.expire(targets[target_id], [relationship.back_populates])
+    return added, removed
+
+def sync_links(instance, name, targets):
+    """Make the many-to-many `instance.<name>` hold exactly `targets` (caller commits).
+
+    Returns the `(added, removed)` target ids.
+    """
+    return _change_links(instance, name, targets, remove_others=True)
+
+def add_links(instance, name, targets):
+    """Link `targets` to `instance.<name>`, skipping any already linked (caller commits).
+
+    Returns the target ids that were added.
+    """
+    return _change_links(instance, name, targets, remove_others=False)[0]
+
+def dedupe_associations():
+    """Rebuild association tables created without a primary key, one row per pair.
+
+    Rows missing either id are dropped too. Returns `(table name, rows before,
+    rows after)` for each table rebuilt; tables that already have their primary
+    key can't hold duplicates and are left alone.
+    """
+    connection = db.session.connection()
+    inspector = inspect(connection)
+    existing = set(inspector.get_table_names())
+    rebuilt = []
+    for table in ASSOCIATION_TABLES:
+        if table.name not in existing or inspector.get_pk_constraint(table.name)['constrained_columns']:
+            continue
+        columns = list(table.columns)
+        before = connection.execute(select([db.func.count()]).select_from(table)).scalar()
+        rows = connection.execute(select(columns).distinct()
+            .where(and_(*[column != None for column in columns]))).fetchall()
+        table.drop(connection)
+        table.create(connection)
+        for start in range(0, len(rows), INSERT_CHUNK):
+            connection.execute(table.insert(), [dict(zip([column.key for column in columns], row))
+                for row in rows[start:start + INSERT_CHUNK]])
+        rebuilt.append((table.name, before, len(rows)))
+    db.session.commit()
+    return rebuilt
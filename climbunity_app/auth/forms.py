@@ -4,7 +4,9 @@ from wtforms.ext.sqlalchemy.fields import QuerySelectField, QuerySelectMultipleF
 from wtforms.validators import DataRequired, Length, URL, ValidationError, email_validator, email
 from climbunity_app.utils import FormEnum
 from climbunity_app.models import *
-from climbunity_app.extensions import app, db, bcrypt
+from climbunity_app.extensions import db, bcrypt
+from climbunity_app.hashing import password_hasher
+from climbunity_app.fields import LookupSelectMultipleField
 from wtforms.fields.html5 import DateField
 
 class SignUpForm(FlaskForm):
@@ -39,9 +41,7 @@ class SignUpForm(FlaskForm):
             Length(max=200, message="Maximum name length is 50 characters.")
         ]
     )
-    climber_styles = QuerySelectMultipleField('Select your climbing styles',
-        query_factory=lambda: Style.query
-    )
+    climber_styles = LookupSelectMultipleField('Select your climbing styles', lookup='style')
     has_gear = BooleanField('Have your own gear?', default="unchecked")
     submit = SubmitField('Sign Up')
     edit = SubmitField('Edit Profile')
@@ -72,9 +72,7 @@ class EditProfileForm(FlaskForm):
             DataRequired("You must enter your address."),
             Length(max=200, message="Maximum name length is 50 characters.")
         ])
-    climber_styles = QuerySelectMultipleField('Select your climbing styles',
-        query_factory=lambda: Style.query
-    )
+    climber_styles = LookupSelectMultipleField('Select your climbing styles', lookup='style')
     has_gear = BooleanField('Have your own gear?', default="unchecked")
     edit = SubmitField('Edit Profile')
 
@@ -83,14 +81,14 @@ class LoginForm(FlaskForm):
         validators=[DataRequired(), Length(min=3, max=50)])
     password = PasswordField('Password', validators=[DataRequired()])
     submit = SubmitField('Log In')
+    user = None # looked up once by validate_username, reused by the password check and the view
 
     def validate_username(self, username):
-        user = User.query.filter_by(username=username.data).first()
-        if not user:
+        self.user = User.query.filter_by(username=username.data).first()
+        if not self.user:
             raise ValidationError('No user with that username. Please try again.')
 
     def validate_password(self, password):
-        user = User.query.filter_by(username=self.username.data).first()
-        if user and not bcrypt.check_password_hash(
-                user.password, password.data):
+        # may raise HashingBusy, which the login view turns into a 503
+        if self.user and not password_hasher.check(self.user.password, password.data):
             raise ValidationError('Password doesn\'t match. Please try again.')
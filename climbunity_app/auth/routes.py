@@ -7,7 +7,9 @@ from climbunity_app.utils import FormEnum
 from climbunity_app.models import *
 from climbunity_app.auth.forms import *
 
-from climbunity_app.extensions import app, db, bcrypt
+from climbunity_app.extensions import db, bcrypt
+from climbunity_app.hashing import password_hasher, HashingBusy
+from climbunity_app.cache import invalidate_pages
 
 auth = Blueprint("auth", __name__)
 
@@ -19,7 +21,11 @@ auth = Blueprint("auth", __name__)
 def signup():
     form = SignUpForm()
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        try:
+            hashed_password = password_hasher.generate(form.password.data)
+        except HashingBusy:
+            flash('We\'re handling a lot of sign ups right now, please try again in a moment.')
+            return render_template('signup.html', form=form), 503
         user = User(
             username=form.username.data,
             password=hashed_password,
@@ -35,6 +41,7 @@ def signup():
         for style in form.climber_styles.data:
             user.user_does_styles.append(style)
         db.session.commit()
+        invalidate_pages('users')
         flash('Account Created.')
         login_user(user, remember=True)
         next_page = request.args.get('next')
@@ -45,8 +52,20 @@ def signup():
 @auth.route('/login', methods=['GET', 'POST'])
 def login():
     form = LoginForm()
-    if form.validate_on_submit():
-        user = User.query.filter_by(username=form.username.data).first()
+    try:
+        validated = form.validate_on_submit()
+    except HashingBusy:
+        flash('We\'re handling a lot of logins right now, please try again in a moment.')
+        return render_template('login.html', form=form), 503
+    if validated:
+        user = form.user
+        if password_hasher.needs_rehash(user.password):
+            # cost factor changed since this hash was made, upgrade it while we have the password
+            try:
+                user.password = password_hasher.generate(form.password.data)
+                db.session.commit()
+            except HashingBusy:
+                pass # the old hash still works, upgrade on a later login
         login_user(user, remember=True)
         next_page = request.args.get('next')
         return redirect(next_page if next_page else url_for('main.homepage'))
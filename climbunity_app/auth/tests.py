@@ -1,10 +1,15 @@
 import os
 from unittest import TestCase
 # import unittest
-import app
 from datetime import date
  
-from climbunity_app.extensions import app, db, bcrypt
+from climbunity_app import create_app
+from climbunity_app.extensions import db, bcrypt
+from climbunity_app.cache import page_cache
+from climbunity_app.fragments import fragment_cache
+from climbunity_app.lookups import reset_lookups
+from climbunity_app.hashing import password_hasher
+from climbunity_app.testing import assert_max_queries
 from climbunity_app.models import SendType, User, Style, Tag, Venue, Route, Ascent, Appointment 
 
 """
@@ -18,6 +23,8 @@ python3 -m unittest discover instead (or this might just register zero tests bec
 # Setup
 #################################################
 
+app = create_app()
+
 def create_user():
     password_hash = bcrypt.generate_password_hash('password123').decode('utf-8')
     user = User(
@@ -45,9 +52,19 @@ class AuthTests(TestCase):
         app.config['WTF_CSRF_ENABLED'] = False
         app.config['DEBUG'] = False
         app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        app.config['BCRYPT_LOG_ROUNDS'] = 12
+        app.config['BCRYPT_QUEUE_TIMEOUT'] = 1
         self.app = app.test_client()
+        self.context = app.app_context()
+        self.context.push()
         db.drop_all()
         db.create_all()
+        page_cache.clear()
+        fragment_cache.clear()
+        reset_lookups()
+
+    def tearDown(self):
+        self.context.pop()
 
     def test_signup(self):
         # TODO: Write a test for the signup route. It should:
@@ -151,4 +168,50 @@ class AuthTests(TestCase):
         response_text = response.get_data(as_text=True)
         response.get_data(as_text=True)
         self.assertIn('<a href="/login">Log In</a>', response_text)
-        
\ No newline at end of file
+        
+
+    def test_login_looks_user_up_once(self):
+        create_user()
+        post_data = {
+            "username": "me1",
+            "password": "password123"
+        }
+        with assert_max_queries(self, 1):
+            response = self.app.post('/login', data=post_data)
+        self.assertEqual(response.status_code, 302)
+
+    def test_login_rehashes_outdated_cost(self):
+        create_user()
+        user = User.query.filter_by(username="me1").one()
+        user.password = bcrypt.generate_password_hash('password123', 4).decode('utf-8')
+        db.session.commit()
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+        post_data = {
+            "username": "me1",
+            "password": "password123"
+        }
+        response = self.app.post('/login', data=post_data)
+        self.assertEqual(response.status_code, 302)
+        user = User.query.filter_by(username="me1").one()
+        self.assertTrue(user.password.startswith('$2b$05$'))
+        self.assertTrue(bcrypt.check_password_hash(user.password, 'password123'))
+
+    def test_login_sheds_load_when_hashing_is_saturated(self):
+        create_user()
+        app.config['BCRYPT_QUEUE_TIMEOUT'] = 0.01
+        with app.app_context():
+            _, slots = password_hasher._pool()
+        held = 0
+        while slots.acquire(blocking=False):
+            held += 1
+        try:
+            post_data = {
+                "username": "me1",
+                "password": "password123"
+            }
+            response = self.app.post('/login', data=post_data)
+        finally:
+            for _ in range(held):
+                slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("handling a lot of logins", response.get_data(as_text=True))
@@ -0,0 +1,273 @@
+"""Server-side cache for anonymous page views, invalidated by the views that write.
+
+Logged-out GETs of the pages decorated with `cached_page` are stored whole
+(body, status and content type) under their URL, for at most PAGE_CACHE_SECONDS.
+Every entry records the version of each tag it was rendered from, e.g.
+"venues" or "venue:3"; write handlers call `invalidate_pages` with the tags
+they touched, which gives those tags new versions, so every entry rendered from
+the old ones stops matching. Responses carry a strong ETag and a matching
+If-None-Match gets a 304.
+
+The store is chosen with PAGE_CACHE_BACKEND:
+
+- memory: an LRU of PAGE_CACHE_MAX_ENTRIES pages per process. The tag
+  versions still live under PAGE_CACHE_DIR, so a write in one worker
+  invalidates the pages every other worker on the host holds.
+- filesystem: pickles under PAGE_CACHE_DIR, shared by every worker on the host.
+- redis: any Redis-compatible server at PAGE_CACHE_REDIS_URL (needs the
+  `redis` package).
+- none: no caching.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, g, request, session, make_response
+from flask_login import current_user
+from climbunity_app.metrics import PAGE_CACHE_REQUESTS
+
+##########################################
+#           Backends                     #
+##########################################
+
+class MemoryBackend(object):
+    """Least-recently-used dict of (expires_at, value), shared by this process's threads."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] is not None and entry[0] <= now:
+                    del self._entries[key]
+                    entry = None
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                values.append(entry[1] if entry is not None else None)
+        return values
+
+    def set_many(self, mapping, timeout=None):
+        expires_at = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            for key, value in mapping.items():
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class FileSystemBackend(object):
+    """One pickle of (expires_at, value) per key in `directory`, written atomically."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get_many(self, keys):
+        now = time.time()
+        values = []
+        for key in keys:
+            try:
+                with open(self._path(key), 'rb') as cache_file:
+                    expires_at, value = pickle.load(cache_file)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                value = None
+            else:
+                if expires_at is not None and expires_at <= now:
+                    value = None
+            values.append(value)
+        return values
+
+    def set_many(self, mapping, timeout=None):
+        expires_at = time.time() + timeout if timeout else None
+        for key, value in mapping.items():
+            descriptor, temporary = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(descriptor, 'wb') as cache_file:
+                pickle.dump((expires_at, value), cache_file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self._path(key))
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+class RedisBackend(object):
+    """Pickled values in a Redis-compatible server, under `prefix`."""
+
+    def __init__(self, url, prefix):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('PAGE_CACHE_BACKEND=redis needs the redis package (pip install redis)')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        return [pickle.loads(value) if value is not None else None
+            for value in self.client.mget([self.prefix + key for key in keys])]
+
+    def set_many(self, mapping, timeout=None):
+        pipeline = self.client.pipeline()
+        for key, value in mapping.items():
+            pipeline.set(self.prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ex=timeout or None)
+        pipeline.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+def make_backend(config, name, max_entries=None):
+    """The backend PAGE_CACHE_BACKEND selects, keeping `name`'s keys apart from other caches.
+
+    `max_entries` bounds the memory backend, PAGE_CACHE_MAX_ENTRIES by default.
+    """
+    backend = config['PAGE_CACHE_BACKEND']
+    if backend == 'memory':
+        return MemoryBackend(max_entries or config['PAGE_CACHE_MAX_ENTRIES'])
+    if backend == 'filesystem':
+        return FileSystemBackend(os.path.join(config['PAGE_CACHE_DIR'], name))
+    if backend == 'redis':
+        return RedisBackend(config['PAGE_CACHE_REDIS_URL'], f'climbunity:{name}:')
+    if backend == 'none':
+        return None
+    raise ValueError(f'Unknown PAGE_CACHE_BACKEND {backend!r}')
+
+##########################################
+#           Page cache                   #
+##########################################
+
+class PageCache(object):
+    """Whole-page cache for anonymous GETs, see the module docstring."""
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.versions = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = make_backend(app.config, 'pages')
+        # tag versions have to be seen by every worker, even when the pages are kept per process
+        self.versions = self.backend
+        if isinstance(self.backend, MemoryBackend):
+            self.versions = FileSystemBackend(os.path.join(app.config['PAGE_CACHE_DIR'], 'page-tags'))
+        app.extensions['page_cache'] = self
+
+    def tag_versions(self, tags):
+        """{tag: version}, giving never-seen (or evicted) tags a fresh version."""
+        keys = [f'tag:{tag}' for tag in tags]
+        versions = dict(zip(tags, self.versions.get_many(keys)))
+        missing = {tag: uuid.uuid4().hex for tag, version in versions.items() if version is None}
+        if missing:
+            self.versions.set_many({f'tag:{tag}': version for tag, version in missing.items()})
+            versions.update(missing)
+        return versions
+
+    def invalidate(self, *tags):
+        if self.versions is not None and tags:
+            self.versions.set_many({f'tag:{tag}': uuid.uuid4().hex for tag in tags})
+
+    def lookup(self, key):
+        """The stored page for `key` if every tag it was rendered from still has the same version."""
+        entry, = self.backend.get_many([key])
+        if entry is None:
+            return None
+        current = self.versions.get_many([f'tag:{tag}' for tag in entry['tags']])
+        if current != list(entry['tags'].values()):
+            return None
+        return entry
+
+    def store(self, key, response, etag, tags):
+        self.backend.set_many({key: {
+            'body': response.get_data(),
+            'status': response.status_code,
+            'mimetype': response.mimetype,
+            'etag': etag,
+            'tags': tags,
+        }}, timeout=current_app.config['PAGE_CACHE_SECONDS'])
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+        if self.versions is not None and self.versions is not self.backend:
+            self.versions.clear()
+
+page_cache = PageCache()
+
+def cacheable_request():
+    """Only logged-out GETs with no flashed message waiting to be shown are served from the cache."""
+    return (page_cache.backend is not None
+        and current_app.config['PAGE_CACHE_SECONDS'] > 0
+        and request.method in ('GET', 'HEAD')
+        and '_flashes' not in session
+        and not current_user.is_authenticated)
+
+def _conditional(response, etag):
+    response.set_etag(etag)
+    response.vary.add('Cookie') # logged-in visitors get a different page at the same URL
+    return response.make_conditional(request)
+
+def cached_page(*tags):
+    """Serve a view's anonymous GETs from the page cache.
+
+    `tags` name the data the page shows and may use the view's arguments,
+    e.g. `cached_page('venue:{venue_id}')`. A view that only learns a tag while
+    running adds it with `cache_page_tags` before querying the data it covers.
+    """
+    def decorator(view):
+        @wraps(view)
+        def cached_view(**kwargs):
+            if not cacheable_request():
+                PAGE_CACHE_REQUESTS.labels(request.endpoint, 'bypass').inc()
+                return view(**kwargs)
+            key = f'page:{request.full_path}'
+            entry = page_cache.lookup(key)
+            if entry is not None:
+                PAGE_CACHE_REQUESTS.labels(request.endpoint, 'hit').inc()
+                response = current_app.response_class(entry['body'], entry['status'], mimetype=entry['mimetype'])
+                return _conditional(response, entry['etag'])
+            PAGE_CACHE_REQUESTS.labels(request.endpoint, 'miss').inc()
+            # versions are read before the view queries, so a write landing mid-render leaves the entry stale-tagged
+            versions = g.page_cache_tags = page_cache.tag_versions([tag.format(**kwargs) for tag in tags])
+            try:
+                response = make_response(view(**kwargs))
+            finally:
+                # g outlives the request when an app context was already pushed (tests, CLI)
+                g.pop('page_cache_tags', None)
+            if response.status_code != 200 or response.is_streamed or '_flashes' in session:
+                return response
+            etag = hashlib.sha1(response.get_data()).hexdigest()
+            page_cache.store(key, response, etag, versions)
+            return _conditional(response, etag)
+        return cached_view
+    return decorator
+
+def cache_page_tags(*tags):
+    """Add tags to the page being cached, if it is (call before querying what they cover)."""
+    if g.get('page_cache_tags') is not None:
+        g.page_cache_tags.update(page_cache.tag_versions(list(tags)))
+
+def invalidate_pages(*tags):
+    """Drop every cached page rendered from any of `tags`; call once the write has committed."""
+    page_cache.invalidate(*tags)
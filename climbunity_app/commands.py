@@ -0,0 +1,139 @@
+"""Flask CLI commands, run with e.g. `flask rebuild-route-stats`."""
+import click
+from flask import Blueprint
+from sqlalchemy import bindparam, func
+from climbunity_app.extensions import db
+from climbunity_app.associations import dedupe_associations
+from climbunity_app.grades import parse_grade
+from climbunity_app.imports import RouteImportError, import_format, import_routes
+from climbunity_app.leaderboards import prune_leaderboards, rebuild_leaderboards
+from climbunity_app.lookups import LOOKUP_MODELS, bump_lookup_versions
+from climbunity_app.models import Route
+from climbunity_app.recommendations import rebuild_recommendations, refresh_recommendations
+from climbunity_app.seeding import SCALES, SEED_DATE, seed_database
+from climbunity_app.stats import rebuild_route_stats
+
+# registered by create_app, at the top level: `flask seed`, not `flask commands seed`
+commands = Blueprint('commands', __name__, cli_group=None)
+
+@commands.cli.command('create-db')
+def create_db_command():
+    """Create any missing tables (run once before the first start, and after adding a model)."""
+    db.create_all()
+    click.echo('Created the database tables.')
+
+@commands.cli.command('rebuild-route-stats')
+def rebuild_route_stats_command():
+    """Recompute every route's ascent statistics from the Ascent table."""
+    count = rebuild_route_stats()
+    click.echo(f'Rebuilt ascent stats for {count} routes.')
+
+@commands.cli.command('rebuild-leaderboards')
+def rebuild_leaderboards_command():
+    """Recompute every leaderboard bucket from the Ascent table."""
+    count = rebuild_leaderboards()
+    click.echo(f'Rebuilt {count} leaderboard buckets.')
+
+@commands.cli.command('prune-leaderboards')
+def prune_leaderboards_command():
+    """Drop the daily leaderboard buckets older than the longest window."""
+    count = prune_leaderboards()
+    click.echo(f'Pruned {count} leaderboard buckets.')
+
+def backfill_route_grades():
+    """Set grade_scale/grade_difficulty on every route from its grade text.
+
+    Parses each distinct grade string once and updates all routes sharing it in
+    one executemany. Returns `(routes, unrecognised)`: how many routes got a
+    difficulty, and the grade strings that didn't parse.
+    """
+    counts = db.session.query(Route.grade, func.count(Route.id)).group_by(Route.grade).all()
+    params, routes, unrecognised = [], 0, []
+    for grade, count in counts:
+        parsed = parse_grade(grade)
+        if parsed:
+            routes += count
+        else:
+            unrecognised.append(grade)
+        params.append({
+            'match_grade': grade,
+            'new_scale': parsed.scale if parsed else None,
+            'new_difficulty': parsed.difficulty if parsed else None,
+        })
+    if params:
+        db.session.execute(
+            Route.__table__.update()
+            .where(Route.grade == bindparam('match_grade'))
+            .values(grade_scale=bindparam('new_scale'), grade_difficulty=bindparam('new_difficulty')),
+            params,
+        )
+    db.session.commit()
+    return routes, sorted(unrecognised)
+
+@commands.cli.command('backfill-grades')
+def backfill_grades_command():
+    """Normalise every route's grade into grade_scale and grade_difficulty."""
+    routes, unrecognised = backfill_route_grades()
+    click.echo(f'Normalised grades for {routes} routes.')
+    if unrecognised:
+        click.echo(f'Unrecognised grades: {", ".join(unrecognised)}')
+
+@commands.cli.command('rebuild-recommendations')
+def rebuild_recommendations_command():
+    """Recompute every route's "climbers also liked" neighbours from all ascents and projects."""
+    count = rebuild_recommendations()
+    click.echo(f'Stored recommendations for {count} routes.')
+
+@commands.cli.command('refresh-recommendations')
+def refresh_recommendations_command():
+    """Recompute recommendations for routes with new ascents or project changes since the last run."""
+    count = refresh_recommendations()
+    click.echo(f'Refreshed recommendations for {count} routes.')
+
+@commands.cli.command('bump-lookups')
+def bump_lookups_command():
+    """Make every worker reload Style and Tag, after changing them outside the app."""
+    bump_lookup_versions(db.session, LOOKUP_MODELS)
+    db.session.commit()
+    click.echo(f'Bumped lookup versions for {", ".join(sorted(LOOKUP_MODELS))}.')
+
+@commands.cli.command('dedupe-associations')
+def dedupe_associations_command():
+    """Rebuild association tables from before their primary keys, dropping duplicate pairs."""
+    rebuilt = dedupe_associations()
+    for name, before, after in rebuilt:
+        click.echo(f'{name}: {before} rows -> {after}')
+    click.echo(f'Rebuilt {len(rebuilt)} association tables.')
+
+@commands.cli.command('seed')
+@click.option('--scale', type=click.Choice(sorted(SCALES, key=SCALES.get)), default='1k',
+    help='Number of ascents, with users, venues, routes and appointments sized to match.')
+@click.option('--ascents', type=int, help='An exact number of ascents instead of --scale.')
+@click.option('--seed', 'random_seed', type=int, default=20, help='Same seed, same data.')
+@click.option('--today', type=click.DateTime(['%Y-%m-%d']),
+    help='Date the data up to this day (YYYY-MM-DD) instead of a fixed one, to fill recent time windows.')
+def seed_command(scale, ascents, random_seed, today):
+    """Fill an empty database with deterministic synthetic climbers, routes and ascents."""
+    try:
+        size = seed_database(ascents or SCALES[scale], random_seed, today.date() if today else SEED_DATE)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    click.echo('Seeded ' + ', '.join(f'{count} {name}' for name, count in size.items()) + '.')
+
+@commands.cli.command('import-routes')
+@click.argument('routes_file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'json']),
+    help='Defaults to the file extension (.csv, .json, .ndjson); needed when reading stdin.')
+@click.option('--dry-run', is_flag=True, help='Check every row, import nothing.')
+def import_routes_command(routes_file, file_format, dry_run):
+    """Bulk-import routes from a CSV or JSON file (see climbunity_app/imports.py for the columns)."""
+    try:
+        result = import_routes(routes_file, file_format or import_format(routes_file.name), dry_run=dry_run)
+    except RouteImportError as error:
+        raise click.ClickException(str(error))
+    for line, message in result.errors:
+        click.echo(f'line {line}: {message}')
+    if result.error_count > len(result.errors):
+        click.echo(f'... and {result.error_count - len(result.errors)} more rows with errors.')
+    verb = 'Checked' if dry_run else 'Imported'
+    click.echo(f'{verb} {result.imported} routes, skipped {result.error_count} rows.')
@@ -1,6 +1,7 @@
 """Initialize Config class to access environment variables."""
 from dotenv import load_dotenv
 import os
+import tempfile
 
 load_dotenv()
 
@@ -9,3 +10,53 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL")
     SECRET_KEY = os.getenv("SECRET_KEY")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # read replicas for the read-only pages (see climbunity_app/replicas.py)
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    SQLALCHEMY_BINDS = {f"replica{number}": url for number, url in enumerate(DATABASE_REPLICA_URLS, 1)}
+    REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", 5))
+    REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 2))
+    REPLICA_CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", 5))
+    # connection pool, ignored for SQLite (see climbunity_app/pool.py)
+    DB_POOL_MODE = os.getenv("DB_POOL_MODE", "queue") # queue | pgbouncer (transaction pooling)
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    # SQL instrumentation (see climbunity_app/querystats.py)
+    SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+    N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 5))
+    QUERY_STATS_HEADERS = os.getenv("QUERY_STATS_HEADERS", "false").lower() == "true"
+    # password hashing (see climbunity_app/hashing.py)
+    BCRYPT_LOG_ROUNDS = int(os.getenv("BCRYPT_LOG_ROUNDS", 12))
+    BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", 2))
+    BCRYPT_QUEUE_SIZE = int(os.getenv("BCRYPT_QUEUE_SIZE", 8))
+    BCRYPT_QUEUE_TIMEOUT = float(os.getenv("BCRYPT_QUEUE_TIMEOUT", 1))
+    # /readyz
+    READINESS_CACHE_SECONDS = float(os.getenv("READINESS_CACHE_SECONDS", 2))
+    READINESS_MAX_POOL_USAGE = float(os.getenv("READINESS_MAX_POOL_USAGE", 0.9))
+    VENUES_PER_PAGE = int(os.getenv("VENUES_PER_PAGE", 20))
+    RECENT_COMMENTS_LIMIT = int(os.getenv("RECENT_COMMENTS_LIMIT", 10))
+    ROUTE_SEARCH_PAGE_SIZE = int(os.getenv("ROUTE_SEARCH_PAGE_SIZE", 20))
+    ROUTE_FACETS_CACHE_SECONDS = int(os.getenv("ROUTE_FACETS_CACHE_SECONDS", 60))
+    PROFILE_FEED_PAGE_SIZE = int(os.getenv("PROFILE_FEED_PAGE_SIZE", 10))
+    # anonymous page cache (see climbunity_app/cache.py)
+    PAGE_CACHE_BACKEND = os.getenv("PAGE_CACHE_BACKEND", "memory") # memory | filesystem | redis | none
+    PAGE_CACHE_SECONDS = int(os.getenv("PAGE_CACHE_SECONDS", 300))
+    PAGE_CACHE_MAX_ENTRIES = int(os.getenv("PAGE_CACHE_MAX_ENTRIES", 1000))
+    PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "climbunity-cache"))
+    PAGE_CACHE_REDIS_URL = os.getenv("PAGE_CACHE_REDIS_URL", "redis://localhost:6379/0")
+    # {% cache %} template fragments, stored in the PAGE_CACHE_BACKEND (see climbunity_app/fragments.py)
+    FRAGMENT_CACHE_SECONDS = int(os.getenv("FRAGMENT_CACHE_SECONDS", 600))
+    FRAGMENT_CACHE_MAX_ENTRIES = int(os.getenv("FRAGMENT_CACHE_MAX_ENTRIES", 5000))
+    # how often each worker checks for Style/Tag changes (see climbunity_app/lookups.py)
+    LOOKUP_VERSION_CHECK_SECONDS = int(os.getenv("LOOKUP_VERSION_CHECK_SECONDS", 5))
+    # partner suggestions (see climbunity_app/partners.py)
+    PARTNER_INDEX_SECONDS = int(os.getenv("PARTNER_INDEX_SECONDS", 300))
+    PROFILE_PARTNER_SUGGESTIONS = int(os.getenv("PROFILE_PARTNER_SUGGESTIONS", 5))
+    # route recommendations (see climbunity_app/recommendations.py)
+    RECOMMENDATIONS_PER_ROUTE = int(os.getenv("RECOMMENDATIONS_PER_ROUTE", 20))
+    RECOMMENDATION_MIN_OVERLAP = int(os.getenv("RECOMMENDATION_MIN_OVERLAP", 2))
+    RECOMMENDATIONS_SHOWN = int(os.getenv("RECOMMENDATIONS_SHOWN", 5))
+    # leaderboards (see climbunity_app/leaderboards.py)
+    LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", 20))
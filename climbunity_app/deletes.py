@@ -0,0 +1,56 @@
+"""Set-based cascading deletes for venues and routes.
+
+The foreign keys declare ON DELETE CASCADE, but tables created before that
+(and SQLite connections without the pragma) won't cascade on their own, so the
+dependent rows are removed explicitly here: one DELETE ... WHERE ... IN
+(subquery) per table, all inside a single transaction.
+"""
+from sqlalchemy import select
+from climbunity_app.extensions import db
+from climbunity_app.leaderboards import leaderboard_route_deletes
+from climbunity_app.models import (Appointment, Ascent, LeaderboardBucket, RecommendationRefresh, Route,
+    RouteRecommendation, RouteStats, Venue, appointment_guest_lists, project_lists_table, route_styles_table,
+    route_tags_table)
+
+def _route_dependents(route_ids):
+    """DELETE statements for everything hanging off the routes in `route_ids`."""
+    return leaderboard_route_deletes(route_ids) + [ # reads the ascents, so before they go
+        project_lists_table.delete().where(project_lists_table.c.route_id.in_(route_ids)),
+        route_styles_table.delete().where(route_styles_table.c.route_id.in_(route_ids)),
+        route_tags_table.delete().where(route_tags_table.c.route_id.in_(route_ids)),
+        RouteStats.__table__.delete().where(RouteStats.route_id.in_(route_ids)),
+        RouteRecommendation.__table__.delete().where(RouteRecommendation.route_id.in_(route_ids)),
+        RouteRecommendation.__table__.delete().where(RouteRecommendation.similar_route_id.in_(route_ids)),
+        RecommendationRefresh.__table__.delete().where(RecommendationRefresh.route_id.in_(route_ids)),
+        Ascent.__table__.delete().where(Ascent.route_id.in_(route_ids)),
+    ]
+
+def _run(statements):
+    try:
+        for statement in statements:
+            db.session.execute(statement)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+def delete_route_cascade(route_id):
+    """Delete a route with its ascents (and their leaderboard counts), stats, recommendations, project list
+    entries, styles and tags."""
+    _run(_route_dependents([route_id]) + [
+        Route.__table__.delete().where(Route.id == route_id),
+    ])
+
+def delete_venue_cascade(venue_id):
+    """Delete a venue with its appointments, routes and everything hanging off them."""
+    route_ids = select([Route.id]).where(Route.venue_id == venue_id)
+    appointment_ids = select([Appointment.id]).where(Appointment.venue_id == venue_id)
+    _run([
+        # the venue's own leaderboards go whole, the site-wide ones are corrected with the routes
+        LeaderboardBucket.__table__.delete().where(LeaderboardBucket.venue_id == venue_id),
+    ] + _route_dependents(route_ids) + [
+        Route.__table__.delete().where(Route.venue_id == venue_id),
+        appointment_guest_lists.delete().where(appointment_guest_lists.c.appointment_id.in_(appointment_ids)),
+        Appointment.__table__.delete().where(Appointment.venue_id == venue_id),
+        Venue.__table__.delete().where(Venue.id == venue_id),
+    ])
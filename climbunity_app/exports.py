@@ -0,0 +1,103 @@
+"""Streaming CSV and NDJSON exports of a climber's ascents and a venue's routes.
+
+Exports can run to millions of rows, so nothing is loaded up front: the
+query runs on a connection of its own with `stream_results` (a server-side
+cursor on Postgres, an unbuffered one on MySQL; SQLite steps through rows
+anyway), rows are fetched BATCH_SIZE at a time, and each batch is encoded and
+sent before the next is fetched. The response starts with the first batch and
+holds one batch in memory however long it runs.
+"""
+import csv
+import enum
+import io
+import json
+from datetime import date
+from flask import Response, stream_with_context
+from sqlalchemy import select
+from climbunity_app.extensions import db
+from climbunity_app.models import Ascent, Route, RouteStats, User, Venue, SEND_TYPE_COLUMNS
+
+BATCH_SIZE = 1000
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+stats_table = RouteStats.__table__
+
+def ascent_export_query(user_id):
+    """Every ascent a climber logged, oldest first, with the route and venue it was on."""
+    return select([
+        Ascent.id.label('ascent_id'),
+        Ascent.send_date,
+        Ascent.send_type,
+        Ascent.send_rating,
+        Ascent.send_comments,
+        Route.id.label('route_id'),
+        Route.name.label('route_name'),
+        Route.grade,
+        Venue.id.label('venue_id'),
+        Venue.name.label('venue_name'),
+    ]).select_from(Ascent.__table__.join(Route.__table__).join(Venue.__table__)) \
+        .where(Ascent.user_id == user_id) \
+        .order_by(Ascent.id)
+
+def venue_routes_export_query(venue_id):
+    """Every route at a venue with its ascent stats, in id order."""
+    return select([
+        Route.id.label('route_id'),
+        Route.name,
+        Route.grade,
+        Route.grade_scale,
+        Route.grade_difficulty,
+        User.username.label('setter'),
+        Route.route_set_date,
+        Route.route_takedown_date,
+        stats_table.c.ascent_count,
+        stats_table.c.rating_count,
+        stats_table.c.rating_average,
+        *[stats_table.c[column] for column in SEND_TYPE_COLUMNS.values()],
+    ]).select_from(Route.__table__
+            .outerjoin(stats_table, stats_table.c.route_id == Route.id)
+            .outerjoin(User.__table__, User.id == Route.setter_id)) \
+        .where(Route.venue_id == venue_id) \
+        .order_by(Route.id)
+
+def _plain(value):
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, date): # and datetime
+        return value.isoformat()
+    return value
+
+def _encode_csv(columns, rows, header):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    writer.writerows([_plain(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+def _encode_ndjson(columns, rows, header):
+    return ''.join(json.dumps(dict(zip(columns, map(_plain, row)))) + '\n' for row in rows)
+
+ENCODERS = {'csv': _encode_csv, 'ndjson': _encode_ndjson}
+
+def stream_query(query, format):
+    """The query's rows encoded as `format`, one string per BATCH_SIZE rows (a CSV header comes first)."""
+    encode = ENCODERS[format]
+    connection = db.engine.connect()
+    try:
+        result = connection.execution_options(stream_results=True).execute(query)
+        columns = list(result.keys())
+        if format == 'csv':
+            yield encode(columns, [], header=True) # headers go out before the first row is fetched
+        while True:
+            rows = result.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            yield encode(columns, rows, header=False)
+    finally:
+        connection.close()
+
+def export_response(query, format, filename):
+    """A streamed download of the query's rows as `filename`.<format>."""
+    return Response(stream_with_context(stream_query(query, format)), mimetype=MIMETYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{format}"'})
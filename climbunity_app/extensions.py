@@ -1,14 +1,35 @@
-from flask import Flask
+"""The app's extensions, created unbound; `create_app` (climbunity_app/__init__.py) binds them."""
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_bcrypt import Bcrypt
-from climbunity_app.config import Config
-import os
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine
+from climbunity_app.pool import pool_options
+from climbunity_app.replicas import RoutingSession
+from climbunity_app.metrics import BCRYPT_SECONDS
+import time
 
-app = Flask(__name__)
-app.config.from_object(Config)
+class ClimbunitySQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension that sizes server database pools from the DB_POOL_* config
+    and routes replica-eligible reads (see climbunity_app/replicas.py)."""
 
-db = SQLAlchemy(app)
+    def apply_driver_hacks(self, app, sa_url, options):
+        super().apply_driver_hacks(app, sa_url, options)
+        if not sa_url.drivername.startswith('sqlite'):
+            options.update(pool_options(app.config))
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+db = ClimbunitySQLAlchemy()
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores ON DELETE CASCADE unless foreign keys are switched on per connection
+    if type(dbapi_connection).__module__ == 'sqlite3':
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
 
 ###########################
 # Authentication
@@ -16,12 +37,27 @@ db = SQLAlchemy(app)
 
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
-login_manager.init_app(app)
-
-from .models import User
 
 @login_manager.user_loader
 def load_user(user_id):
+    from climbunity_app.models import User
     return User.query.get(user_id)
 
-bcrypt = Bcrypt(app)
\ No newline at end of file
+class TimedBcrypt(Bcrypt):
+    """Flask-Bcrypt that reports hashing time to /metrics."""
+
+    def generate_password_hash(self, password, rounds=None):
+        start = time.perf_counter()
+        try:
+            return super().generate_password_hash(password, rounds)
+        finally:
+            BCRYPT_SECONDS.labels('generate').observe(time.perf_counter() - start)
+
+    def check_password_hash(self, pw_hash, password):
+        start = time.perf_counter()
+        try:
+            return super().check_password_hash(pw_hash, password)
+        finally:
+            BCRYPT_SECONDS.labels('check').observe(time.perf_counter() - start)
+
+bcrypt = TimedBcrypt()
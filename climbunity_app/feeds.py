@@ -0,0 +1,56 @@
+"""Profile page queries: the ascent feed and a user's appointments.
+
+Each returns rows that already carry the route and venue names, so the
+profile templates never have to scan whole tables to label a link.
+"""
+from datetime import date
+from sqlalchemy import func, literal_column
+from climbunity_app.extensions import db
+from climbunity_app.models import Appointment, Ascent, Route, Venue, appointment_guest_lists
+from climbunity_app.pagination import decode_cursor, encode_cursor, seek
+
+# stands in for ascents logged before send dates were required, so they sort last;
+# spelled as a literal so the expression matches the ix_ascent_user_feed expression index
+FEED_EPOCH = date(1970, 1, 1)
+FEED_SORT = func.coalesce(Ascent.send_date, literal_column("'1970-01-01'"))
+
+def ascent_feed(user_id, cursor=None, limit=10):
+    """One page of a user's ascents, newest first, keyset-paginated on (send_date, id).
+
+    Returns `(rows, next_cursor)`; each row has `Ascent`, `route_name`, `venue_id`
+    and `venue_name`, and `next_cursor` is None on the last page.
+    """
+    query = db.session.query(
+        Ascent,
+        Route.name.label('route_name'),
+        Venue.id.label('venue_id'),
+        Venue.name.label('venue_name'),
+    ).join(Route, Route.id == Ascent.route_id) \
+        .join(Venue, Venue.id == Route.venue_id) \
+        .filter(Ascent.user_id == user_id) \
+        .order_by(FEED_SORT.desc(), Ascent.id.desc())
+    cursor_values = decode_cursor(cursor, date.fromisoformat, int)
+    rows, has_more = seek(query, [FEED_SORT, Ascent.id], cursor_values, limit, descending=True)
+    next_cursor = None
+    if has_more:
+        last = rows[-1].Ascent
+        next_cursor = encode_cursor(last.send_date or FEED_EPOCH, last.id)
+    return rows, next_cursor
+
+def user_appointments(user_id):
+    """Appointments a user attends, soonest first, each with `venue_name`."""
+    return db.session.query(Appointment, Venue.name.label('venue_name')) \
+        .join(appointment_guest_lists, appointment_guest_lists.c.appointment_id == Appointment.id) \
+        .join(Venue, Venue.id == Appointment.venue_id) \
+        .filter(appointment_guest_lists.c.user_id == user_id) \
+        .order_by(Appointment.appointment_datetime, Appointment.id) \
+        .all()
+
+def attending_appointment_ids(user_id, appointment_ids):
+    """Which of `appointment_ids` the user already attends, as a set."""
+    if not appointment_ids:
+        return set()
+    rows = db.session.query(appointment_guest_lists.c.appointment_id) \
+        .filter(appointment_guest_lists.c.user_id == user_id,
+            appointment_guest_lists.c.appointment_id.in_(appointment_ids))
+    return {row.appointment_id for row in rows}
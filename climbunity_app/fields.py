@@ -0,0 +1,138 @@
+"""Form fields that pick model rows by id without loading the whole table.
+
+QuerySelectField renders every row of its query into a <select> and runs the
+query again on POST to validate. These fields render only the currently
+selected rows, let static/typeahead.js fetch candidates from a search endpoint,
+and check the submitted ids with a single `WHERE id IN (...)` on validate.
+Small static tables are offered whole from the process's cached copy instead
+(see climbunity_app/lookups.py).
+"""
+from flask import url_for
+from markupsafe import Markup, escape
+from wtforms.ext.sqlalchemy.fields import QuerySelectMultipleField
+from wtforms.fields import Field
+from wtforms.validators import StopValidation, ValidationError
+from wtforms.widgets import html_params
+from climbunity_app.lookups import attached, lookup_rows
+
+class TypeaheadWidget(object):
+    """A search box wired to the field's search endpoint, above a <select> of the chosen rows."""
+
+    def __call__(self, field, **kwargs):
+        kwargs.setdefault('id', field.id)
+        if field.multiple:
+            kwargs['multiple'] = True
+        options = ''.join(
+            f'<option value="{row.id}" selected>{escape(str(row))}</option>'
+            for row in field.selected()
+        )
+        search = html_params(
+            type='search', class_='typeahead-input', autocomplete='off',
+            placeholder=f'Search {field.label.text.lower()}...', **{'aria-label': field.label.text},
+        )
+        return Markup(
+            f'<span class="typeahead" data-search-url="{url_for(field.search_endpoint)}">'
+            f'<input {search}>'
+            f'<select {html_params(name=field.name, **kwargs)}>{options}</select>'
+            '<ul class="typeahead-results"></ul>'
+            '</span>'
+        )
+
+class ModelSelectField(Field):
+    """One `model` row, chosen by id. `data` is the model instance (or None)."""
+    widget = TypeaheadWidget()
+    multiple = False
+
+    def __init__(self, label=None, validators=None, model=None, search_endpoint=None, **kwargs):
+        super(ModelSelectField, self).__init__(label, validators, **kwargs)
+        self.model = model
+        self.search_endpoint = search_endpoint
+        self._submitted = None
+
+    def process_data(self, value):
+        # form defaults and obj= may hand us bare ids, e.g. RouteForm(obj=route).venue_id
+        self.data = self._load(value)
+
+    def _load(self, value):
+        if value is None or isinstance(value, self.model):
+            return value
+        return self.model.query.get(value)
+
+    def process_formdata(self, valuelist):
+        submitted = [value for value in valuelist if value != '']
+        self._submitted = submitted if self.multiple else submitted[:1]
+
+    def selected(self):
+        return [self.data] if self.data is not None else []
+
+    def _fetch(self):
+        """Resolve the submitted ids with one query, failing on any that don't exist.
+
+        Stops validation on failure so DataRequired doesn't replace the message.
+        """
+        try:
+            ids = list(dict.fromkeys(int(value) for value in self._submitted))
+        except ValueError:
+            raise StopValidation(self.gettext('Not a valid choice'))
+        if not ids:
+            return []
+        found = {row.id: row for row in self.model.query.filter(self.model.id.in_(ids))}
+        if len(found) != len(ids):
+            raise StopValidation(self.gettext('Not a valid choice'))
+        return [found[id] for id in ids]
+
+    def pre_validate(self, form):
+        if self._submitted is None:
+            return
+        rows = self._fetch()
+        self.data = rows[0] if rows else None
+
+class ModelSelectMultipleField(ModelSelectField):
+    """Any number of `model` rows, chosen by id. `data` is a list of model instances."""
+    multiple = True
+
+    def _load(self, value):
+        return [super(ModelSelectMultipleField, self)._load(item) for item in value or []]
+
+    def selected(self):
+        return [row for row in self.data or [] if row is not None]
+
+    def pre_validate(self, form):
+        if self._submitted is None:
+            return
+        self.data = self._fetch()
+
+class LookupSelectMultipleField(QuerySelectMultipleField):
+    """Any number of rows of a cached lookup table ('style' or 'tag'), all offered in a <select>.
+
+    Renders and validates against the cached rows without a query; `data`
+    holds instances of the current session, ready to add to a relationship.
+    """
+
+    def __init__(self, label=None, validators=None, lookup=None, **kwargs):
+        super(LookupSelectMultipleField, self).__init__(label, validators,
+            query_factory=lambda: lookup_rows(lookup), get_pk=lambda row: row.id, **kwargs)
+
+    def _get_data(self):
+        if self._formdata is not None:
+            QuerySelectMultipleField._get_data(self)
+            self._data = attached(self._data)
+        return self._data
+
+    data = property(_get_data, QuerySelectMultipleField._set_data)
+
+    def _selected_ids(self):
+        return {row.id for row in self.data or []}
+
+    def iter_choices(self):
+        selected = self._selected_ids()
+        for pk, row in self._get_object_list():
+            yield (pk, self.get_label(row), row.id in selected)
+
+    def pre_validate(self, form):
+        selected = self._selected_ids() # resolves submitted ids first, flagging unknown ones
+        if self._invalid_formdata:
+            raise ValidationError(self.gettext('Not a valid choice'))
+        offered = {row.id for _, row in self._get_object_list()}
+        if not selected <= offered:
+            raise ValidationError(self.gettext('Not a valid choice'))
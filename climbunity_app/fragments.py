@@ -0,0 +1,95 @@
+"""`{% cache key, ttl %}` fragment caching for the app's templates.
+
+Logged-in pages can't be cached whole, but most of what they render is the
+same for every viewer. Wrapping such a part of a template
+
+    {% cache ('venue-routes', venue.id, current_user.is_authenticated, routes) %}
+        ...
+    {% endcache %}
+
+stores its HTML in the PAGE_CACHE_BACKEND store for `ttl` seconds
+(FRAGMENT_CACHE_SECONDS when left out). The key is stamped from its values:
+model instances contribute their class and every column value, so editing,
+adding or removing one of the rows a fragment shows gives it a new key and the
+old entry is simply never read again. Anything else the fragment varies on
+(whose page it is, whether the viewer is logged in, ...) has to be in the key
+too; per-viewer bits belong outside the tag.
+
+Hits and misses are counted on /metrics as `fragment_cache_requests`, per
+fragment ("template:line").
+"""
+import hashlib
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import inspect
+from climbunity_app.cache import make_backend
+from climbunity_app.metrics import FRAGMENT_CACHE_REQUESTS
+
+def _stamp(value):
+    """`value` with every model instance in it replaced by its class and column values."""
+    if isinstance(value, (list, tuple)): # includes query result rows
+        return tuple(_stamp(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(_stamp(item) for item in value))
+    state = inspect(value, raiseerr=False)
+    if state is not None and hasattr(state, 'mapper'):
+        return (state.mapper.class_.__name__,
+            tuple(getattr(value, column.key) for column in state.mapper.column_attrs))
+    return value
+
+def fragment_key(value):
+    """A digest of `value` that changes whenever any row in it does."""
+    return hashlib.sha1(repr(_stamp(value)).encode('utf-8')).hexdigest()
+
+class FragmentCache(object):
+    """Stores rendered fragments; installs the `{% cache %}` tag on the app's Jinja environment."""
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = make_backend(app.config, 'fragments', app.config['FRAGMENT_CACHE_MAX_ENTRIES'])
+        app.extensions['fragment_cache'] = self
+        app.jinja_env.add_extension(FragmentCacheExtension)
+
+    def render(self, fragment, key, ttl, caller):
+        """The fragment's cached HTML for `key`, rendering it with `caller` on a miss."""
+        if ttl is None:
+            ttl = current_app.config['FRAGMENT_CACHE_SECONDS']
+        if self.backend is None or ttl <= 0:
+            return caller()
+        cache_key = f'fragment:{fragment}:{fragment_key(key)}'
+        body, = self.backend.get_many([cache_key])
+        if body is not None:
+            FRAGMENT_CACHE_REQUESTS.labels(fragment, 'hit').inc()
+            return Markup(body)
+        FRAGMENT_CACHE_REQUESTS.labels(fragment, 'miss').inc()
+        body = caller()
+        self.backend.set_many({cache_key: str(body)}, timeout=ttl)
+        return body
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+fragment_cache = FragmentCache()
+
+class FragmentCacheExtension(Extension):
+    """Jinja extension for `{% cache key[, ttl] %}...{% endcache %}`."""
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = parser.parse_expression()
+        ttl = parser.parse_expression() if parser.stream.skip_if('comma') else nodes.Const(None)
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        fragment = nodes.Const(f'{parser.name or "string"}:{lineno}')
+        return nodes.CallBlock(self.call_method('_render', [fragment, key, ttl]), [], [], body) \
+            .set_lineno(lineno)
+
+    def _render(self, fragment, key, ttl, caller):
+        return fragment_cache.render(fragment, key, ttl, caller)
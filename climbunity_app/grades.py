@@ -0,0 +1,121 @@
+"""Parse free-text climbing grades into a scale and a comparable difficulty.
+
+Route.grade is whatever the setter typed. `parse_grade` recognises the four
+common systems and maps each onto one numeric ladder per discipline:
+
+- sport (YDS "5.10a", French "7a+"): the YDS number, letters in quarters,
+  so 5.9 is 9.0, 5.10a is 10.0 and 5.10c is 10.5
+- boulder (V "V4", Fontainebleau "f7A+" / "7A+"): the V number, VB is -1
+
+French and Font look alike; Font grades are written with an upper-case letter
+or an "f"/"Font" prefix, French ones in lower case. Slash grades ("5.10a/b",
+"V4-5") take the midpoint, and a trailing "+"/"-" moves a grade a little up
+or down.
+"""
+import math
+import re
+from collections import namedtuple
+
+Grade = namedtuple('Grade', ['scale', 'difficulty'])
+
+SPORT = 'sport'
+BOULDER = 'boulder'
+SCALES = (SPORT, BOULDER)
+
+YDS_LETTERS = {'a': 0.0, 'b': 0.25, 'c': 0.5, 'd': 0.75}
+
+# French sport grades on the YDS ladder
+FRENCH = {
+    '3': 4.0, '4a': 5.0, '4b': 6.0, '4c': 7.0, '5a': 8.0, '5b': 9.0, '5c': 9.5,
+    '6a': 10.0, '6a+': 10.25, '6b': 10.5, '6b+': 10.75, '6c': 11.125, '6c+': 11.5,
+    '7a': 11.75, '7a+': 12.0, '7b': 12.25, '7b+': 12.5, '7c': 12.75, '7c+': 13.0,
+    '8a': 13.25, '8a+': 13.5, '8b': 13.75, '8b+': 14.0, '8c': 14.25, '8c+': 14.5,
+    '9a': 14.75, '9a+': 15.0, '9b': 15.25, '9b+': 15.5, '9c': 15.75, '9c+': 16.0,
+}
+
+# Fontainebleau boulder grades on the V ladder
+FONT = {
+    '3': -1.0, '4': 0.0, '4+': 0.5, '5': 1.0, '5+': 2.0,
+    '6a': 3.0, '6a+': 3.5, '6b': 4.0, '6b+': 4.5, '6c': 5.0, '6c+': 5.5,
+    '7a': 6.0, '7a+': 7.0, '7b': 8.0, '7b+': 8.5, '7c': 9.0, '7c+': 10.0,
+    '8a': 11.0, '8a+': 12.0, '8b': 13.0, '8b+': 14.0, '8c': 15.0, '8c+': 16.0, '9a': 17.0,
+}
+
+# nudge for a trailing + or - on grades that don't define their own (5.10+, V4-)
+MODIFIERS = {'+': 0.25, '-': -0.25, '': 0.0}
+
+YDS_PATTERN = re.compile(r'^5\.(\d{1,2})([abcd])?(?:/([abcd]))?([+-]?)$')
+V_PATTERN = re.compile(r'^v(b|\d{1,2})(?:[-/](\d{1,2}))?([+-]?)$')
+FRENCH_PATTERN = re.compile(r'^([3-9][abc]?\+?)(?:/([3-9][abc]?\+?))?$')
+FONT_PREFIX = re.compile(r'^(?:font|fb|f)\s*', re.IGNORECASE)
+
+def _yds(match):
+    number, letter, slash_letter, modifier = match.groups()
+    number = int(number)
+    if number < 10:
+        # 5.0 - 5.9 have no letters
+        if letter:
+            return None
+        return number + MODIFIERS[modifier]
+    if letter:
+        difficulty = number + YDS_LETTERS[letter]
+        if slash_letter:
+            difficulty = (difficulty + number + YDS_LETTERS[slash_letter]) / 2
+        return difficulty + MODIFIERS[modifier] / 2
+    # letterless 5.11, 5.11-, 5.11+: the middle, bottom or top of the band
+    return number + {'': 0.375, '-': 0.125, '+': 0.625}[modifier]
+
+def _v(match):
+    low, high, modifier = match.groups()
+    low = -1 if low == 'b' else int(low)
+    difficulty = low if high is None else (low + int(high)) / 2
+    return difficulty + MODIFIERS[modifier]
+
+def _lookup(table, first, second):
+    if first not in table or (second is not None and second not in table):
+        return None
+    if second is None:
+        return table[first]
+    return (table[first] + table[second]) / 2
+
+def parse_grade(text):
+    """The `Grade(scale, difficulty)` for a grade string, or None if it isn't one we know."""
+    if not text:
+        return None
+    raw = text.strip().replace(' ', '')
+    lowered = raw.lower()
+    match = YDS_PATTERN.match(lowered)
+    if match:
+        difficulty = _yds(match)
+        return Grade(SPORT, difficulty) if difficulty is not None else None
+    match = V_PATTERN.match(lowered)
+    if match:
+        return Grade(BOULDER, _v(match))
+    prefixed = FONT_PREFIX.match(raw)
+    font = bool(prefixed) or any(character.isupper() for character in raw)
+    if prefixed:
+        lowered = raw[prefixed.end():].lower()
+    match = FRENCH_PATTERN.match(lowered)
+    if match:
+        first, second = match.groups()
+        if font:
+            difficulty = _lookup(FONT, first, second)
+            return Grade(BOULDER, difficulty) if difficulty is not None else None
+        difficulty = _lookup(FRENCH, first, second)
+        return Grade(SPORT, difficulty) if difficulty is not None else None
+    return None
+
+def grade_label(scale, difficulty):
+    """A canonical YDS or V label for a normalised difficulty, e.g. for pyramid buckets.
+
+    Plus/minus grades land on their base grade; anything past 5.15d carries on
+    the same pattern (French 9c+ is "5.16a").
+    """
+    if scale == BOULDER:
+        number = math.floor(difficulty + 0.25)
+        return 'VB' if number < 0 else f'V{number}'
+    number = int(difficulty + (0.25 if difficulty < 10 else 0))
+    if number < 10:
+        return f'5.{number}'
+    letter = 'abcd'[min(3, int((difficulty - number) * 4))]
+    return f'5.{number}{letter}'
@@ -0,0 +1,66 @@
+"""Password hashing on a bounded worker pool.
+
+bcrypt is deliberately slow, and a burst of logins hashing on the request
+threads starves every other page. Hashes run on a small per-process thread
+pool (bcrypt releases the GIL) with a fixed number of slots. When all slots
+are taken for longer than BCRYPT_QUEUE_TIMEOUT the caller gets `HashingBusy`
+straight away instead of piling up behind the others.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from climbunity_app.extensions import bcrypt
+
+class HashingBusy(Exception):
+    """Every hashing slot is taken, the caller should shed the request."""
+
+class PasswordHasher(object):
+    """Runs bcrypt for the app on BCRYPT_WORKERS threads with BCRYPT_QUEUE_SIZE waiting slots."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._slots = None
+
+    def _pool(self):
+        # built lazily and per process: threads don't survive gunicorn's fork
+        with self._lock:
+            if self._pid != os.getpid():
+                workers = current_app.config['BCRYPT_WORKERS']
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+                self._slots = threading.BoundedSemaphore(workers + current_app.config['BCRYPT_QUEUE_SIZE'])
+                self._pid = os.getpid()
+            return self._executor, self._slots
+
+    def _run(self, function, *args):
+        executor, slots = self._pool()
+        if not slots.acquire(timeout=current_app.config['BCRYPT_QUEUE_TIMEOUT']):
+            raise HashingBusy()
+        try:
+            future = executor.submit(function, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future.result()
+
+    def check(self, pw_hash, password):
+        """Whether `password` matches the stored bcrypt `pw_hash`."""
+        return self._run(bcrypt.check_password_hash, pw_hash, password)
+
+    def generate(self, password):
+        """A new bcrypt hash of `password` at the configured BCRYPT_LOG_ROUNDS, as text."""
+        rounds = current_app.config['BCRYPT_LOG_ROUNDS']
+        return self._run(bcrypt.generate_password_hash, password, rounds).decode('utf-8')
+
+    def needs_rehash(self, pw_hash):
+        """Whether `pw_hash` was made with a different cost than BCRYPT_LOG_ROUNDS."""
+        try:
+            cost = int(pw_hash.split('$')[2])
+        except (IndexError, ValueError):
+            return True
+        return cost != current_app.config['BCRYPT_LOG_ROUNDS']
+
+password_hasher = PasswordHasher()
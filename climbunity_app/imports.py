@@ -0,0 +1,296 @@
+"""Bulk route import for reset days: `flask import-routes wall.csv` or the /import_routes upload.
+
+The file is a CSV with a header row, or JSON: one object per line (NDJSON), or
+a single array of objects (read whole, so prefer lines for big files). Fields:
+
+- name, grade (required, any grade `parse_grade` knows)
+- venue_id, or venue with the venue's exact name
+- setter: a username (optional)
+- photo_url, route_set_date, route_takedown_date (YYYY-MM-DD, optional)
+- styles, tags: names, separated by ";" in CSV or as a string or list in JSON (optional,
+  must already exist, the import never creates styles or tags)
+
+Rows are read, checked and written CHUNK at a time, so memory stays flat
+however long the file is: each chunk looks its venues and setters up with one
+query apiece, styles and tags come from the cached lookup tables, and the
+rows that pass are written together with their RouteStats and parsed grade
+columns: COPY on Postgres, elsewhere an INSERT per route (for its id) and one
+multi-row INSERT per association table. Rows that fail are skipped and
+reported by line number; everything else is committed in one transaction at
+the end, after which the venue pages are invalidated.
+"""
+import csv
+import io
+import json
+from datetime import date
+from climbunity_app.extensions import db
+from climbunity_app.cache import invalidate_pages
+from climbunity_app.grades import parse_grade
+from climbunity_app.lookups import lookup_rows
+from climbunity_app.models import Route, RouteStats, User, Venue, route_styles_table, route_tags_table
+
+CHUNK = 1000
+MAX_REPORTED_ERRORS = 100
+FORMATS = {'.csv': 'csv', '.json': 'json', '.ndjson': 'json', '.jsonl': 'json'}
+NO_IMAGE = '/static/img/no_image.jpeg'
+MAX_ID = 2 ** 31 - 1 # the largest id an integer column holds
+
+class RouteImportError(ValueError):
+    """The file as a whole can't be imported (unreadable, or missing a required column)."""
+
+class ImportResult(object):
+    """What an import did: routes written, venues touched, and the first MAX_REPORTED_ERRORS row errors."""
+
+    def __init__(self):
+        self.imported = 0
+        self.venue_ids = set()
+        self.errors = []
+        self.error_count = 0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+def import_format(filename):
+    """'csv' or 'json' from a file name's extension."""
+    for extension, format in FORMATS.items():
+        if filename.lower().endswith(extension):
+            return format
+    raise RouteImportError(f'Import a .csv, .json or .ndjson file, not {filename!r}.')
+
+##########################################
+#           Reading                      #
+##########################################
+
+def _csv_rows(stream):
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames or 'name' not in reader.fieldnames or 'grade' not in reader.fieldnames \
+            or not {'venue', 'venue_id'} & set(reader.fieldnames):
+        raise RouteImportError('The CSV header needs name, grade and venue (or venue_id) columns.')
+    for row in reader:
+        row['styles'] = [name for name in (row.get('styles') or '').split(';') if name.strip()]
+        row['tags'] = [name for name in (row.get('tags') or '').split(';') if name.strip()]
+        yield reader.line_num, row, None
+
+def _json_rows(stream):
+    first, skipped = stream.read(1), 0 # peek at the first character: an array, or one object per line?
+    while first.isspace():
+        skipped += first == '\n'
+        first = stream.read(1)
+    if first == '[':
+        try:
+            rows = json.loads(first + stream.read())
+        except ValueError as error:
+            raise RouteImportError(f'The file is not valid JSON: {error}')
+        for number, row in enumerate(rows, 1):
+            yield number, row, None if isinstance(row, dict) else 'Expected an object.'
+        return
+    pending = first
+    for number, line in enumerate(stream, skipped + 1):
+        line, pending = pending + line, ''
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield number, None, f'Not valid JSON: {error}'
+            continue
+        yield number, row, None if isinstance(row, dict) else 'Expected an object.'
+    if pending:
+        yield skipped + 1, None, 'Not valid JSON.'
+
+def read_rows(stream, format):
+    """(line, row, error) for every route in a text stream; `row` is None when `error` says why."""
+    return _csv_rows(stream) if format == 'csv' else _json_rows(stream)
+
+##########################################
+#           Checking                     #
+##########################################
+
+def _text(row, key):
+    value = row.get(key)
+    return str(value).strip() if value is not None else ''
+
+def _names(value):
+    """The names in a ";"-separated string or a list, or None when the value is neither."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(';')
+    elif not isinstance(value, list):
+        return None
+    return [str(name).strip() for name in value if str(name).strip()]
+
+def _id(value):
+    """A venue id as an int, or None unless it is a whole number an id column can hold."""
+    try:
+        id = int(value)
+    except ValueError:
+        return None
+    return id if 1 <= id <= MAX_ID else None
+
+def _date(row, key):
+    value = _text(row, key)
+    return date.fromisoformat(value) if value else None
+
+def _venues(chunk):
+    """{id: id} and {name: [ids]} for every venue a chunk names, in one query."""
+    ids = {_id(_text(row, 'venue_id')) for _, row in chunk if _text(row, 'venue_id')} - {None}
+    names = {_text(row, 'venue') for _, row in chunk if _text(row, 'venue')}
+    by_id, by_name = {}, {}
+    if ids or names:
+        for id, name in db.session.query(Venue.id, Venue.name).filter(Venue.id.in_(ids) | Venue.name.in_(names)):
+            by_id[id] = id
+            by_name.setdefault(name, []).append(id)
+    return by_id, by_name
+
+def _setters(chunk):
+    usernames = {_text(row, 'setter') for _, row in chunk if _text(row, 'setter')}
+    if not usernames:
+        return {}
+    return dict(db.session.query(User.username, User.id).filter(User.username.in_(usernames)))
+
+def _check(chunk, styles, tags, result):
+    """The chunk's rows that can be imported, as (route values, style ids, tag ids); the rest go to `result`."""
+    venues_by_id, venues_by_name = _venues(chunk)
+    setters = _setters(chunk)
+    routes = []
+    for line, row in chunk:
+        errors = []
+        name, grade = _text(row, 'name'), _text(row, 'grade')
+        if not 1 <= len(name) <= 80:
+            errors.append('name must be 1 to 80 characters')
+        parsed = parse_grade(grade) if len(grade) <= 10 else None
+        if not parsed:
+            errors.append(f'unrecognised grade {grade!r}')
+        venue_id, venue = _text(row, 'venue_id'), _text(row, 'venue')
+        if venue_id:
+            venue_id = venues_by_id.get(_id(venue_id))
+            if venue_id is None:
+                errors.append(f'no venue with id {_text(row, "venue_id")}')
+        elif len(venues_by_name.get(venue, [])) == 1:
+            venue_id, = venues_by_name[venue]
+        elif venue in venues_by_name:
+            errors.append(f'more than one venue is called {venue!r}, use venue_id')
+        else:
+            errors.append(f'no venue called {venue!r}' if venue else 'venue or venue_id is required')
+        setter = _text(row, 'setter')
+        if setter and setter not in setters:
+            errors.append(f'no user called {setter!r}')
+        dates = {}
+        for key in ('route_set_date', 'route_takedown_date'):
+            try:
+                dates[key] = _date(row, key)
+            except ValueError:
+                errors.append(f'{key} must be YYYY-MM-DD')
+        style_names, tag_names = _names(row.get('styles')), _names(row.get('tags'))
+        for key, names in (('styles', style_names), ('tags', tag_names)):
+            if names is None:
+                errors.append(f'{key} must be a list of names')
+        style_names, tag_names = style_names or [], tag_names or []
+        unknown = [style for style in style_names if style.lower() not in styles] \
+            + [tag for tag in tag_names if tag.lower() not in tags]
+        if unknown:
+            errors.append(f'unknown styles or tags: {", ".join(unknown)}')
+        if errors:
+            result.add_error(line, '; '.join(errors))
+            continue
+        routes.append((dict(
+            venue_id=venue_id,
+            setter_id=setters.get(setter),
+            name=name,
+            grade=grade,
+            grade_scale=parsed.scale,
+            grade_difficulty=parsed.difficulty,
+            photo_url=_text(row, 'photo_url') or NO_IMAGE,
+            **dates,
+        ), sorted({styles[style.lower()] for style in style_names}), sorted({tags[tag.lower()] for tag in tag_names})))
+    return routes
+
+##########################################
+#           Writing                      #
+##########################################
+
+def _copy(table, columns, rows):
+    """Postgres COPY of `rows` (tuples in `columns` order) into `table`, through the session's connection."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows) # None goes out as an unquoted empty field, which COPY reads as NULL
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f'COPY {table.name} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+def _write(routes, result):
+    if not routes:
+        return
+    stats_table = RouteStats.__table__
+    stats_columns = [column.name for column in stats_table.columns if column.name != 'route_id']
+    if db.session.get_bind().dialect.name == 'postgresql':
+        ids = [id for id, in db.session.execute(
+            "SELECT nextval(pg_get_serial_sequence('route', 'id')) FROM generate_series(1, :count)",
+            {'count': len(routes)})]
+        route_columns = ['id', *routes[0][0]]
+        _copy(Route.__table__, route_columns, [(id, *values.values()) for id, (values, _, _) in zip(ids, routes)])
+        _copy(stats_table, ['route_id', *stats_columns], [(id, *[0] * len(stats_columns)) for id in ids])
+        _copy(route_styles_table, ['route_id', 'style_id'],
+            [(id, style_id) for id, (_, style_ids, _) in zip(ids, routes) for style_id in style_ids])
+        _copy(route_tags_table, ['route_id', 'tag_id'],
+            [(id, tag_id) for id, (_, _, tag_ids) in zip(ids, routes) for tag_id in tag_ids])
+    else:
+        # no portable way to get a batch's ids back, so routes go one INSERT each (still one transaction)
+        ids = [db.session.execute(Route.__table__.insert(), values).inserted_primary_key[0] for values, _, _ in routes]
+        db.session.execute(stats_table.insert(), [dict(route_id=id, **dict.fromkeys(stats_columns, 0)) for id in ids])
+        style_rows = [dict(route_id=id, style_id=style_id) for id, (_, style_ids, _) in zip(ids, routes)
+            for style_id in style_ids]
+        tag_rows = [dict(route_id=id, tag_id=tag_id) for id, (_, _, tag_ids) in zip(ids, routes) for tag_id in tag_ids]
+        if style_rows:
+            db.session.execute(route_styles_table.insert(), style_rows)
+        if tag_rows:
+            db.session.execute(route_tags_table.insert(), tag_rows)
+    result.imported += len(routes)
+    result.venue_ids.update(values['venue_id'] for values, _, _ in routes)
+
+def import_routes(stream, format, dry_run=False):
+    """Import every route in a text `stream` ('csv' or 'json'), skipping rows with errors. Returns an ImportResult.
+
+    With `dry_run` the rows are only checked. Raises RouteImportError when the
+    file can't be read at all, leaving the database untouched.
+    """
+    result = ImportResult()
+    styles = {row.style.lower(): row.id for row in lookup_rows('style')}
+    tags = {row.tag.lower(): row.id for row in lookup_rows('tag')}
+
+    def flush(chunk):
+        routes = _check(chunk, styles, tags, result)
+        if dry_run:
+            result.imported += len(routes)
+        else:
+            _write(routes, result)
+
+    chunk = []
+    try:
+        for line, row, error in read_rows(stream, format):
+            if error:
+                result.add_error(line, error)
+                continue
+            chunk.append((line, row))
+            if len(chunk) == CHUNK:
+                flush(chunk)
+                chunk = []
+        flush(chunk)
+    except UnicodeDecodeError:
+        db.session.rollback()
+        raise RouteImportError('The file is not UTF-8 text.')
+    except csv.Error as error:
+        db.session.rollback()
+        raise RouteImportError(f'The file is not valid CSV: {error}.')
+    except Exception:
+        db.session.rollback()
+        raise
+    result.errors.sort() # rows that didn't parse are reported before the chunk they were in is checked
+    if dry_run:
+        db.session.rollback()
+        return result
+    db.session.commit()
+    invalidate_pages('venues', *(f'venue:{venue_id}:routes' for venue_id in sorted(result.venue_ids)))
+    return result
@@ -0,0 +1,271 @@
+"""Venue and site-wide leaderboards over all time, the last 30 days and the last 7 days.
+
+Boards rank climbers by sends (every ascent but an abandoned one), flashes,
+onsights, and their hardest boulder and sport sends by normalised grade. Rather
+than scanning Ascent joined to Route, each climber has a LeaderboardBucket of
+counters per venue they sent at and one for every venue together
+(ALL_VENUES), each kept once for all time (ALL_TIME) and once per send date in
+the last DAILY_DAYS days:
+
+- Logging an ascent moves its four buckets with one UPDATE in the same
+  transaction, plus one INSERT for buckets that don't exist yet.
+- Deleting one moves them back. A bucket whose hardest send it was gets the
+  next hardest from that climber's remaining ascents, in the same UPDATE.
+- Editing a route's venue or grade takes its ascents out of the buckets
+  and puts them back afterwards, a few set-based statements either way.
+- A board is one query on the bucket primary key: a row per climber for all
+  time, or the window's daily rows summed per climber.
+
+Daily buckets older than DAILY_DAYS are never read again. `flask
+prune-leaderboards` drops them and `flask rebuild-leaderboards` recomputes
+every bucket from the Ascent table.
+"""
+from collections import namedtuple
+from datetime import date, timedelta
+from sqlalchemy import and_, case, desc, exists, func, literal, or_, select
+from climbunity_app.extensions import db
+from climbunity_app.grades import BOULDER, SPORT, grade_label
+from climbunity_app.models import Ascent, LeaderboardBucket, Route, SendType, User
+
+ALL_VENUES = 0
+ALL_TIME = date(1, 1, 1)
+DAILY_DAYS = 30
+
+WINDOWS = {'all': None, '30d': 30, '7d': 7} # days, None for all time
+Board = namedtuple('Board', ['column', 'title', 'scale'])
+BOARDS = {
+    'sends': Board('ascent_count', 'Most sends', None),
+    'flashes': Board('flash_count', 'Most flashes', None),
+    'onsights': Board('onsight_count', 'Most onsights', None),
+    'hardest_boulder': Board('hardest_boulder', 'Hardest boulder', BOULDER),
+    'hardest_sport': Board('hardest_sport', 'Hardest sport climb', SPORT),
+}
+COUNTERS = ['ascent_count', 'flash_count', 'onsight_count']
+HARDEST = {BOULDER: 'hardest_boulder', SPORT: 'hardest_sport'}
+
+bucket_table = LeaderboardBucket.__table__
+# the subqueries below read routes through an alias, so a route id subquery
+# passed in by deletes.py can't correlate with them
+route_table = Route.__table__.alias('leaderboard_route')
+
+Standing = namedtuple('Standing', ['rank', 'user_id', 'username', 'value'])
+
+def _send_type(value):
+    # unflushed ascents still hold the raw form value (the enum name)
+    return SendType[value] if isinstance(value, str) else value
+
+def _deltas(ascent, route, step):
+    """The counters an ascent moves by `step`, and the (column, difficulty) of its grade if it counts as hardest."""
+    send_type = _send_type(ascent.send_type)
+    if send_type is None or send_type == SendType.ABANDON:
+        return {}, None
+    deltas = {'ascent_count': step}
+    if send_type == SendType.FLASH:
+        deltas['flash_count'] = step
+    elif send_type == SendType.ONSIGHT:
+        deltas['onsight_count'] = step
+    hardest = None
+    if route.grade_scale in HARDEST and route.grade_difficulty is not None:
+        hardest = HARDEST[route.grade_scale], route.grade_difficulty
+    return deltas, hardest
+
+def _cutoff(days):
+    return date.today() - timedelta(days=days - 1)
+
+def _bucket_keys(ascent, venue_id):
+    """(venue ids, days) of the buckets an ascent falls in."""
+    days = [ALL_TIME]
+    if ascent.send_date is not None and ascent.send_date >= _cutoff(DAILY_DAYS):
+        days.append(ascent.send_date)
+    return [venue_id, ALL_VENUES], days
+
+def _is_send():
+    return Ascent.send_type != SendType.ABANDON # NULL send types fall out too
+
+def _covers_bucket():
+    """The ascents (joined to route_table) that count towards the bucket row being updated."""
+    return and_(
+        Ascent.user_id == bucket_table.c.user_id,
+        or_(bucket_table.c.venue_id == ALL_VENUES, bucket_table.c.venue_id == route_table.c.venue_id),
+        or_(bucket_table.c.day == ALL_TIME, bucket_table.c.day == Ascent.send_date),
+    )
+
+def _hardest_left(scale, *conditions):
+    """The bucket's hardest `scale` send among the ascents matching `conditions`, as a correlated subquery."""
+    return select([func.max(route_table.c.grade_difficulty)]) \
+        .select_from(Ascent.__table__.join(route_table, route_table.c.id == Ascent.route_id)) \
+        .where(and_(_covers_bucket(), _is_send(), route_table.c.grade_scale == scale, *conditions)) \
+        .as_scalar()
+
+##########################################
+#           Incremental upkeep           #
+##########################################
+
+def record_leaderboard_ascent(ascent, route):
+    """Add a newly logged ascent on `route` to its climber's buckets (caller commits)."""
+    deltas, hardest = _deltas(ascent, route, 1)
+    if not deltas:
+        return
+    venue_ids, days = _bucket_keys(ascent, route.venue_id)
+    values = {column: bucket_table.c[column] + delta for column, delta in deltas.items()}
+    if hardest:
+        column, difficulty = hardest
+        current = bucket_table.c[column]
+        values[column] = case([(or_(current.is_(None), current < difficulty), difficulty)], else_=current)
+    where = and_(bucket_table.c.user_id == ascent.user_id, bucket_table.c.venue_id.in_(venue_ids),
+        bucket_table.c.day.in_(days))
+    result = db.session.execute(bucket_table.update().where(where).values(values))
+    if result.rowcount == len(venue_ids) * len(days):
+        return
+    keys = select([bucket_table.c.venue_id, bucket_table.c.day]).where(where)
+    existing = {tuple(key) for key in db.session.execute(keys)}
+    row = dict(dict.fromkeys(COUNTERS, 0), **deltas)
+    if hardest:
+        row[hardest[0]] = hardest[1]
+    db.session.execute(bucket_table.insert(), [dict(row, venue_id=venue_id, day=day, user_id=ascent.user_id)
+        for venue_id in venue_ids for day in days if (venue_id, day) not in existing])
+
+def discard_leaderboard_ascent(ascent, route):
+    """Remove a deleted ascent on `route` from its climber's buckets (caller commits)."""
+    deltas, hardest = _deltas(ascent, route, -1)
+    if not deltas:
+        return
+    venue_ids, days = _bucket_keys(ascent, route.venue_id)
+    values = {column: bucket_table.c[column] + delta for column, delta in deltas.items()}
+    if hardest:
+        column, difficulty = hardest
+        current = bucket_table.c[column]
+        values[column] = case([(current <= difficulty, _hardest_left(route.grade_scale, Ascent.id != ascent.id))],
+            else_=current)
+    db.session.execute(bucket_table.update()
+        .where(and_(bucket_table.c.user_id == ascent.user_id, bucket_table.c.venue_id.in_(venue_ids),
+            bucket_table.c.day.in_(days)))
+        .values(values))
+
+def _counted(on_routes, *conditions):
+    """How many of the bucket's sends are on the routes, as a correlated subquery."""
+    return select([func.count(Ascent.id)]) \
+        .select_from(Ascent.__table__.join(route_table, route_table.c.id == Ascent.route_id)) \
+        .where(and_(_covers_bucket(), _is_send(), on_routes, *conditions)) \
+        .as_scalar()
+
+def _route_counts(on_routes, step):
+    """The bucket counters moved by `step` times the sends on the routes."""
+    return {
+        'ascent_count': bucket_table.c.ascent_count + step * _counted(on_routes),
+        'flash_count': bucket_table.c.flash_count + step * _counted(on_routes, Ascent.send_type == SendType.FLASH),
+        'onsight_count': bucket_table.c.onsight_count
+            + step * _counted(on_routes, Ascent.send_type == SendType.ONSIGHT),
+    }
+
+def leaderboard_route_deletes(route_ids):
+    """Statements taking the ascents on `route_ids` (ids or a subquery) out of the buckets; run before they go."""
+    on_routes = Ascent.route_id.in_(route_ids)
+    climbers = select([Ascent.user_id]).where(on_routes)
+    return [bucket_table.update().where(bucket_table.c.user_id.in_(climbers)).values(
+        **_route_counts(on_routes, -1),
+        **{column: _hardest_left(scale, ~on_routes) for scale, column in HARDEST.items()},
+    )]
+
+def leaderboard_route_adds(route_ids):
+    """Statements putting the ascents on `route_ids` back in the buckets, once the routes' venue or grade has changed.
+
+    Together with leaderboard_route_deletes, run before the change, this moves
+    an edited route's ascents between buckets: missing buckets are inserted
+    empty, then every bucket of the route's climbers is topped up.
+    """
+    on_routes = Ascent.route_id.in_(route_ids)
+    statements = []
+    for per_venue in (True, False):
+        for daily in (False, True):
+            venue_id = route_table.c.venue_id if per_venue else literal(ALL_VENUES)
+            day = Ascent.send_date if daily else literal(ALL_TIME, db.Date)
+            present = exists().where(and_(bucket_table.c.venue_id == venue_id, bucket_table.c.day == day,
+                bucket_table.c.user_id == Ascent.user_id))
+            empty = [literal(0).label(column) for column in COUNTERS]
+            keys = select([venue_id, day, Ascent.user_id, *empty]).distinct() \
+                .select_from(Ascent.__table__.join(route_table, route_table.c.id == Ascent.route_id)) \
+                .where(and_(on_routes, _is_send(), ~present))
+            if daily:
+                keys = keys.where(Ascent.send_date >= _cutoff(DAILY_DAYS))
+            statements.append(bucket_table.insert().from_select(['venue_id', 'day', 'user_id', *COUNTERS], keys))
+    climbers = select([Ascent.user_id]).where(on_routes)
+    statements.append(bucket_table.update().where(bucket_table.c.user_id.in_(climbers)).values(
+        **_route_counts(on_routes, 1),
+        **{column: _hardest_left(scale) for scale, column in HARDEST.items()},
+    ))
+    return statements
+
+##########################################
+#           Rebuilding                   #
+##########################################
+
+def _total(condition):
+    return func.coalesce(func.sum(case([(condition, 1)], else_=0)), 0)
+
+def _hardest(scale):
+    return func.max(case([(Route.grade_scale == scale, Route.grade_difficulty)]))
+
+def _bucket_rows(per_venue, daily):
+    """INSERT ... SELECT of one kind of bucket, aggregated from the Ascent table."""
+    venue_id = Route.venue_id if per_venue else literal(ALL_VENUES)
+    day = Ascent.send_date if daily else literal(ALL_TIME, db.Date)
+    query = select([
+        venue_id, day, Ascent.user_id,
+        func.count(Ascent.id),
+        _total(Ascent.send_type == SendType.FLASH),
+        _total(Ascent.send_type == SendType.ONSIGHT),
+        _hardest(BOULDER),
+        _hardest(SPORT),
+    ]).select_from(Ascent.__table__.join(Route.__table__)).where(_is_send())
+    if daily:
+        query = query.where(Ascent.send_date >= _cutoff(DAILY_DAYS))
+    query = query.group_by(*[column for column, grouped in [(Route.venue_id, per_venue), (Ascent.send_date, daily)]
+        if grouped], Ascent.user_id)
+    columns = ['venue_id', 'day', 'user_id', *COUNTERS, 'hardest_boulder', 'hardest_sport']
+    return bucket_table.insert().from_select(columns, query)
+
+def rebuild_leaderboards():
+    """Recompute every bucket from the Ascent table in one set-based pass per kind. Returns the bucket count."""
+    db.session.execute(bucket_table.delete())
+    for per_venue in (True, False):
+        for daily in (False, True):
+            db.session.execute(_bucket_rows(per_venue, daily))
+    db.session.commit()
+    return db.session.query(func.count()).select_from(bucket_table).scalar()
+
+def prune_leaderboards():
+    """Drop the daily buckets no window reaches any more. Returns how many went."""
+    result = db.session.execute(bucket_table.delete()
+        .where(and_(bucket_table.c.day > ALL_TIME, bucket_table.c.day < _cutoff(DAILY_DAYS))))
+    db.session.commit()
+    return result.rowcount
+
+##########################################
+#           Reading                      #
+##########################################
+
+def leaderboard(board, window, venue_id=ALL_VENUES, limit=20):
+    """The top `limit` Standings on a board over a window, at one venue or (ALL_VENUES) everywhere.
+
+    Values are counts, or grade labels for the hardest boards. Ties share a
+    rank and are listed by username.
+    """
+    column, _, scale = BOARDS[board]
+    days = WINDOWS[window]
+    value = bucket_table.c[column]
+    value = func.max(value) if scale else func.sum(value)
+    query = select([User.id, User.username, value.label('value')]) \
+        .select_from(bucket_table.join(User.__table__, User.id == bucket_table.c.user_id)) \
+        .where(bucket_table.c.venue_id == venue_id) \
+        .where(bucket_table.c.day == ALL_TIME if days is None else bucket_table.c.day >= _cutoff(days)) \
+        .group_by(User.id, User.username) \
+        .having(value.isnot(None) if scale else value > 0) \
+        .order_by(desc('value'), User.username) \
+        .limit(limit)
+    standings, rank, previous = [], 0, None
+    for number, (user_id, username, total) in enumerate(db.session.execute(query), 1):
+        if total != previous:
+            rank, previous = number, total
+        standings.append(Standing(rank, user_id, username, grade_label(scale, total) if scale else int(total)))
+    return standings
@@ -0,0 +1,128 @@
+"""Process-wide copies of the static lookup tables, Style and Tag.
+
+The forms offering styles and tags and the pages listing them read these
+copies instead of querying the tables on every render and validation. Each
+table has a version in LookupVersion; any flush that adds, edits or deletes a
+Style or Tag bumps it in the same transaction. Every worker compares its copy
+with the stored versions at most every LOOKUP_VERSION_CHECK_SECONDS (one
+primary key query for both tables) and reloads a table whose version moved,
+so a change made in any process shows up everywhere without a restart. After
+editing the tables outside the ORM, run `flask bump-lookups`.
+
+The cached rows are detached instances: read their columns freely, but pass
+them through `attached` before putting them in a relationship.
+"""
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from climbunity_app.extensions import db
+from climbunity_app.models import LookupVersion, Style, Tag
+from climbunity_app.replicas import primary_reads
+
+LOOKUP_MODELS = {'style': Style, 'tag': Tag}
+
+class LookupTable(object):
+    """One lookup table's rows in id order, as loaded at `version`."""
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.rows = rows
+        self.by_id = {row.id: row for row in rows}
+
+_tables = {}
+_versions = {'current': None, 'checked_at': None}
+_lock = threading.Lock()
+
+def _load(model):
+    columns = model.__table__.columns
+    rows = []
+    for values in db.session.query(*columns).order_by(model.id):
+        row = model(**{column.key: value for column, value in zip(columns, values)})
+        make_transient_to_detached(row)
+        rows.append(row)
+    return rows
+
+def stored_versions():
+    """{name: version} as stored in LookupVersion, 0 for tables never bumped."""
+    versions = dict.fromkeys(LOOKUP_MODELS, 0)
+    versions.update(db.session.query(LookupVersion.name, LookupVersion.version))
+    return versions
+
+def lookup_table(name):
+    """The process's LookupTable for 'style' or 'tag', reloaded when its stored version has moved."""
+    now = time.monotonic()
+    # a copy loaded from a lagging replica would be kept as the newer version until the next bump
+    with _lock, primary_reads():
+        checked_at = _versions['checked_at']
+        if checked_at is None or now - checked_at >= current_app.config['LOOKUP_VERSION_CHECK_SECONDS']:
+            _versions['current'] = stored_versions()
+            _versions['checked_at'] = now
+        version = _versions['current'][name]
+        table = _tables.get(name)
+        if table is None or table.version != version:
+            table = _tables[name] = LookupTable(version, _load(LOOKUP_MODELS[name]))
+        return table
+
+def lookup_rows(name):
+    """Every row of a lookup table, in id order."""
+    return lookup_table(name).rows
+
+def attached(rows):
+    """Cached rows as instances of the current session, without querying."""
+    return [db.session.merge(row, load=False) for row in rows]
+
+def lookups_by_owner(name, owner_column, owner_ids):
+    """{owner id: [cached rows]} through an association table, one query on it alone.
+
+    e.g. `lookups_by_owner('style', user_styles_table.c.user_id, [1, 2])`.
+    """
+    owned = {owner_id: [] for owner_id in owner_ids}
+    if not owned:
+        return owned
+    table = lookup_table(name)
+    lookup_column = owner_column.table.c[f'{name}_id']
+    rows = db.session.query(owner_column, lookup_column) \
+        .filter(owner_column.in_(list(owned)), lookup_column != None) \
+        .order_by(owner_column, lookup_column)
+    for owner_id, lookup_id in rows:
+        if lookup_id in table.by_id:
+            owned[owner_id].append(table.by_id[lookup_id])
+    return owned
+
+def bump_lookup_versions(session, names):
+    """Give lookup tables new versions, in `session`'s transaction."""
+    versions = LookupVersion.__table__
+    for name in sorted(names):
+        updated = session.execute(versions.update().where(versions.c.name == name)
+            .values(version=versions.c.version + 1))
+        if not updated.rowcount:
+            session.execute(versions.insert().values(name=name, version=1))
+    session.info['lookups_changed'] = True
+
+def reset_lookups():
+    """Forget this process's copies, so the next read reloads them."""
+    with _lock:
+        _tables.clear()
+        _versions['checked_at'] = None
+
+@event.listens_for(db.session, 'before_flush')
+def bump_changed_lookups(session, flush_context, instances):
+    changed = {name for name, model in LOOKUP_MODELS.items()
+        if any(isinstance(instance, model) for instance in list(session.new) + list(session.deleted))
+        or any(isinstance(instance, model) and session.is_modified(instance, include_collections=False)
+            for instance in session.dirty)}
+    if changed:
+        bump_lookup_versions(session, changed)
+
+@event.listens_for(db.session, 'after_commit')
+def recheck_lookups(session):
+    # this process sees its own change right away, the others at their next check
+    if session.info.pop('lookups_changed', False):
+        with _lock:
+            _versions['checked_at'] = None
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_lookup_changes(session):
+    session.info.pop('lookups_changed', None)
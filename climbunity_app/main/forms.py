@@ -1,11 +1,15 @@
 from datetime import datetime
 from flask_wtf import FlaskForm
-from wtforms import StringField, SelectField, SubmitField, FloatField, PasswordField, IntegerField, RadioField, SelectMultipleField
+from flask_wtf.file import FileField, FileAllowed, FileRequired
+from wtforms import StringField, SelectField, SubmitField, FloatField, PasswordField, IntegerField, RadioField, SelectMultipleField, BooleanField
 from wtforms.ext.sqlalchemy.fields import QuerySelectField, QuerySelectMultipleField
 from wtforms.validators import DataRequired, Length, URL, ValidationError, NumberRange
 from climbunity_app.utils import FormEnum
+from climbunity_app.fields import LookupSelectMultipleField, ModelSelectField, ModelSelectMultipleField
+from climbunity_app.search import SORT_CHOICES
+from climbunity_app.grades import parse_grade
 from climbunity_app.models import *
-from climbunity_app.extensions import app, db, bcrypt
+from climbunity_app.extensions import db, bcrypt
 from wtforms.fields.html5 import DateField, TimeField, DateTimeField, DateTimeLocalField
 # from flask_login import current_user
 
@@ -39,27 +43,57 @@ class RouteForm(FlaskForm):
             DataRequired(), 
             Length(min=1, max=80, message="Your route name needs to be betweeen 1 and 80 characters.")
         ])
-    venue_id = QuerySelectField('Gym / Crag',
-        query_factory=lambda: Venue.query,
+    venue_id = ModelSelectField('Gym / Crag',
+        model=Venue,
+        search_endpoint='api.search_venues',
         validators=[DataRequired()]
         )
-    setter_id = QuerySelectField('Route Setter',
-        query_factory=lambda: User.query)
-    grade = StringField('Route Grade', validators=[Length(max=10, message="Please input a simple YDS or V-grade entry, maximum 10 characters.")]) 
+    setter_id = ModelSelectField('Route Setter',
+        model=User,
+        search_endpoint='api.search_users')
+    grade = StringField('Route Grade', validators=[Length(max=10, message="Please input a YDS, V, French or Font grade, maximum 10 characters.")]) 
     photo_url = StringField('Photo URL')
     route_set_date = DateField('Route Set Date')
     route_takedown_date = DateField('Projected Route Takedown Date')
-    route_styles = QuerySelectMultipleField('What type of route is this?',
-        query_factory=lambda: Style.query)
-    route_tags = QuerySelectMultipleField('Apply tags to this route',
-        query_factory=lambda: Tag.query)
+    route_styles = LookupSelectMultipleField('What type of route is this?', lookup='style')
+    route_tags = LookupSelectMultipleField('Apply tags to this route', lookup='tag')
     submit = SubmitField('Submit')
 
+    def validate_grade(self, grade):
+        if not parse_grade(grade.data):
+            raise ValidationError('Please input a YDS (5.10a), V (V4), French (7a+) or Font (f7A+) grade.')
+
+class RouteImportForm(FlaskForm):
+    """Form for uploading a file of routes (see climbunity_app/imports.py)."""
+    routes_file = FileField('Routes file', validators=[
+        FileRequired(),
+        FileAllowed(['csv', 'json', 'ndjson', 'jsonl'], message="Please upload a .csv, .json or .ndjson file.")
+    ])
+    dry_run = BooleanField('Only check the file, import nothing')
+    submit = SubmitField('Import')
+
+class RouteSearchForm(FlaskForm):
+    """Filters for the route search page, submitted as a GET query string (see climbunity_app/search.py)"""
+    class Meta:
+        csrf = False
+
+    venue = ModelSelectField('Venue',
+        model=Venue,
+        search_endpoint='api.search_venues')
+    style = LookupSelectMultipleField('Any of these styles', lookup='style')
+    tag = LookupSelectMultipleField('All of these tags', lookup='tag')
+    grade = StringField('Grades (comma separated)')
+    scale = SelectField('Discipline', choices=[('', 'Any'), ('sport', 'Sport'), ('boulder', 'Boulder')])
+    min_grade = StringField('From grade')
+    max_grade = StringField('To grade')
+    sort = SelectField('Sort by', choices=SORT_CHOICES)
+    submit = SubmitField('Search')
+
 class AscentForm(FlaskForm):
     """Form for logging a route ascent"""
     ascent_date = DateField("Date of ascent", validators=[DataRequired()])
     ascent_type = SelectField("Type of ascent", choices=SendType.choices())
-    rating = RadioField("Personal route rating", choices=[0,1,2,3,4,5])
+    rating = RadioField("Personal route rating", choices=[0,1,2,3,4,5], coerce=int)
     comments = StringField("Comments", validators=[Length(max=1000, message="Please limit comments to 1000 characters.")])
     submit = SubmitField('Submit')
 
@@ -70,12 +104,14 @@ class AppointmentForm(FlaskForm):
         format='%Y-%m-%dT%H:%M',
         validators=[DataRequired()]
     )
-    venue_id = QuerySelectField('Venue', 
-        query_factory=lambda: Venue.query, 
+    venue_id = ModelSelectField('Venue',
+        model=Venue,
+        search_endpoint='api.search_venues',
         validators=[DataRequired()]
     )
-    additional_guests = QuerySelectMultipleField('Additional guests',
-        query_factory=lambda: User.query
+    additional_guests = ModelSelectMultipleField('Additional guests',
+        model=User,
+        search_endpoint='api.search_users'
     )
 
     def validate_appointment_datetime(self, appointment_datetime):
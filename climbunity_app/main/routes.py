@@ -1,16 +1,33 @@
+import io
 import os
 import time
 import random
 from os.path import exists
-from flask import Blueprint, request, render_template, redirect, url_for, flash
+from flask import Blueprint, current_app, request, render_template, redirect, url_for, flash, abort
 from flask_login import login_user, logout_user, login_required, current_user
 from datetime import date, datetime
+from sqlalchemy import func
 from climbunity_app.utils import FormEnum
+from climbunity_app.pagination import encode_cursor, decode_cursor, seek
+from climbunity_app.stats import record_ascent, discard_ascent
+from climbunity_app.leaderboards import (ALL_VENUES, BOARDS, WINDOWS, leaderboard, record_leaderboard_ascent,
+    discard_leaderboard_ascent, leaderboard_route_adds, leaderboard_route_deletes)
+from climbunity_app.deletes import delete_route_cascade, delete_venue_cascade
+from climbunity_app.feeds import ascent_feed, user_appointments, attending_appointment_ids
+from climbunity_app.search import search_args, search_routes, search_facets
+from climbunity_app.partners import partner_suggestions
+from climbunity_app.cache import cached_page, cache_page_tags, invalidate_pages
+from climbunity_app.replicas import reads_from_replica
+from climbunity_app.recommendations import queue_recommendation_refresh, recommended_routes, similar_routes
+from climbunity_app.lookups import lookups_by_owner
+from climbunity_app.associations import add_links, sync_links
+from climbunity_app.imports import RouteImportError, import_format, import_routes
+from climbunity_app.exports import ascent_export_query, venue_routes_export_query, export_response
 from climbunity_app.models import *
 from climbunity_app.main.forms import *
 from climbunity_app.auth.forms import *
 
-from climbunity_app.extensions import app, db, bcrypt
+from climbunity_app.extensions import db, bcrypt
 
 main = Blueprint("main", __name__)
 
@@ -20,10 +37,18 @@ main = Blueprint("main", __name__)
 
 # homepage route 
 @main.route('/')
+@cached_page('venues')
+@reads_from_replica
 def homepage():
-    all_venues = Venue.query.all()
-    routes = Route.query.all()
-    return render_template('home.html', routes=routes, all_venues=all_venues)
+    # one grouped query per page: venues plus their route counts, seeking past the last venue id
+    venue_listing = db.session.query(Venue, func.count(Route.id)) \
+        .outerjoin(Route, Route.venue_id == Venue.id) \
+        .group_by(Venue.id) \
+        .order_by(Venue.id)
+    cursor = decode_cursor(request.args.get('cursor'), int)
+    venue_listing, has_more = seek(venue_listing, [Venue.id], cursor, current_app.config['VENUES_PER_PAGE'])
+    next_cursor = encode_cursor(venue_listing[-1][0].id) if has_more else None
+    return render_template('home.html', venue_listing=venue_listing, next_cursor=next_cursor, paged=cursor is not None)
 
 ######################
 #  venue routes
@@ -43,12 +68,15 @@ def new_venue():
         )
         db.session.add(new_venue)
         db.session.commit()
+        invalidate_pages('venues')
         flash('New venue was created successfully.')
         return redirect(url_for('main.venue_detail', venue_id=new_venue.id))
     return render_template('new_venue.html', form=form)
 
 # read and update
 @main.route('/venue/<venue_id>', methods=['GET', 'POST'])
+@cached_page('venue:{venue_id}', 'venue:{venue_id}:routes')
+@reads_from_replica
 def venue_detail(venue_id):
     venue = Venue.query.get(venue_id)
     routes = Route.query.filter_by(venue_id=venue_id).all()
@@ -60,29 +88,28 @@ def venue_detail(venue_id):
         venue.open_hours = form.open_hours.data
         venue.description = form.description.data
         db.session.commit()
+        invalidate_pages('venues', f'venue:{venue.id}')
         flash('Venue was edited successfully.')
         return redirect(url_for('main.venue_detail', venue_id=venue.id))
 
     venue = Venue.query.get(venue_id)
     return render_template('venue_detail.html', form=form, routes=routes, venue=venue)
 
+# export the venue's routes with their ascent stats, streamed
+@main.route('/venue/<venue_id>/routes.<any(csv, ndjson):format>')
+@login_required
+def export_venue_routes(venue_id, format):
+    venue = Venue.query.get_or_404(venue_id)
+    return export_response(venue_routes_export_query(venue.id), format, f'venue-{venue.id}-routes')
+
 @main.route('/delete_venue/<venue_id>', methods=['POST'])
 @login_required
 def delete_venue(venue_id):
     venue = Venue.query.get(venue_id)
-    for appointment in venue.booked_appointments:
-        db.session.delete(appointment)
-        db.session.commit()
-    routes = Route.query.filter_by(venue_id=venue.id).all()
-    for route in routes:
-        for ascent in route.ascents_on_route:
-            db.session.delete(ascent)
-            db.session.commit()
-        db.session.delete(route)
-        db.session.commit()
-    db.session.delete(venue)
-    db.session.commit()
-    flash(f"{venue.name} deleted!")
+    venue_name = venue.name
+    delete_venue_cascade(venue.id)
+    invalidate_pages('venues', f'venue:{venue_id}', f'venue:{venue_id}:routes', 'leaderboard:all')
+    flash(f"{venue_name} deleted!")
     return redirect(url_for("main.homepage"))
 
 ######################
@@ -103,11 +130,12 @@ def new_route():
         new_route = Route(
             name=form.name.data,
             venue_id = form.venue_id.data.id,
-            setter_id = form.setter_id.data.id,
+            setter_id = form.setter_id.data.id if form.setter_id.data else None,
             grade=form.grade.data,
             photo_url=image_url,
             route_set_date=form.route_set_date.data,
             route_takedown_date=form.route_takedown_date.data,
+            stats=RouteStats(),
         )
         db.session.add(new_route)
         db.session.commit()
@@ -116,22 +144,45 @@ def new_route():
         for tag in form.route_tags.data:
             new_route.route_tags.append(tag)
         db.session.commit()
+        invalidate_pages('venues', f'venue:{new_route.venue_id}:routes')
         flash('New route was created successfully.')
         return redirect(url_for('main.route_detail', route_id=new_route.id))
     return render_template('new_route.html', form=form)
 
+# bulk create from a file, for reset days
+@main.route('/import_routes', methods=['GET', 'POST'])
+@login_required
+def upload_routes():
+    form = RouteImportForm()
+    result = None
+    if form.validate_on_submit():
+        upload = form.routes_file.data
+        try:
+            result = import_routes(io.TextIOWrapper(upload.stream, encoding='utf-8-sig'),
+                import_format(upload.filename), dry_run=form.dry_run.data)
+        except RouteImportError as error:
+            flash(str(error))
+        else:
+            verb = 'can be imported' if form.dry_run.data else 'imported'
+            flash(f'{result.imported} routes {verb}, {result.error_count} rows with errors.')
+    return render_template('import_routes.html', form=form, result=result)
+
 # read and update
 @main.route('/route/<route_id>', methods=['GET', 'POST'])
+@cached_page('route:{route_id}')
+@reads_from_replica
 def route_detail(route_id):
     route = Route.query.get(route_id)
+    cache_page_tags(f'venue:{route.venue_id}')
     route_venue = Venue.query.get(route.venue_id)
     setter = User.query.get(route.setter_id)
-    ratings = 0
-    rating = 0
-    if route.ascents_on_route:
-        for ascent in route.ascents_on_route:
-            ratings += ascent.send_rating
-        rating = ratings/len(route.ascents_on_route)
+    stats = RouteStats.query.get(route.id)
+    rating = stats.average_rating if stats else 0
+    recent_comments = Ascent.query \
+        .filter(Ascent.route_id == route.id, Ascent.send_comments != None, Ascent.send_comments != '') \
+        .order_by(Ascent.id.desc()) \
+        .limit(current_app.config['RECENT_COMMENTS_LIMIT']) \
+        .all()
     form = RouteForm(obj=route)
     if form.validate_on_submit():
         image_exists = os.path.exists(f'/static/img/{form.photo_url.data}')
@@ -139,32 +190,70 @@ def route_detail(route_id):
             image_url = form.photo_url.data
         else:
             image_url = '/static/img/no_image.jpeg'
+        old_venue_id = route.venue_id
+        # the leaderboards count the route's ascents by venue and grade: take them out, put them back after
+        moves_ascents = form.venue_id.data.id != route.venue_id or form.grade.data != route.grade
+        if moves_ascents:
+            for statement in leaderboard_route_deletes([route.id]):
+                db.session.execute(statement)
         route.name = form.name.data
         route.venue_id = form.venue_id.data.id
         route.grade = form.grade.data
         route.photo_url = image_url
         route.route_set_date = form.route_set_date.data
         route.route_takedown_date = form.route_takedown_date.data
-        route.possible_route_styles.extend(form.route_styles.data)
-        route.route_tags.extend(form.route_tags.data)
+        sync_links(route, 'possible_route_styles', form.route_styles.data)
+        sync_links(route, 'route_tags', form.route_tags.data)
+        if moves_ascents:
+            db.session.flush()
+            for statement in leaderboard_route_adds([route.id]):
+                db.session.execute(statement)
         db.session.commit()
+        leaderboards = [f'leaderboard:{old_venue_id}', f'leaderboard:{route.venue_id}', 'leaderboard:all']
+        invalidate_pages(f'route:{route.id}', f'venue:{old_venue_id}:routes', f'venue:{route.venue_id}:routes',
+            *(['venues'] if route.venue_id != old_venue_id else []), *(leaderboards if moves_ascents else []))
         flash('Route was edited successfully.')
         return redirect(url_for('main.route_detail', route_id=route.id, route_venue=route_venue, setter=setter, rating=rating))
     item = Route.query.get(route_id)
-    return render_template('route_detail.html', form=form, route=route, route_venue=route_venue, setter=setter, rating=rating)
+    similar = similar_routes(route.id, current_app.config['RECOMMENDATIONS_SHOWN'])
+    return render_template('route_detail.html', form=form, route=route, route_venue=route_venue, setter=setter, rating=rating, stats=stats, recent_comments=recent_comments, similar=similar)
+
+# search
+@main.route('/routes/search')
+@reads_from_replica
+def route_search():
+    form = RouteSearchForm(request.args)
+    form.validate() # resolves the venue; bad filters are just ignored below
+    filters, sort = search_args(request.args)
+    cursor = request.args.get('cursor')
+    results, next_cursor = search_routes(filters, sort, cursor, current_app.config['ROUTE_SEARCH_PAGE_SIZE'])
+    facets = None if cursor else search_facets(filters)
+
+    def search_url(**changes):
+        """This search with some arguments replaced (None drops one), back on the first page."""
+        args = request.args.to_dict(flat=False)
+        args.pop('cursor', None)
+        for name, value in changes.items():
+            if value is None:
+                args.pop(name, None)
+            else:
+                args[name] = value
+        return url_for('main.route_search', **args)
+
+    return render_template('route_search.html', form=form, filters=filters, results=results,
+        next_cursor=next_cursor, facets=facets, search_url=search_url)
 
 # delete
 @main.route('/delete_route/<route_id>', methods=['POST'])
 @login_required
 def delete_route(route_id):
     route = Route.query.get(route_id)
-    for ascent in route.ascents_on_route:
-        db.session.delete(ascent)
-        db.session.commit()
-    db.session.delete(route)
-    db.session.commit()
-    flash(f"{route.name} deleted!")
-    return redirect(url_for("main.venue_detail", venue_id=route.venue_id))
+    route_name, venue_id = route.name, route.venue_id
+    delete_route_cascade(route.id)
+    invalidate_pages('venues', f'route:{route_id}', f'venue:{venue_id}:routes', f'leaderboard:{venue_id}',
+        'leaderboard:all')
+    flash(f"{route_name} deleted!")
+    return redirect(url_for("main.venue_detail", venue_id=venue_id))
 
 ######################
 #  project list routes
@@ -176,7 +265,8 @@ def delete_route(route_id):
 @login_required
 def add_to_project_list(route_id):
     route = Route.query.get(route_id)
-    current_user.user_projects.append(route)
+    add_links(current_user._get_current_object(), 'user_projects', [route])
+    queue_recommendation_refresh(route.id)
     db.session.commit()
     flash(f"{route.name} added to project list")
     return redirect(url_for("main.route_detail", route_id = route.id, user_id=current_user.id))
@@ -187,6 +277,7 @@ def add_to_project_list(route_id):
 def remove_from_project_list(route_id):
     route = Route.query.get(route_id)
     current_user.user_projects.remove(route)
+    queue_recommendation_refresh(route.id)
     db.session.commit()
     flash(f"{route.name} removed from project list")
     return redirect(url_for("main.user_detail", user_id=current_user.id))
@@ -211,9 +302,12 @@ def log_ascent(route_id):
             send_rating = form.rating.data,
             send_comments = form.comments.data
         )
-        route.ascents_on_route.append(new_ascent)
         db.session.add(new_ascent)
+        record_ascent(new_ascent)
+        record_leaderboard_ascent(new_ascent, route)
+        queue_recommendation_refresh(route.id)
         db.session.commit()
+        invalidate_pages(f'route:{route.id}', f'leaderboard:{route.venue_id}', 'leaderboard:all')
         flash('New ascent was logged successfully.')
         return redirect(url_for('main.route_detail', route_id=route.id, venue=venue))
     return render_template('new_ascent.html', route_id=route.id, route=route, venue=venue, form=form)
@@ -224,12 +318,42 @@ def log_ascent(route_id):
 def delete_ascent(ascent_id):
     ascent = Ascent.query.get(ascent_id)
     route = Route.query.get(ascent.route_id)
-    route.ascents_on_route.remove(ascent)
+    discard_ascent(ascent)
+    discard_leaderboard_ascent(ascent, route)
+    queue_recommendation_refresh(ascent.route_id)
     db.session.delete(ascent)
     db.session.commit()
+    invalidate_pages(f'route:{route.id}', f'leaderboard:{route.venue_id}', 'leaderboard:all')
     flash(f"{route.name} removed from ascent list")
     return redirect(url_for("main.user_detail", user_id=current_user.id))
 
+######################
+#  leaderboard routes
+######################
+
+def leaderboard_context(venue_id):
+    """Template variables for a leaderboard page, picked with the `board` and `window` query arguments."""
+    board = request.args.get('board', 'sends')
+    window = request.args.get('window', 'all')
+    if board not in BOARDS or window not in WINDOWS:
+        abort(404)
+    standings = leaderboard(board, window, venue_id, current_app.config['LEADERBOARD_SIZE'])
+    return dict(board=board, window=window, boards=BOARDS, windows=WINDOWS, standings=standings)
+
+# every venue together
+@main.route('/leaderboard')
+@cached_page('leaderboard:all')
+@reads_from_replica
+def site_leaderboard():
+    return render_template('leaderboard.html', venue=None, **leaderboard_context(ALL_VENUES))
+
+@main.route('/venue/<venue_id>/leaderboard')
+@cached_page('venue:{venue_id}', 'leaderboard:{venue_id}')
+@reads_from_replica
+def venue_leaderboard(venue_id):
+    venue = Venue.query.get_or_404(venue_id)
+    return render_template('leaderboard.html', venue=venue, **leaderboard_context(venue.id))
+
 ######################
 #  profile routes
 ######################
@@ -237,31 +361,62 @@ def delete_ascent(ascent_id):
 # user creation route is in auth routes
 # display all profiles
 @main.route('/users', methods=['GET', 'POST'])
+@cached_page('users')
+@reads_from_replica
 def all_users():
     users = User.query.all()
-    return render_template('all_users.html', users=users)  
+    styles = lookups_by_owner('style', user_styles_table.c.user_id, [user.id for user in users])
+    return render_template('all_users.html', users=users, styles=styles)  
   
+def profile_context(user):
+    """Template variables shared by the profile pages: styles, first feed page and appointments,
+    plus partner suggestions and recommended routes on your own profile."""
+    feed, next_cursor = ascent_feed(user.id, limit=current_app.config['PROFILE_FEED_PAGE_SIZE'])
+    appointments = user_appointments(user.id)
+    joined_appointment_ids = set()
+    if current_user.is_authenticated and current_user != user:
+        joined_appointment_ids = attending_appointment_ids(
+            current_user.id, [appointment.id for appointment, _ in appointments])
+    styles = lookups_by_owner('style', user_styles_table.c.user_id, [user.id])[user.id]
+    context = dict(user=user, styles=styles, feed=feed, next_cursor=next_cursor,
+        appointments=appointments, joined_appointment_ids=joined_appointment_ids)
+    if current_user == user:
+        context['partners'] = partner_suggestions(user.id, current_app.config['PROFILE_PARTNER_SUGGESTIONS'])
+        context['recommended'] = recommended_routes(user.id, current_app.config['RECOMMENDATIONS_SHOWN'])
+    return context
+
 # read specific profile
 @main.route('/profile/<user_id>', methods=['GET', 'POST'])
+@reads_from_replica
 def user_detail(user_id):
-    routes = Route.query.all()
-    venues = Venue.query.all()
     user = User.query.get(user_id)
-    ascents = Ascent.query.filter_by(user_id=user_id).all() # fine for small data but should be built out to display only 3-5 results + option to see all on different page
     if current_user == user:
         form = SignUpForm(obj=user)
-        return render_template('user_detail.html', routes=routes, ascents=ascents, venues=venues, user=user, form=form)  
-    else:
-        user = User.query.get(user_id)
-    return render_template('user_detail.html', routes=routes, ascents=ascents, venues=venues, user=user)
+        return render_template('user_detail.html', form=form, **profile_context(user))
+    return render_template('user_detail.html', **profile_context(user))
+
+# "load more" for the profile ascent feed, returns just the next page of the feed
+@main.route('/profile/<user_id>/ascents')
+@reads_from_replica
+def user_ascent_feed(user_id):
+    user = User.query.get(user_id)
+    feed, next_cursor = ascent_feed(user.id, request.args.get('cursor'), current_app.config['PROFILE_FEED_PAGE_SIZE'])
+    return render_template('partials/ascent_feed_partial.html', user=user, feed=feed, next_cursor=next_cursor)
+
+# export a climber's own ascent history (admins can export anyone's), streamed
+@main.route('/profile/<user_id>/ascents.<any(csv, ndjson):format>')
+@login_required
+def export_user_ascents(user_id, format):
+    user = User.query.get_or_404(user_id)
+    if current_user != user and not current_user.is_admin:
+        abort(403)
+    return export_response(ascent_export_query(user.id), format, f'{user.username}-ascents')
 
 # update profile
     
 @main.route('/edit_profile/<user_id>', methods=['GET', 'POST'])
 def edit_user_detail(user_id):
-    routes = Route.query.all()
     user = User.query.get(user_id)
-    ascents = Ascent.query.filter_by(user_id=user_id).limit(5).all()
     form = EditProfileForm(obj=user)
     if current_user == user:
         if form.validate_on_submit():
@@ -269,16 +424,14 @@ def edit_user_detail(user_id):
             user.last_name = form.last_name.data
             user.address = form.address.data
             user.has_gear = form.has_gear.data
-            user.user_does_styles.clear()
-            user.user_does_styles.extend(form.climber_styles.data)
+            sync_links(user, 'user_does_styles', form.climber_styles.data)
             flash('User profile was edited successfully.')
             db.session.commit()
+            invalidate_pages('users')
         user = user.query.get(current_user.id)
         response = redirect(url_for("main.user_detail", user_id=user.id, form=form, follow_redirects=True))
         response_text = response.get_data(as_text=True)
-    else:
-        user = User.query.get(user_id)
-    return render_template('user_detail.html', routes=routes, ascents=ascents, user=user, form=form)
+    return render_template('user_detail.html', form=form, **profile_context(user))
 
 ######################
 #  appointment routes
@@ -298,7 +451,8 @@ def new_appointment():
         current_user.user_appointments.append(new_appointment) # append to creator event list
         if form.additional_guests.data:
             for guest in form.additional_guests.data:
-                guest.user_appointments.append(new_appointment)
+                if guest.id != current_user.id: # already on the list as the creator
+                    guest.user_appointments.append(new_appointment)
         venue = Venue.query.filter_by(id=new_appointment.venue_id).one()
         venue.booked_appointments.append(new_appointment)
         db.session.add(new_appointment)
@@ -312,7 +466,7 @@ def new_appointment():
 @login_required
 def join_appointment(appointment_id):
     appointment = Appointment.query.get(appointment_id)
-    current_user.user_appointments.append(appointment)
+    add_links(current_user._get_current_object(), 'user_appointments', [appointment])
     db.session.commit()
     flash(f"You've joined an appointment!")
     return redirect(url_for("main.user_detail", user_id=current_user.id))
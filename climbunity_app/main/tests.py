@@ -1,10 +1,30 @@
+import io
+import json
 import os
+import tempfile
+import time
 import unittest
-import app
-
-from datetime import date, datetime
-from climbunity_app.extensions import app, db, bcrypt
+from unittest.mock import patch
+
+from datetime import date, datetime, timedelta
+from flask import Flask
+from sqlalchemy import func
+from prometheus_client import REGISTRY
+from climbunity_app import create_app
+from climbunity_app.extensions import db, bcrypt
+from climbunity_app.cache import page_cache, PageCache, MemoryBackend, FileSystemBackend
+from climbunity_app.fragments import fragment_cache, fragment_key
+from climbunity_app.lookups import lookup_table, reset_lookups
+from climbunity_app.replicas import reset_replica_health
 from climbunity_app.models import *
+from climbunity_app.testing import assert_max_queries
+from climbunity_app.querystats import capture_queries
+from climbunity_app.feeds import ascent_feed
+from climbunity_app.imports import import_routes
+from climbunity_app.pagination import encode_cursor
+from climbunity_app.grades import parse_grade, grade_label
+from climbunity_app.leaderboards import ALL_VENUES, leaderboard, rebuild_leaderboards
+from climbunity_app import partners
 
 """
 Run these tests with the command:
@@ -17,6 +37,8 @@ python3 -m unittest discover instead (or this might just register zero tests bec
 # Setup
 #################################################
 
+app = create_app()
+
 def login(client, username, password):
     return client.post('/login', data=dict(
         username=username,
@@ -86,6 +108,51 @@ def create_ascent():
     db.session.add(a1)
     db.session.commit()
 
+def create_recommendation_fixture():
+    """me1 and me2 both loved Silence and Biographie; someone else climbed Silence and Action Directe."""
+    create_user()
+    create_another_user()
+    create_venue()
+    password_hash = bcrypt.generate_password_hash('password345', 4).decode('utf-8')
+    db.session.add(User(username='me3', password=password_hash, email='test345@test.com',
+        first_name='Third', last_name='User', address='345 Test. St', has_gear=False))
+    for name in ['Silence', 'Biographie', 'Action Directe']:
+        db.session.add(Route(venue_id=1, setter_id=1, name=name, grade='9a'))
+    db.session.commit()
+    for user_id, route_id, rating in [(1, 1, 5), (1, 2, 5), (2, 1, 4), (2, 2, 5), (3, 1, None), (3, 3, None)]:
+        db.session.add(Ascent(user_id=user_id, route_id=route_id, send_rating=rating))
+    db.session.commit()
+
+def create_leaderboard_fixture(client):
+    """me1 and me2 log sends at Rock Oasis (and me1 an abandoned try at Boulder Barn) over the last two months."""
+    create_user()
+    create_another_user()
+    create_venue()
+    db.session.add(Venue(name='Boulder Barn', address='Queen and Bathurst'))
+    db.session.commit()
+    for venue_id, name, grade in [(1, 'Crimp City', 'V5'), (1, 'Jug Haul', 'V3'), (1, 'Long Walk', '5.11a'),
+            (2, 'Roof Problem', 'V7')]:
+        db.session.add(Route(venue_id=venue_id, setter_id=1, name=name, grade=grade))
+    db.session.commit()
+    days_ago = lambda days: (date.today() - timedelta(days=days)).isoformat()
+    login(client, 'me1', 'password123')
+    for route_id, send_type, days in [(1, 'FLASH', 0), (2, 'REDPOINT', 10), (3, 'ONSIGHT', 60), (4, 'ABANDON', 0)]:
+        client.post(f'/log_ascent/{route_id}', data={'ascent_type': send_type, 'ascent_date': days_ago(days), 'rating': 3})
+    logout(client)
+    login(client, 'me2', 'password234')
+    client.post('/log_ascent/2', data={'ascent_type': 'FLASH', 'ascent_date': days_ago(1), 'rating': 4})
+    logout(client)
+
+def standings(board, window, venue_id=ALL_VENUES):
+    return [(standing.rank, standing.username, standing.value) for standing in leaderboard(board, window, venue_id)]
+
+def leaderboard_buckets():
+    """Every bucket holding a send, to compare the incremental upkeep with a rebuild."""
+    return sorted(tuple(row) for row in db.session.query(LeaderboardBucket.venue_id, LeaderboardBucket.day,
+        LeaderboardBucket.user_id, LeaderboardBucket.ascent_count, LeaderboardBucket.flash_count,
+        LeaderboardBucket.onsight_count, LeaderboardBucket.hardest_boulder, LeaderboardBucket.hardest_sport)
+        .filter(LeaderboardBucket.ascent_count > 0))
+
 def create_appointment():
     user = User.query.first()
     venue = Venue.query.first()
@@ -109,9 +176,20 @@ class MainTests(unittest.TestCase):
         app.config['WTF_CSRF_ENABLED'] = False
         app.config['DEBUG'] = False
         app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        app.config['VENUES_PER_PAGE'] = 20
+        app.config['PROFILE_FEED_PAGE_SIZE'] = 10
         self.app = app.test_client()
+        self.context = app.app_context()
+        self.context.push()
+        partners._index['current'] = None
         db.drop_all()
         db.create_all()
+        page_cache.clear()
+        fragment_cache.clear()
+        reset_lookups()
+
+    def tearDown(self):
+        self.context.pop()
  
     def test_homepage_logged_out(self):
         """Test that the venues show up on the homepage."""
@@ -162,6 +240,30 @@ class MainTests(unittest.TestCase):
         self.assertNotIn('Log In', response_text)
         self.assertNotIn('Sign Up', response_text)
 
+    def test_homepage_route_counts_and_pagination(self):
+        """Test that venues list their route counts and page by keyset."""
+        # Set up
+        create_user()
+        create_venue()
+        create_route()
+        db.session.add(Venue(name="Joe Rockheads", address="Liberty Village"))
+        db.session.commit()
+        app.config['VENUES_PER_PAGE'] = 1
+
+        response = self.app.get('/', follow_redirects=True)
+        response_text = response.get_data(as_text=True)
+        self.assertIn('Rock Oasis</a> - Number of tracked routes: 1', response_text)
+        self.assertNotIn('Joe Rockheads', response_text)
+        self.assertIn('More venues', response_text)
+
+        # follow the "More venues" link to the second page
+        next_link = response_text.split('More venues')[0].rsplit('href="', 1)[1].split('"')[0]
+        response = self.app.get(next_link.replace('&amp;', '&'), follow_redirects=True)
+        response_text = response.get_data(as_text=True)
+        self.assertIn('Joe Rockheads</a> - Number of tracked routes: 0', response_text)
+        self.assertNotIn('Rock Oasis', response_text)
+        self.assertNotIn('More venues', response_text)
+
     def test_venue_detail_logged_out(self):
         """Test that the book appears on its detail page."""
         # Set up
@@ -394,6 +496,170 @@ class MainTests(unittest.TestCase):
         response_text = response.get_data(as_text=True)
         self.assertIn('<p>Silence removed from project list</p>', response_text)
 
+    def test_association_writes_are_idempotent(self):
+        """Test that re-adding a project, rejoining and re-saving styles and tags never duplicate a pair."""
+        # Set up
+        create_user()
+        create_another_user()
+        create_venue()
+        create_route()
+        create_appointment()
+        db.session.add_all([Style(style='boulder'), Style(style='sport'), Tag(tag='crimpy')])
+        db.session.commit()
+        login(self.app, 'me2', 'password234')
+
+        for _ in range(2):
+            self.app.post('/add_to_project_list/1')
+            self.app.post('/join_appointment/1')
+            self.app.post('/route/1', data={'name': 'Silence', 'venue_id': 1, 'grade': '9c',
+                'route_styles': ['1', '2'], 'route_tags': ['1']})
+        self.assertEqual(db.session.query(project_lists_table).count(), 1)
+        self.assertEqual(db.session.query(appointment_guest_lists).count(), 1)
+        self.assertEqual(db.session.query(route_styles_table).count(), 2)
+
+        # a route edit replaces the styles with the ones picked
+        self.app.post('/route/1', data={'name': 'Silence', 'venue_id': 1, 'grade': '9c', 'route_styles': ['2']})
+        self.assertEqual([style.style for style in Route.query.get(1).possible_route_styles], ['sport'])
+        self.assertEqual(Route.query.get(1).route_tags, [])
+
+    def test_dedupe_associations(self):
+        """Test that a project list table from before its primary key is rebuilt without duplicates."""
+        # Set up
+        create_user()
+        create_venue()
+        create_route()
+        project_lists_table.drop(db.engine)
+        db.session.execute('CREATE TABLE user_project_lists (route_id INTEGER, user_id INTEGER)')
+        db.session.execute('INSERT INTO user_project_lists VALUES (1, 1), (1, 1), (1, 1), (NULL, 1)')
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['dedupe-associations'])
+        self.assertIn('user_project_lists: 4 rows -> 1', result.output)
+        self.assertIn('Rebuilt 1 association tables.', result.output)
+        self.assertEqual(db.session.execute('SELECT route_id, user_id FROM user_project_lists').fetchall(), [(1, 1)])
+        self.assertEqual([route.name for route in User.query.get(1).user_projects], ['Silence'])
+
+        result = app.test_cli_runner().invoke(args=['dedupe-associations'])
+        self.assertIn('Rebuilt 0 association tables.', result.output)
+
+    def test_import_routes_command(self):
+        """Test that `flask import-routes` writes good rows with grades, stats, styles and tags, and reports bad ones."""
+        # Set up
+        create_user()
+        create_venue()
+        db.session.add_all([Style(style='boulder'), Tag(tag='crimpy'), Tag(tag='slab')])
+        db.session.commit()
+        lookup_table('tag') # warm, to check the import leaves the lookup versions alone
+        versions = {version.name: version.version for version in LookupVersion.query}
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'wall.csv')
+        with open(path, 'w') as routes_file:
+            routes_file.write('name,grade,venue,setter,route_set_date,styles,tags\n'
+                'Pink Crimps,V4,Rock Oasis,me1,2024-07-01,boulder,Crimpy;slab\n'
+                'Green Slab,5.10a,Rock Oasis,,,,\n'
+                'Mystery,purple,Rock Oasis,,,,\n'
+                'Elsewhere,V2,Nowhere Gym,nobody,July,,jugs\n')
+
+        result = app.test_cli_runner().invoke(args=['import-routes', '--dry-run', path])
+        self.assertIn('Checked 2 routes, skipped 2 rows.', result.output)
+        self.assertEqual(Route.query.count(), 0)
+
+        result = app.test_cli_runner().invoke(args=['import-routes', path])
+        self.assertIn("line 4: unrecognised grade 'purple'", result.output)
+        self.assertIn("line 5: no venue called 'Nowhere Gym'; no user called 'nobody'; "
+            "route_set_date must be YYYY-MM-DD; unknown styles or tags: jugs", result.output)
+        self.assertIn('Imported 2 routes, skipped 2 rows.', result.output)
+        crimps = Route.query.filter_by(name='Pink Crimps').one()
+        self.assertEqual((crimps.venue_id, crimps.setter_id, crimps.route_set_date), (1, 1, date(2024, 7, 1)))
+        self.assertEqual((crimps.grade_scale, crimps.grade_difficulty), ('boulder', 4.0))
+        self.assertEqual([style.style for style in crimps.possible_route_styles], ['boulder'])
+        self.assertEqual(sorted(tag.tag for tag in crimps.route_tags), ['crimpy', 'slab'])
+        self.assertEqual(RouteStats.query.count(), 2)
+        self.assertEqual(crimps.stats.ascent_count, 0)
+        self.assertEqual({version.name: version.version for version in LookupVersion.query}, versions)
+
+    def test_import_routes_upload(self):
+        """Test that routes uploaded as NDJSON are imported and show up on the cached venue page."""
+        # Set up
+        create_user()
+        create_venue()
+        self.assertNotIn('Blue Roof', self.app.get('/venue/1').get_data(as_text=True)) # now cached
+        login(self.app, 'me1', 'password123')
+        upload = b'{"name": "Blue Roof", "grade": "V6", "venue_id": 1}\n{"name": "", "grade": "V1", "venue_id": 2}\n'
+
+        response = self.app.post('/import_routes', data={'routes_file': (io.BytesIO(upload), 'wall.ndjson')},
+            content_type='multipart/form-data', follow_redirects=True)
+        response_text = response.get_data(as_text=True)
+        self.assertIn('1 routes imported, 1 rows with errors.', response_text)
+        self.assertIn('Line 2: name must be 1 to 80 characters; no venue with id 2', response_text)
+        self.assertEqual(Route.query.one().name, 'Blue Roof')
+
+        response = self.app.post('/import_routes', data={'routes_file': (io.BytesIO(b'name'), 'wall.txt')},
+            content_type='multipart/form-data')
+        self.assertIn('Please upload a .csv, .json or .ndjson file.', response.get_data(as_text=True))
+
+        oversized = f'name,grade,venue_id\nHuge,V1,1\n"{"x" * 200000}",V1,1\n'.encode('utf-8')
+        response = self.app.post('/import_routes', data={'routes_file': (io.BytesIO(oversized), 'wall.csv')},
+            content_type='multipart/form-data', follow_redirects=True)
+        self.assertIn('The file is not valid CSV: field larger than field limit', response.get_data(as_text=True))
+        self.assertEqual(Route.query.count(), 1)
+        logout(self.app)
+        self.assertIn('Blue Roof', self.app.get('/venue/1').get_data(as_text=True))
+
+    def test_import_routes_malformed_rows(self):
+        """Test that rows with unusable styles, tags or venue ids are reported rather than failing the import."""
+        create_user()
+        create_venue()
+        db.session.add(Style(style='boulder'))
+        db.session.commit()
+        rows = [
+            {'name': 'Numbered', 'grade': 'V1', 'venue_id': 1, 'styles': 5},
+            {'name': 'Mapped', 'grade': 'V1', 'venue_id': 1, 'tags': {'crimpy': True}},
+            {'name': 'Superscript', 'grade': 'V1', 'venue_id': '\u00b2'},
+            {'name': 'Overflow', 'grade': 'V1', 'venue_id': '9' * 30},
+            {'name': 'Negative', 'grade': 'V1', 'venue_id': -1},
+            {'name': 'Fine', 'grade': 'V1', 'venue_id': 1, 'styles': ['boulder']},
+        ]
+        stream = io.StringIO(''.join(json.dumps(row) + '\n' for row in rows))
+
+        result = import_routes(stream, 'json')
+        self.assertEqual(result.errors, [
+            (1, 'styles must be a list of names'),
+            (2, 'tags must be a list of names'),
+            (3, 'no venue with id \u00b2'),
+            (4, f'no venue with id {"9" * 30}'),
+            (5, 'no venue with id -1'),
+        ])
+        self.assertEqual(result.imported, 1)
+        self.assertEqual(Route.query.one().name, 'Fine')
+
+    def test_seed_command(self):
+        """Test that `flask seed` fills an empty database deterministically, derived rows included."""
+        result = app.test_cli_runner().invoke(args=['seed', '--ascents', '500', '--seed', '3'])
+        self.assertIn('Seeded 3 venues, 30 routes, 20 users, 500 ascents, 5 appointments.', result.output)
+        first = [(ascent.user_id, ascent.route_id, ascent.send_rating) for ascent in Ascent.query.order_by(Ascent.id)]
+        self.assertEqual(db.session.query(func.sum(RouteStats.ascent_count)).scalar(), 500)
+        self.assertEqual(Route.query.filter(Route.grade_difficulty == None).count(), 0)
+        self.assertEqual(LookupVersion.query.get('tag').version, 1)
+
+        result = app.test_cli_runner().invoke(args=['seed'])
+        self.assertIn('already has users or venues', result.output)
+
+        login(self.app, 'climber1', 'climbunity')
+        self.assertIn('climber1\'s Profile', self.app.get('/profile/1').get_data(as_text=True))
+        logout(self.app)
+
+        self.assertEqual(standings('sends', '30d'), []) # sent in the two years up to SEED_DATE
+
+        # the same rows again, dated up to today so the recent windows fill up
+        db.drop_all()
+        db.create_all()
+        app.test_cli_runner().invoke(args=['seed', '--ascents', '500', '--seed', '3', '--today', str(date.today())])
+        self.assertEqual([(ascent.user_id, ascent.route_id, ascent.send_rating)
+            for ascent in Ascent.query.order_by(Ascent.id)], first)
+        self.assertLessEqual(db.session.query(func.max(Ascent.send_date)).scalar(), date.today())
+        self.assertNotEqual(standings('sends', '30d'), [])
+
     def test_create_appointment(self):
         """Test creating an appointment."""
         # Set up
@@ -527,3 +793,709 @@ class MainTests(unittest.TestCase):
         self.assertIn("<p>Silence removed from ascent list</p>", response_text)
 
 
+
+    def test_ascent_updates_route_stats(self):
+        """Test that logging and deleting ascents keeps the route stats current."""
+        # Set up
+        create_user()
+        create_venue()
+        create_route()
+        login(self.app, 'me1', 'password123')
+
+        post_data = {
+            'ascent_type':'FLASH',
+            'ascent_date':'2022-02-02',
+            'rating':4,
+            'comments':'Crimpy!'
+        }
+        self.app.post('/log_ascent/1', data=post_data, follow_redirects=True)
+        post_data['ascent_type'] = 'REDPOINT'
+        post_data['rating'] = 2
+        self.app.post('/log_ascent/1', data=post_data, follow_redirects=True)
+
+        stats = RouteStats.query.get(1)
+        self.assertEqual(stats.ascent_count, 2)
+        self.assertEqual(stats.rating_sum, 6)
+        self.assertEqual(stats.rating_average, 3.0)
+        self.assertEqual(stats.rating_4, 1)
+        self.assertEqual(stats.flash_count, 1)
+        self.assertEqual(stats.redpoint_count, 1)
+
+        response = self.app.get('/route/1', follow_redirects=True)
+        response_text = response.get_data(as_text=True)
+        self.assertIn('<p>Average rating: 3.0</p>', response_text)
+        self.assertIn('<li>Crimpy!</li>', response_text)
+
+        ascent = Ascent.query.filter_by(send_type=SendType.FLASH).one()
+        self.app.post(f'/delete_ascent/{ascent.id}', follow_redirects=True)
+        stats = RouteStats.query.get(1)
+        self.assertEqual(stats.ascent_count, 1)
+        self.assertEqual(stats.rating_sum, 2)
+        self.assertEqual(stats.rating_average, 2.0)
+        self.assertEqual(stats.flash_count, 0)
+
+    def test_rebuild_route_stats(self):
+        """Test that the rebuild command recomputes stats from the ascent table."""
+        # Set up
+        create_user()
+        create_venue()
+        create_route()
+        create_ascent()
+        db.session.add(Ascent(user_id=1, route_id=1, send_rating=5, send_type=SendType.ONSIGHT))
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['rebuild-route-stats'])
+        self.assertIn('Rebuilt ascent stats for 1 routes.', result.output)
+
+        stats = RouteStats.query.get(1)
+        self.assertEqual(stats.ascent_count, 2)
+        self.assertEqual(stats.rating_count, 1)
+        self.assertEqual(stats.rating_5, 1)
+        self.assertEqual(stats.rating_average, 5.0)
+        self.assertEqual(stats.onsight_count, 1)
+
+    def test_leaderboards_follow_ascents(self):
+        """Test that logging and deleting ascents keeps every leaderboard window up to date."""
+        create_leaderboard_fixture(self.app)
+
+        self.assertEqual(standings('sends', 'all', 1), [(1, 'me1', 3), (2, 'me2', 1)])
+        self.assertEqual(standings('sends', '30d', 1), [(1, 'me1', 2), (2, 'me2', 1)])
+        self.assertEqual(standings('sends', '7d', 1), [(1, 'me1', 1), (1, 'me2', 1)])
+        self.assertEqual(standings('onsights', '30d', 1), [])
+        self.assertEqual(standings('hardest_boulder', 'all'), [(1, 'me1', 'V5'), (2, 'me2', 'V3')]) # not the abandoned V7
+        self.assertEqual(standings('hardest_sport', 'all', 1), [(1, 'me1', '5.11a')])
+        self.assertEqual(standings('sends', 'all', 2), [])
+
+        login(self.app, 'me1', 'password123')
+        with assert_max_queries(self, 3): # the climber, the venue, the board
+            response = self.app.get('/venue/1/leaderboard?board=flashes&window=7d')
+        response_text = response.get_data(as_text=True)
+        self.assertIn('>me1</a> - 1', response_text)
+        self.assertIn('>me2</a> - 1', response_text)
+        self.assertEqual(self.app.get('/leaderboard?window=1y').status_code, 404)
+
+        # deleting the hardest send falls back to the next hardest
+        flash = Ascent.query.filter_by(user_id=1, send_type=SendType.FLASH).one()
+        self.app.post(f'/delete_ascent/{flash.id}')
+        self.assertEqual(standings('hardest_boulder', 'all', 1), [(1, 'me1', 'V3'), (1, 'me2', 'V3')])
+        self.assertEqual(standings('flashes', 'all'), [(1, 'me2', 1)])
+        self.assertEqual(standings('sends', '7d'), [(1, 'me2', 1)])
+        self.assertIn('>me2</a> - 1', self.app.get('/leaderboard?board=flashes').get_data(as_text=True))
+
+        incremental = leaderboard_buckets()
+        rebuild_leaderboards()
+        self.assertEqual(incremental, leaderboard_buckets())
+
+    def test_leaderboards_follow_route_and_venue_deletes(self):
+        """Test that the route and venue cascades take their ascents off the leaderboards."""
+        create_leaderboard_fixture(self.app)
+        login(self.app, 'me1', 'password123')
+
+        self.app.post('/delete_route/2')
+        self.assertEqual(standings('sends', 'all'), [(1, 'me1', 2)])
+        self.assertEqual(standings('hardest_boulder', 'all', 1), [(1, 'me1', 'V5')])
+        incremental = leaderboard_buckets()
+        rebuild_leaderboards()
+        self.assertEqual(incremental, leaderboard_buckets())
+
+        self.app.post('/delete_venue/1')
+        self.assertEqual(LeaderboardBucket.query.filter_by(venue_id=1).count(), 0)
+        self.assertEqual(standings('sends', 'all'), []) # only the abandoned try at Boulder Barn is left
+        incremental = leaderboard_buckets()
+        rebuild_leaderboards()
+        self.assertEqual(incremental, leaderboard_buckets())
+
+    def test_leaderboards_follow_route_edits(self):
+        """Test that moving a route to another venue or regrading it moves its ascents on the leaderboards."""
+        create_leaderboard_fixture(self.app)
+        login(self.app, 'me1', 'password123')
+        self.assertIn('>me1</a> - 3', self.app.get('/venue/1/leaderboard').get_data(as_text=True)) # now cached
+
+        self.app.post('/route/1', data={'name': 'Crimp City', 'venue_id': 2, 'grade': 'V10'})
+        self.assertEqual(standings('sends', 'all', 1), [(1, 'me1', 2), (2, 'me2', 1)])
+        self.assertEqual(standings('flashes', '7d', 2), [(1, 'me1', 1)])
+        self.assertEqual(standings('hardest_boulder', 'all', 1), [(1, 'me1', 'V3'), (1, 'me2', 'V3')])
+        self.assertEqual(standings('hardest_boulder', 'all'), [(1, 'me1', 'V10'), (2, 'me2', 'V3')])
+        self.assertIn('>me1</a> - 2', self.app.get('/venue/1/leaderboard').get_data(as_text=True))
+        incremental = leaderboard_buckets()
+        rebuild_leaderboards()
+        self.assertEqual(incremental, leaderboard_buckets())
+
+        # regrading in place, to a grade off the boulder scale
+        self.app.post('/route/2', data={'name': 'Jug Haul', 'venue_id': 1, 'grade': '5.12a'})
+        self.assertEqual(standings('hardest_sport', 'all', 1), [(1, 'me1', '5.12a'), (1, 'me2', '5.12a')])
+        self.assertEqual(standings('hardest_boulder', 'all', 1), [])
+        incremental = leaderboard_buckets()
+        rebuild_leaderboards()
+        self.assertEqual(incremental, leaderboard_buckets())
+
+    def test_delete_venue_cascades(self):
+        """Test deleting a venue removes its routes, ascents and appointments."""
+        # Set up
+        create_user()
+        create_venue()
+        create_route()
+        create_ascent()
+        create_appointment()
+        user = User.query.get(1)
+        user.user_projects.append(Route.query.get(1))
+        user.user_appointments.append(Appointment.query.get(1))
+        db.session.commit()
+        login(self.app, 'me1', 'password123')
+
+        response = self.app.post('/delete_venue/1', follow_redirects=True)
+        response_text = response.get_data(as_text=True)
+        self.assertIn('<p>Rock Oasis deleted!</p>', response_text)
+
+        self.assertEqual(Venue.query.count(), 0)
+        self.assertEqual(Route.query.count(), 0)
+        self.assertEqual(Ascent.query.count(), 0)
+        self.assertEqual(Appointment.query.count(), 0)
+        self.assertEqual(db.session.query(project_lists_table).count(), 0)
+        self.assertEqual(db.session.query(appointment_guest_lists).count(), 0)
+        self.assertEqual(User.query.count(), 1)
+
+    def test_database_cascades_route_delete(self):
+        """Test that the foreign keys cascade when a route row is deleted directly."""
+        # Set up
+        create_user()
+        create_venue()
+        create_route()
+        create_ascent()
+
+        db.session.execute(Route.__table__.delete())
+        db.session.commit()
+        self.assertEqual(Ascent.query.count(), 0)
+
+    def test_export_user_ascents(self):
+        """Test that a climber can stream their own ascents as CSV and NDJSON, and only their own."""
+        # Set up
+        create_user()
+        create_another_user()
+        create_venue()
+        create_route()
+        db.session.add(Ascent(user_id=1, route_id=1, send_date=date(2022, 1, 1), send_type='FLASH', send_rating=5,
+            send_comments='first, go'))
+        db.session.add(Ascent(user_id=1, route_id=1))
+        db.session.add(Ascent(user_id=2, route_id=1, send_comments='not mine'))
+        db.session.commit()
+        login(self.app, 'me1', 'password123')
+
+        response = self.app.get('/profile/1/ascents.csv')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertIn('filename="me1-ascents.csv"', response.headers['Content-Disposition'])
+        self.assertEqual(response.get_data(as_text=True).splitlines(), [
+            'ascent_id,send_date,send_type,send_rating,send_comments,route_id,route_name,grade,venue_id,venue_name',
+            '1,2022-01-01,FLASH,5,"first, go",1,Silence,9c+,1,Rock Oasis',
+            '2,,,,,1,Silence,9c+,1,Rock Oasis',
+        ])
+
+        response = self.app.get('/profile/1/ascents.ndjson')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        first, second = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual((first['send_date'], first['send_type'], first['venue_name']), ('2022-01-01', 'FLASH', 'Rock Oasis'))
+        self.assertIsNone(second['send_rating'])
+
+        self.assertEqual(self.app.get('/profile/2/ascents.csv').status_code, 403)
+        self.assertEqual(self.app.get('/profile/1/ascents.xml').status_code, 404)
+
+    def test_export_venue_routes(self):
+        """Test that a venue's routes stream out in batches with their stats and setter."""
+        # Set up
+        create_user()
+        create_venue()
+        db.session.add_all([Route(venue_id=1, setter_id=1 if n == 0 else None, name=f'Route {n}', grade='V3',
+            stats=RouteStats(ascent_count=n)) for n in range(5)])
+        db.session.commit()
+        login(self.app, 'me1', 'password123')
+
+        with patch('climbunity_app.exports.BATCH_SIZE', 2):
+            response = self.app.get('/venue/1/routes.csv')
+            chunks = list(response.response)
+        self.assertEqual(len(chunks), 4) # the header, then 2 + 2 + 1 routes
+        lines = b''.join(chunks).decode('utf-8').splitlines()
+        self.assertEqual(lines[0].split(',')[:9], ['route_id', 'name', 'grade', 'grade_scale', 'grade_difficulty',
+            'setter', 'route_set_date', 'route_takedown_date', 'ascent_count'])
+        self.assertEqual(lines[1].split(',')[:9], ['1', 'Route 0', 'V3', 'boulder', '3.0', 'me1', '', '', '0'])
+        self.assertEqual([line.split(',')[8] for line in lines[1:]], ['0', '1', '2', '3', '4'])
+        self.assertEqual(self.app.get('/venue/2/routes.ndjson').status_code, 404)
+
+    def test_profile_ascent_feed(self):
+        """Test that the profile feed shows route and venue names and loads more by keyset."""
+        # Set up
+        create_user()
+        create_venue()
+        create_route()
+        db.session.add(Ascent(user_id=1, route_id=1, send_date=date(2022,1,1), send_comments='first go'))
+        db.session.add(Ascent(user_id=1, route_id=1, send_date=date(2022,3,1), send_comments='sent it'))
+        db.session.commit()
+        app.config['PROFILE_FEED_PAGE_SIZE'] = 1
+
+        response = self.app.get('/profile/1', follow_redirects=True)
+        response_text = response.get_data(as_text=True)
+        self.assertIn('2022-03-01 - <a href="/route/1">Silence</a> @ <a href="/venue/1">Rock Oasis</a>', response_text)
+        self.assertNotIn('first go', response_text)
+        self.assertIn('Load more ascents', response_text)
+
+        next_link = response_text.split('">Load more ascents')[0].rsplit('href="', 1)[1]
+        response = self.app.get(next_link.replace('&amp;', '&'))
+        response_text = response.get_data(as_text=True)
+        self.assertIn('2022-01-01 - <a href="/route/1">Silence</a>', response_text)
+        self.assertIn('first go', response_text)
+        self.assertNotIn('sent it', response_text)
+        self.assertNotIn('Load more ascents', response_text)
+
+    def test_profile_ascent_feed_uses_index(self):
+        """Test that feed pages are read in ix_ascent_user_feed order rather than sorted."""
+        create_user()
+        for cursor in (None, encode_cursor(date(2022,1,1), 5)):
+            with capture_queries() as queries:
+                ascent_feed(1, cursor)
+            statement = queries.statements[-1]
+            sqlite = db.session.connection().connection
+            plan = ' '.join(row[-1] for row in
+                sqlite.execute(f'EXPLAIN QUERY PLAN {statement}', (None,) * statement.count('?')))
+            self.assertIn('ix_ascent_user_feed', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_all_users_query_budget(self):
+        """Test that the users page loads styles without one query per user."""
+        # Set up
+        create_user()
+        create_another_user()
+        bouldering = Style(style='boulder')
+        sport = Style(style='sport')
+        for user in User.query.all():
+            user.user_does_styles.extend([bouldering, sport])
+        db.session.commit()
+        db.session.remove()
+        with app.app_context():
+            lookup_table('style') # styles are labelled from the cached lookup table
+
+        with assert_max_queries(self, 2):
+            response = self.app.get('/users')
+        response_text = response.get_data(as_text=True)
+        self.assertIn('<li>boulder</li>', response_text)
+        self.assertIn('me2', response_text)
+
+    def test_lookup_tables_are_cached(self):
+        """Test that forms offer styles and tags from the lookup cache until their version moves."""
+        create_user()
+        db.session.add_all([Style(style='boulder'), Style(style='sport'), Tag(tag='crimpy')])
+        db.session.commit()
+        login(self.app, 'me1', 'password123')
+        self.app.get('/new_route')
+
+        with assert_max_queries(self, 10) as queries:
+            response_text = self.app.get('/new_route').get_data(as_text=True)
+        self.assertIn('crimpy', response_text)
+        self.assertFalse([statement for statement in queries.statements
+            if 'FROM style' in statement or 'FROM tag' in statement or 'lookup_version' in statement])
+
+        # edits through the ORM bump the version, this worker reloads on its next read
+        Style.query.get(2).style = 'trad'
+        db.session.commit()
+        self.assertIn('trad', self.app.get('/new_route').get_data(as_text=True))
+        self.assertEqual(LookupVersion.query.get('style').version, 2)
+
+        # another worker's change shows up once this one next checks the stored versions
+        app.config['LOOKUP_VERSION_CHECK_SECONDS'] = 3600
+        db.session.execute("UPDATE tag SET tag = 'slopey'")
+        app.test_cli_runner().invoke(args=['bump-lookups'])
+        self.assertIn('slopey', self.app.get('/new_route').get_data(as_text=True))
+        db.session.execute("UPDATE tag SET tag = 'pinchy'")
+        db.session.execute("UPDATE lookup_version SET version = version + 1")
+        db.session.commit()
+        self.assertIn('slopey', self.app.get('/new_route').get_data(as_text=True))
+        app.config['LOOKUP_VERSION_CHECK_SECONDS'] = 0
+        self.assertIn('pinchy', self.app.get('/new_route').get_data(as_text=True))
+        app.config['LOOKUP_VERSION_CHECK_SECONDS'] = 5
+
+    def test_profile_edit_with_cached_styles(self):
+        """Test that styles picked from the lookup cache are saved to the profile."""
+        create_user()
+        db.session.add_all([Style(style='boulder'), Style(style='sport')])
+        db.session.commit()
+        login(self.app, 'me1', 'password123')
+        self.app.post('/edit_profile/1', data={'first_name': 'Test', 'address': '123 Test. St', 'climber_styles': ['1', '2']})
+        self.app.post('/edit_profile/1', data={'first_name': 'Test', 'address': '123 Test. St', 'climber_styles': ['2']})
+        self.assertEqual([style.style for style in User.query.get(1).user_does_styles], ['sport'])
+        self.assertIn('<li>sport</li>', self.app.get('/profile/1').get_data(as_text=True))
+
+        response_text = self.app.post('/edit_profile/1',
+            data={'first_name': 'Test', 'address': '123 Test. St', 'climber_styles': ['9']}).get_data(as_text=True)
+        self.assertIn('Not a valid choice', response_text)
+
+    def test_n_plus_one_is_logged(self):
+        """Test that repeating one statement shape within a request is flagged."""
+        # Set up
+        create_user()
+        create_venue()
+        for n in range(app.config['N_PLUS_ONE_THRESHOLD']):
+            create_route()
+        db.session.remove()
+
+        with app.test_request_context('/venue/1'):
+            app.preprocess_request()
+            # lazy loading each route's ascents is the textbook N+1
+            for route in Route.query.all():
+                route.ascents_on_route
+            with self.assertLogs('climbunity.sql', level='WARNING') as logs:
+                app.process_response(app.response_class())
+        self.assertIn('Probable N+1 on main.venue_detail: 5 x SELECT', logs.output[0])
+
+    def test_route_grade_is_normalised(self):
+        """Test that setting a route's grade fills in its scale and difficulty."""
+        create_user()
+        login(self.app, 'me1', 'password123')
+        create_venue()
+        post_data = {
+            'venue_id':1,
+            'setter_id':1,
+            'name':"Return of the Sleepwalker",
+            'grade':"V17"
+        }
+        self.app.post('/new_route', data=post_data, follow_redirects=True)
+        route = Route.query.one()
+        self.assertEqual((route.grade_scale, route.grade_difficulty), ('boulder', 17.0))
+
+        post_data['grade'] = 'not a grade'
+        response = self.app.post('/route/1', data=post_data, follow_redirects=True)
+        self.assertIn('Please input a YDS', response.get_data(as_text=True))
+        post_data['grade'] = '5.12a'
+        self.app.post('/route/1', data=post_data, follow_redirects=True)
+        route = Route.query.one()
+        self.assertEqual((route.grade_scale, route.grade_difficulty), ('sport', 12.0))
+
+    def test_backfill_grades(self):
+        """Test that the backfill command normalises routes inserted without the ORM."""
+        create_user()
+        create_venue()
+        db.session.execute(Route.__table__.insert(), [
+            dict(venue_id=1, name='One', grade='7a+'),
+            dict(venue_id=1, name='Two', grade='7A+'),
+            dict(venue_id=1, name='Three', grade='7a+'),
+            dict(venue_id=1, name='Four', grade='hard'),
+        ])
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['backfill-grades'])
+        self.assertIn('Normalised grades for 3 routes.', result.output)
+        self.assertIn('Unrecognised grades: hard', result.output)
+        grades = {route.name: (route.grade_scale, route.grade_difficulty) for route in Route.query}
+        self.assertEqual(grades, {
+            'One': ('sport', 12.0),
+            'Two': ('boulder', 7.0),
+            'Three': ('sport', 12.0),
+            'Four': (None, None),
+        })
+
+    def test_route_recommendations(self):
+        """Test that the batch job stores neighbours that the route and profile pages read."""
+        create_recommendation_fixture()
+        result = app.test_cli_runner().invoke(args=['rebuild-recommendations'])
+        self.assertIn('Stored recommendations for 2 routes.', result.output)
+        # Silence <-> Action Directe has only one climber in common
+        pairs = {(row.route_id, row.similar_route_id, row.rank) for row in RouteRecommendation.query}
+        self.assertEqual(pairs, {(1, 2, 1), (2, 1, 1)})
+
+        response_text = self.app.get('/route/1').get_data(as_text=True)
+        self.assertIn('Climbers who liked this also liked', response_text)
+        self.assertIn('<a href="/route/2">Biographie</a>', response_text)
+
+        login(self.app, 'me3', 'password345')
+        with assert_max_queries(self, 15): # includes building the partner index and loading the styles
+            response_text = self.app.get('/profile/3').get_data(as_text=True)
+        self.assertIn('Routes You Might Like', response_text)
+        self.assertIn('<a href="/route/2">Biographie</a>', response_text)
+        self.assertIn('<a href="/route/2">Biographie</a>', self.app.get('/edit_profile/3').get_data(as_text=True))
+
+    def test_refresh_recommendations(self):
+        """Test that new ascents queue their route and the refresh picks up the new neighbours."""
+        create_recommendation_fixture()
+        app.test_cli_runner().invoke(args=['rebuild-recommendations'])
+        login(self.app, 'me1', 'password123')
+        self.app.post('/log_ascent/3', data={'ascent_type': 'REDPOINT', 'ascent_date': '2022-02-02', 'rating': 5})
+        self.assertEqual([row.route_id for row in RecommendationRefresh.query], [3])
+
+        result = app.test_cli_runner().invoke(args=['refresh-recommendations'])
+        self.assertIn('Refreshed recommendations for 2 routes.', result.output)
+        self.assertEqual(RecommendationRefresh.query.count(), 0)
+        neighbours = {(row.route_id, row.similar_route_id) for row in RouteRecommendation.query}
+        self.assertEqual(neighbours, {(1, 2), (2, 1), (1, 3), (3, 1)})
+
+        # nothing queued, nothing to do
+        result = app.test_cli_runner().invoke(args=['refresh-recommendations'])
+        self.assertIn('Refreshed recommendations for 0 routes.', result.output)
+
+        self.app.post('/delete_route/3')
+        self.assertEqual({(row.route_id, row.similar_route_id) for row in RouteRecommendation.query},
+            {(1, 2), (2, 1)})
+
+    def test_anonymous_pages_are_cached(self):
+        """Test that logged-out views are served from the page cache with ETags and 304s."""
+        create_user()
+        create_venue()
+        create_route()
+        response = self.app.get('/venue/1')
+        etag = response.headers['ETag']
+        self.assertIn('Silence', response.get_data(as_text=True))
+
+        # written behind the app's back, so nothing invalidates the cached page
+        Route.query.get(1).name = 'Renamed'
+        db.session.commit()
+        with assert_max_queries(self, 0):
+            response = self.app.get('/venue/1')
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertIn('Silence', response.get_data(as_text=True))
+        self.assertIn('Cookie', response.headers['Vary'])
+
+        response = self.app.get('/venue/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+
+        # logged-in visitors always get a fresh page
+        login(self.app, 'me1', 'password123')
+        self.assertIn('Renamed', self.app.get('/venue/1').get_data(as_text=True))
+
+    def test_writes_invalidate_cached_pages(self):
+        """Test that the write handlers drop the cached pages showing what they changed."""
+        create_user()
+        create_venue()
+        create_route()
+        for url in ['/', '/venue/1', '/route/1', '/users']:
+            self.app.get(url)
+
+        login(self.app, 'me1', 'password123')
+        self.app.post('/log_ascent/1', data={'ascent_type': 'ONSIGHT', 'ascent_date': '2022-02-02', 'rating': 5})
+        self.app.post('/new_route', data={'venue_id': 1, 'name': 'Biographie', 'grade': '9a+'})
+        logout(self.app)
+
+        self.assertIn('Logged ascents:</strong> 1', self.app.get('/route/1').get_data(as_text=True))
+        self.assertIn('Biographie', self.app.get('/venue/1').get_data(as_text=True))
+        self.assertIn('Number of tracked routes: 2', self.app.get('/').get_data(as_text=True))
+        # nothing touched the users list
+        with assert_max_queries(self, 0):
+            self.app.get('/users')
+
+        # the flash after a redirect is never cached, nor served a cached page
+        login(self.app, 'me1', 'password123')
+        self.app.post('/delete_route/2')
+        logout(self.app)
+        with self.app.session_transaction() as session:
+            session['_flashes'] = [('message', 'Biographie deleted!')]
+        response_text = self.app.get('/venue/1').get_data(as_text=True)
+        self.assertIn('Biographie deleted!', response_text)
+        self.assertNotIn('Biographie</strong>', response_text)
+        self.assertNotIn('Biographie deleted!', self.app.get('/venue/1').get_data(as_text=True))
+
+    def fragment_results(self):
+        """{'hit': n, 'miss': n} summed over every cached fragment so far."""
+        results = {'hit': 0, 'miss': 0}
+        for metric in REGISTRY.collect():
+            if metric.name == 'fragment_cache_requests':
+                for sample in metric.samples:
+                    if sample.name.endswith('_total'):
+                        results[sample.labels['result']] += sample.value
+        return results
+
+    def test_logged_in_fragments_are_cached(self):
+        """Test that {% cache %} fragments are reused until the rows they show change."""
+        create_user()
+        create_another_user()
+        create_venue()
+        create_route()
+        create_ascent()
+        login(self.app, 'me1', 'password123')
+        self.app.post('/add_to_project_list/1')
+
+        before = self.fragment_results()
+        for _ in range(2):
+            self.assertIn('Silence', self.app.get('/venue/1').get_data(as_text=True))
+            self.assertIn('remove from list', self.app.get('/profile/1').get_data(as_text=True))
+        after = self.fragment_results()
+        # venue routes, projects, ascent feed and appointments: missed once, then hit
+        self.assertEqual(after['miss'] - before['miss'], 4)
+        self.assertEqual(after['hit'] - before['hit'], 4)
+
+        # a changed row changes the key, even when written behind the app's back
+        Route.query.get(1).name = 'Renamed'
+        db.session.commit()
+        self.assertIn('Renamed', self.app.get('/venue/1').get_data(as_text=True))
+        self.assertIn('Renamed</a>', self.app.get('/profile/1').get_data(as_text=True))
+
+        # the per-viewer parts are in the key: another climber doesn't get the owner's buttons
+        logout(self.app)
+        login(self.app, 'me2', 'password234')
+        response_text = self.app.get('/profile/1').get_data(as_text=True)
+        self.assertIn('Renamed', response_text)
+        self.assertNotIn('remove from list', response_text)
+        self.assertNotIn('Delete ascent', response_text)
+
+class ReplicaRoutingTests(unittest.TestCase):
+    """Tests for reading the read-only pages from a replica, with a second SQLite database as the replica."""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        app.config['SQLALCHEMY_BINDS'] = {'replica1': f'sqlite:///{os.path.join(tempfile.mkdtemp(), "replica.db")}'}
+        app.config['REPLICA_STICKY_SECONDS'] = 60
+        app.config['REPLICA_CHECK_SECONDS'] = 60
+        self.app = app.test_client()
+        self.context = app.app_context()
+        self.context.push()
+        partners._index['current'] = None
+        db.drop_all()
+        db.create_all()
+        page_cache.clear()
+        fragment_cache.clear()
+        reset_lookups()
+        reset_replica_health()
+        # the same climber and venue on both, but the replica hasn't caught up with the venue's rename
+        create_user()
+        create_venue()
+        self.replica = db.get_engine(app, 'replica1')
+        db.Model.metadata.create_all(self.replica)
+        for model in [User, Venue]:
+            rows = [dict(row) for row in db.session.execute(model.__table__.select())]
+            self.replica.execute(model.__table__.insert(), rows)
+        self.replica.execute(Venue.__table__.update().values(name='Stale Oasis'))
+
+    def tearDown(self):
+        self.replica.dispose()
+        app.config['SQLALCHEMY_BINDS'] = {}
+        self.context.pop()
+
+    def routing(self, target, reason):
+        return REGISTRY.get_sample_value('db_read_routing_total', {'target': target, 'reason': reason}) or 0
+
+    def test_reads_go_to_replica_until_own_write(self):
+        """Test that logged-in page views read the replica, except for a while after the visitor's own POST."""
+        login(self.app, 'me1', 'password123') # a POST, so the next reads stick to the primary
+        self.assertIn('Rock Oasis', self.app.get('/venue/1').get_data(as_text=True))
+
+        app.config['REPLICA_STICKY_SECONDS'] = 0
+        login(self.app, 'me1', 'password123')
+        replica_reads = self.routing('replica1', 'replica')
+        self.assertIn('Stale Oasis', self.app.get('/venue/1').get_data(as_text=True))
+        self.assertIn('Stale Oasis', self.app.get('/').get_data(as_text=True))
+        self.assertEqual(self.routing('replica1', 'replica'), replica_reads + 2)
+
+        # writes made while reading from the replica still go to the primary
+        self.app.post('/venue/1', data=dict(name='New Oasis', address='Dundas', open_hours='All day',
+            description='Bouldering gym'))
+        self.assertEqual(Venue.query.get(1).name, 'New Oasis')
+
+    def test_anonymous_cached_pages_read_primary(self):
+        """Test that pages going into the page cache are rendered from the primary."""
+        cached_renders, replica_reads = self.routing('primary', 'page_cache'), self.routing('replica1', 'replica')
+        self.assertIn('Rock Oasis', self.app.get('/venue/1').get_data(as_text=True))
+        self.assertEqual(self.routing('primary', 'page_cache'), cached_renders + 1)
+        self.app.get('/profile/1') # not page cached, so it can read the replica
+        self.assertEqual(self.routing('replica1', 'replica'), replica_reads + 1)
+
+    def test_falls_back_to_primary(self):
+        """Test that a lagging or broken replica is skipped, and a failed replica read is retried on the primary."""
+        app.config['REPLICA_STICKY_SECONDS'] = 0
+        login(self.app, 'me1', 'password123')
+        reset_replica_health() # the redirect home already found it healthy
+        with patch('climbunity_app.replicas.replica_lag', return_value=30.0):
+            self.assertIn('Rock Oasis', self.app.get('/venue/1').get_data(as_text=True))
+        self.assertGreater(self.routing('primary', 'unavailable'), 0)
+
+        reset_replica_health()
+        self.replica.execute('DROP TABLE route') # the replica breaks mid-request
+        failed = self.routing('primary', 'replica_failed')
+        response = self.app.get('/venue/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Rock Oasis', response.get_data(as_text=True))
+        self.assertEqual(self.routing('primary', 'replica_failed'), failed + 1)
+        self.assertIn('Rock Oasis', self.app.get('/venue/1').get_data(as_text=True)) # marked down until rechecked
+
+class PageCacheBackendTests(unittest.TestCase):
+    """Tests for the page cache stores."""
+
+    def test_memory_backend_evicts_least_recently_used(self):
+        backend = MemoryBackend(max_entries=2)
+        backend.set_many({'a': 1, 'b': 2})
+        backend.get_many(['a'])
+        backend.set_many({'c': 3})
+        self.assertEqual(backend.get_many(['a', 'b', 'c']), [1, None, 3])
+
+    def test_backends_expire_entries(self):
+        for backend in [MemoryBackend(max_entries=10), FileSystemBackend(tempfile.mkdtemp())]:
+            backend.set_many({'page': 'body'}, timeout=0.05)
+            backend.set_many({'tag': 'version'})
+            self.assertEqual(backend.get_many(['page', 'tag', 'missing']), ['body', 'version', None])
+            time.sleep(0.06)
+            self.assertEqual(backend.get_many(['page', 'tag']), [None, 'version'])
+            backend.clear()
+            self.assertEqual(backend.get_many(['tag']), [None])
+
+    def test_memory_backend_invalidates_across_workers(self):
+        """Test that a write in one worker drops the page another worker keeps in its own memory."""
+        config = {'PAGE_CACHE_BACKEND': 'memory', 'PAGE_CACHE_MAX_ENTRIES': 10, 'PAGE_CACHE_SECONDS': 300,
+            'PAGE_CACHE_DIR': tempfile.mkdtemp()}
+        workers = []
+        for _ in range(2):
+            worker = Flask(__name__)
+            worker.config.update(config)
+            workers.append((worker, PageCache(worker)))
+        (reader, reader_cache), (writer, writer_cache) = workers
+        with reader.test_request_context():
+            reader_cache.store('page:/venue/1?', reader.response_class('Rock Oasis'), 'etag',
+                reader_cache.tag_versions(['venue:1']))
+            self.assertIsNotNone(reader_cache.lookup('page:/venue/1?'))
+        with writer.app_context():
+            writer_cache.invalidate('venue:1')
+        self.assertIsNone(reader_cache.lookup('page:/venue/1?'))
+        self.assertEqual(writer_cache.backend.get_many(['page:/venue/1?']), [None]) # pages stay per process
+
+    def test_fragment_key_follows_row_values(self):
+        route = Route(id=1, venue_id=1, name='Silence', grade='9c')
+        key = fragment_key(('routes', [route], {2, 1}))
+        self.assertEqual(fragment_key(('routes', [route], {1, 2})), key)
+        route.grade = '9b+'
+        self.assertNotEqual(fragment_key(('routes', [route], {1, 2})), key)
+
+class GradeTests(unittest.TestCase):
+    """Tests for the grade parser."""
+
+    def test_parse_grade(self):
+        cases = {
+            '5.9': ('sport', 9.0),
+            '5.10a': ('sport', 10.0),
+            '5.10c': ('sport', 10.5),
+            '5.10a/b': ('sport', 10.125),
+            '5.11': ('sport', 11.375),
+            '5.11+': ('sport', 11.625),
+            '6a': ('sport', 10.0),
+            '9c+': ('sport', 16.0),
+            'V0': ('boulder', 0.0),
+            'v4': ('boulder', 4.0),
+            'V4-5': ('boulder', 4.5),
+            'V5+': ('boulder', 5.25),
+            'VB': ('boulder', -1.0),
+            '7A+': ('boulder', 7.0),
+            'f7a+': ('boulder', 7.0),
+            'Font 6C': ('boulder', 5.0),
+        }
+        for text, expected in cases.items():
+            self.assertEqual(tuple(parse_grade(text)), expected, text)
+        for text in ['', None, '5.9a', 'hard', '5', 'V', '10b']:
+            self.assertIsNone(parse_grade(text), text)
+
+    def test_grades_compare_across_systems(self):
+        self.assertLess(parse_grade('5.11d').difficulty, parse_grade('7b').difficulty)
+        self.assertEqual(parse_grade('6a').difficulty, parse_grade('5.10a').difficulty)
+        self.assertEqual(parse_grade('7A').difficulty, parse_grade('V6').difficulty)
+
+    def test_grade_label(self):
+        self.assertEqual(grade_label(*parse_grade('7a+')), '5.12a')
+        self.assertEqual(grade_label(*parse_grade('5.9+')), '5.9')
+        self.assertEqual(grade_label(*parse_grade('V4-')), 'V4')
+        self.assertEqual(grade_label(*parse_grade('f7A+')), 'V7')
+        self.assertEqual(grade_label(*parse_grade('VB')), 'VB')
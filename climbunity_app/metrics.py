@@ -0,0 +1,129 @@
+"""Prometheus metrics shared by the app, served from /metrics (see ops/routes.py).
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR so every worker writes its samples
+there and /metrics aggregates them across processes.
+"""
+import os
+import time
+from flask import g, request
+from jinja2 import Template
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+
+# the metrics below open their sample files as they are defined, so the directory
+# has to exist first: in a fresh container it does for gunicorn (gunicorn.conf.py
+# clears it) but not for `flask create-db` or any other command run before it
+if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+##########################################
+#           HTTP requests                #
+##########################################
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds',
+    'Time to handle a request', ['endpoint', 'method', 'status'], buckets=LATENCY_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight',
+    'Requests currently being handled', multiprocess_mode='livesum')
+RESPONSE_SIZE = Histogram('http_response_size_bytes',
+    'Size of response bodies', ['endpoint'],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304))
+DB_TIME_SHARE = Histogram('http_request_db_time_share',
+    'Fraction of request time spent executing SQL', ['endpoint'],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+TEMPLATE_RENDER = Histogram('template_render_seconds',
+    'Time to render a page template', ['template'], buckets=LATENCY_BUCKETS)
+PAGE_CACHE_REQUESTS = Counter('page_cache_requests',
+    'Cacheable page views by outcome (hit, miss, or bypass for logged-in/non-GET)', ['endpoint', 'result'])
+FRAGMENT_CACHE_REQUESTS = Counter('fragment_cache_requests',
+    'Renders of {% cache %} template fragments by outcome (hit or miss)', ['fragment', 'result'])
+BCRYPT_SECONDS = Histogram('bcrypt_seconds',
+    'Time spent hashing or checking passwords', ['operation'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2, 5))
+
+##########################################
+#           Connection pool              #
+##########################################
+
+POOL_CHECKOUTS = Counter('db_pool_checkouts',
+    'Connections checked out of the SQLAlchemy pool')
+POOL_CHECKOUT_WAIT = Histogram('db_pool_checkout_wait_seconds',
+    'Time spent waiting for a pooled connection',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+POOL_TIMEOUTS = Counter('db_pool_checkout_timeouts',
+    'Checkouts that gave up after DB_POOL_TIMEOUT seconds')
+POOL_OVERFLOW_OPENED = Counter('db_pool_overflow_connections',
+    'Connections opened beyond DB_POOL_SIZE')
+POOL_CHECKED_OUT = Gauge('db_pool_checked_out',
+    'Connections currently checked out', multiprocess_mode='livesum')
+POOL_OVERFLOW = Gauge('db_pool_overflow',
+    'Overflow connections currently open', multiprocess_mode='livesum')
+POOL_SIZE = Gauge('db_pool_size',
+    'Configured persistent pool size', multiprocess_mode='livesum')
+
+##########################################
+#           SQL per request              #
+##########################################
+
+DB_STATEMENTS = Histogram('db_statements_per_request',
+    'SQL statements issued while handling one request', ['endpoint'],
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, 250))
+DB_TIME = Counter('db_time_seconds',
+    'Time spent executing SQL statements', ['endpoint'])
+DB_SLOW_STATEMENTS = Counter('db_slow_statements',
+    'Statements slower than SLOW_QUERY_MS', ['endpoint'])
+DB_N_PLUS_ONE = Counter('db_n_plus_one',
+    'Requests that repeated one statement shape at least N_PLUS_ONE_THRESHOLD times', ['endpoint'])
+DB_READ_ROUTING = Counter('db_read_routing',
+    'Replica-eligible requests by the database that served them and why', ['target', 'reason'])
+
+def metrics_registry():
+    """The registry to expose: aggregated across workers when running multiprocess."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+class TimedTemplate(Template):
+    """Jinja template that reports how long each top-level render takes.
+
+    Includes and extended layouts render inside their page, so they are
+    counted as part of it rather than on their own.
+    """
+
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            TEMPLATE_RENDER.labels(self.name or 'string').observe(time.perf_counter() - start)
+
+def init_request_metrics(app):
+    """Time every request on `app` and record its size and DB share by endpoint."""
+    app.jinja_env.template_class = TimedTemplate
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.get('request_start')
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_LATENCY.labels(endpoint, request.method, response.status_code).observe(elapsed)
+        if not response.is_streamed:
+            RESPONSE_SIZE.labels(endpoint).observe(response.calculate_content_length() or 0)
+        query_stats = g.get('query_stats')
+        if query_stats is not None and elapsed > 0:
+            DB_TIME_SHARE.labels(endpoint).observe(min(query_stats.duration / elapsed, 1.0))
+        return response
+
+    @app.teardown_request
+    def finish_request_timer(exception=None):
+        if g.pop('request_start', None) is not None:
+            REQUESTS_IN_FLIGHT.dec()
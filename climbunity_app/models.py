@@ -3,6 +3,8 @@ from climbunity_app.extensions import db
 from climbunity_app.utils import FormEnum
 from sqlalchemy.orm import backref
 from flask_login import UserMixin
+from sqlalchemy import event
+from climbunity_app.grades import parse_grade
 import enum
 
 class SendType(FormEnum):
@@ -31,6 +33,12 @@ class User(UserMixin, db.Model):
     user_does_styles = db.relationship('Style',
         secondary='user_style_lists', back_populates='climber_styles'
     ) # User <- N -- N -> Style
+    # typeahead prefix search, lower(username) LIKE 'prefix%' (see climbunity_app/api/routes.py);
+    # text_pattern_ops lets Postgres use the index for LIKE whatever the database collation
+    __table_args__ = (
+        db.Index('ix_user_username_lower', db.func.lower(username).label('username_lower'),
+            postgresql_ops={'username_lower': 'text_pattern_ops'}),
+    )
 
     def __str__(self):
         return f'{self.username}'
@@ -57,9 +65,10 @@ class Style(db.Model):
     def __repr__(self):
         return f'{self.style}'
     
+# association tables key on (owner, target), so a pair can only be linked once (see climbunity_app/associations.py)
 user_styles_table = db.Table('user_style_lists',
-    db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('style_id', db.Integer, db.ForeignKey('style.id'))
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('style_id', db.Integer, db.ForeignKey('style.id', ondelete='CASCADE'), primary_key=True),
 ) # User <- N -- N -> Style
     
 class Tag(db.Model):
@@ -85,7 +94,13 @@ class Venue(db.Model):
     address = db.Column(db.String(80), nullable=False)
     open_hours = db.Column(db.String(500))
     description = db.Column(db.String(500))
-    booked_appointments = db.relationship('Appointment', back_populates='appointment_venue') # Venue <-1 -- N-> Appointment
+    booked_appointments = db.relationship('Appointment', back_populates='appointment_venue',
+        passive_deletes=True
+    ) # Venue <-1 -- N-> Appointment
+    __table_args__ = (
+        db.Index('ix_venue_name_lower', db.func.lower(name).label('name_lower'),
+            postgresql_ops={'name_lower': 'text_pattern_ops'}),
+    )
 
     def __str__(self):
         return f'{self.name}'
@@ -96,14 +111,19 @@ class Venue(db.Model):
 class Route(db.Model):
     """Route model"""
     id = db.Column(db.Integer, primary_key=True)
-    venue_id = db.Column(db.Integer, db.ForeignKey('venue.id'), nullable=False)
-    setter_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    venue_id = db.Column(db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), nullable=False, index=True)
+    setter_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
     name = db.Column(db.String(80), nullable=False)
-    grade = db.Column(db.String(10), nullable=False)
+    grade = db.Column(db.String(10), nullable=False, index=True)
+    # parsed from `grade` whenever it is set (see climbunity_app/grades.py), None if unrecognised
+    grade_scale = db.Column(db.String(7))
+    grade_difficulty = db.Column(db.Float)
     photo_url = db.Column(URLType)
     route_set_date = db.Column(db.Date)
     route_takedown_date = db.Column(db.Date)
-    ascents_on_route = db.relationship('Ascent', back_populates='route_ascended') # Route <-1 -- N-> Ascent
+    ascents_on_route = db.relationship('Ascent', back_populates='route_ascended',
+        passive_deletes=True
+    ) # Route <-1 -- N-> Ascent
     projecting_users = db.relationship('User',
         secondary='user_project_lists', back_populates='user_projects'
     ) # User <- N -- N -> Route
@@ -113,6 +133,15 @@ class Route(db.Model):
     route_tags = db.relationship('Tag',
         secondary='route_tag_lists', back_populates='tagged_routes'
     ) # Route <- N -- N -> Tag
+    stats = db.relationship('RouteStats', uselist=False, back_populates='route',
+        cascade='all, delete-orphan'
+    ) # Route <-1 -- 1-> RouteStats
+    __table_args__ = (
+        # route search's newest-first sort, undated routes last; must match search.SET_DATE_SORT exactly
+        db.Index('ix_route_set_date', db.func.coalesce(route_set_date, db.literal_column("'1970-01-01'")), 'id'),
+        # grade ranges and hardest/easiest first, within a scale
+        db.Index('ix_route_grade_difficulty', 'grade_scale', 'grade_difficulty', 'id'),
+    )
 
     def __str__(self):
         return f'{self.name}'
@@ -120,31 +149,101 @@ class Route(db.Model):
     def __repr__(self):
         return f'{self.name}'
 
+@event.listens_for(Route.grade, 'set')
+def normalise_route_grade(route, value, oldvalue, initiator):
+    # bulk inserts skip this; `flask backfill-grades` catches them up
+    grade = parse_grade(value)
+    route.grade_scale = grade.scale if grade else None
+    route.grade_difficulty = grade.difficulty if grade else None
+
+class RouteStats(db.Model):
+    """Running ascent totals for a route, maintained as ascents are logged and deleted"""
+    # see climbunity_app/stats.py for the bookkeeping, `flask rebuild-route-stats` recomputes from scratch
+    route_id = db.Column(db.Integer, db.ForeignKey('route.id', ondelete='CASCADE'), primary_key=True)
+    ascent_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_average = db.Column(db.Float, nullable=False, default=0) # rating_sum / rating_count, indexed for sorting
+    # rating histogram, one bucket per AscentForm rating choice
+    rating_0 = db.Column(db.Integer, nullable=False, default=0)
+    rating_1 = db.Column(db.Integer, nullable=False, default=0)
+    rating_2 = db.Column(db.Integer, nullable=False, default=0)
+    rating_3 = db.Column(db.Integer, nullable=False, default=0)
+    rating_4 = db.Column(db.Integer, nullable=False, default=0)
+    rating_5 = db.Column(db.Integer, nullable=False, default=0)
+    # send type breakdown, one bucket per SendType
+    onsight_count = db.Column(db.Integer, nullable=False, default=0)
+    redpoint_count = db.Column(db.Integer, nullable=False, default=0)
+    send_count = db.Column(db.Integer, nullable=False, default=0)
+    abandon_count = db.Column(db.Integer, nullable=False, default=0)
+    flash_count = db.Column(db.Integer, nullable=False, default=0)
+    route = db.relationship('Route', back_populates='stats') # Route <-1 -- 1-> RouteStats
+    __table_args__ = (
+        db.Index('ix_route_stats_rating', 'rating_average', 'route_id'), # route search, best rated first
+    )
+
+    @property
+    def average_rating(self):
+        if not self.rating_count:
+            return 0
+        return round(self.rating_sum / self.rating_count, 1)
+
+    @property
+    def rating_histogram(self):
+        return [(rating, getattr(self, f'rating_{rating}') or 0) for rating in range(6)]
+
+    @property
+    def send_type_breakdown(self):
+        return [(send_type, getattr(self, column) or 0) for send_type, column in SEND_TYPE_COLUMNS.items()]
+
+    def __str__(self):
+        return f'{self.route_id}'
+
+    def __repr__(self):
+        return f'{self.route_id}'
+
+SEND_TYPE_COLUMNS = {
+    SendType.ONSIGHT: 'onsight_count',
+    SendType.REDPOINT: 'redpoint_count',
+    SendType.SEND: 'send_count',
+    SendType.ABANDON: 'abandon_count',
+    SendType.FLASH: 'flash_count',
+}
+
 project_lists_table = db.Table('user_project_lists',
-    db.Column('route_id', db.Integer, db.ForeignKey('route.id')),
-    db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('route_id', db.Integer, db.ForeignKey('route.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_user_project_lists_route', 'route_id'), # route deletes
 ) # User <- N -- N -> Route
 
 route_styles_table = db.Table('route_style_lists',
-    db.Column('route_id', db.Integer, db.ForeignKey('route.id')),
-    db.Column('style_id', db.Integer, db.ForeignKey('style.id'))
+    db.Column('route_id', db.Integer, db.ForeignKey('route.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('style_id', db.Integer, db.ForeignKey('style.id', ondelete='CASCADE'), primary_key=True),
+    # the primary key covers route -> styles; this lets route search go style -> routes from the index alone
+    db.Index('ix_route_style_lists_style_route', 'style_id', 'route_id'),
 ) # Route <- N -- N -> Style
 
-route_styles_table = db.Table('route_tag_lists',
-    db.Column('route_id', db.Integer, db.ForeignKey('route.id')),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'))
+route_tags_table = db.Table('route_tag_lists',
+    db.Column('route_id', db.Integer, db.ForeignKey('route.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_route_tag_lists_tag_route', 'tag_id', 'route_id'),
 ) # Route <- N -- N -> Tag
 
 class Ascent(db.Model):
     """Ascent model"""
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    route_id = db.Column(db.Integer, db.ForeignKey('route.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    route_id = db.Column(db.Integer, db.ForeignKey('route.id', ondelete='CASCADE'), nullable=False)
     send_date = db.Column(db.Date)
     send_type = db.Column(db.Enum(SendType))
     send_rating = db.Column(db.Integer)
     send_comments = db.Column(db.String(1000))
     route_ascended = db.relationship('Route', back_populates='ascents_on_route')  # Route <-1 -- N-> Ascent
+    __table_args__ = (
+        # profile feed keyset, undated ascents last; must match feeds.FEED_SORT exactly
+        db.Index('ix_ascent_user_feed', 'user_id',
+            db.func.coalesce(send_date, db.literal_column("'1970-01-01'")), 'id'),
+    )
 
     def __str__(self):
         return f'{self.name}'
@@ -155,8 +254,8 @@ class Ascent(db.Model):
 class Appointment(db.Model):
     """Appointment model"""
     id = db.Column(db.Integer, primary_key=True)
-    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    venue_id = db.Column(db.Integer, db.ForeignKey('venue.id'), nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), nullable=False)
     appointment_datetime = db.Column(db.DateTime, nullable=False)
     appointment_venue = db.relationship('Venue', back_populates='booked_appointments') # Venue <-1 -- N-> Appointment
     appointment_attendants = db.relationship('User',
@@ -170,6 +269,72 @@ class Appointment(db.Model):
         return f'{self.id}'
 
 appointment_guest_lists = db.Table('appointment_guests',
-    db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('appointment_id', db.Integer, db.ForeignKey('appointment.id'))
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('appointment_id', db.Integer, db.ForeignKey('appointment.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_appointment_guests_appointment', 'appointment_id'), # guest lists, appointment deletes
 ) # User <-N -- N -> Appointment
+
+class RouteRecommendation(db.Model):
+    """A precomputed "climbers who liked this also liked" neighbour of a route"""
+    # written in bulk by climbunity_app/recommendations.py, `flask rebuild-recommendations` recomputes from scratch
+    route_id = db.Column(db.Integer, db.ForeignKey('route.id', ondelete='CASCADE'), primary_key=True)
+    similar_route_id = db.Column(db.Integer, db.ForeignKey('route.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, nullable=False) # 1 is the closest neighbour
+    score = db.Column(db.Float, nullable=False)
+    __table_args__ = (
+        db.Index('ix_route_recommendation_rank', 'route_id', 'rank'), # route page, best first
+        db.Index('ix_route_recommendation_similar', 'similar_route_id'), # route deletes
+    )
+
+    def __str__(self):
+        return f'{self.route_id} -> {self.similar_route_id}'
+
+    def __repr__(self):
+        return f'{self.route_id} -> {self.similar_route_id}'
+
+class RecommendationRefresh(db.Model):
+    """A route whose recommendations are stale since an ascent or project change"""
+    # queued by the views, drained by `flask refresh-recommendations`; a route can be queued more than once
+    id = db.Column(db.Integer, primary_key=True)
+    route_id = db.Column(db.Integer, db.ForeignKey('route.id', ondelete='CASCADE'), nullable=False)
+
+    def __str__(self):
+        return f'{self.route_id}'
+
+    def __repr__(self):
+        return f'{self.route_id}'
+
+class LeaderboardBucket(db.Model):
+    """A climber's send totals at one venue (or every venue) on one day (or all time)"""
+    # maintained by climbunity_app/leaderboards.py as ascents are logged and deleted,
+    # `flask rebuild-leaderboards` recomputes from scratch
+    venue_id = db.Column(db.Integer, primary_key=True, autoincrement=False) # 0 for every venue, so no foreign key
+    day = db.Column(db.Date, primary_key=True) # the send date, 0001-01-01 for all time
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    ascent_count = db.Column(db.Integer, nullable=False, default=0)
+    flash_count = db.Column(db.Integer, nullable=False, default=0)
+    onsight_count = db.Column(db.Integer, nullable=False, default=0)
+    # normalised grades (see climbunity_app/grades.py), one per discipline since the ladders differ
+    hardest_boulder = db.Column(db.Float)
+    hardest_sport = db.Column(db.Float)
+    __table_args__ = (
+        db.Index('ix_leaderboard_bucket_user', 'user_id'), # ascent and route deletes
+    )
+
+    def __str__(self):
+        return f'{self.venue_id}/{self.day}/{self.user_id}'
+
+    def __repr__(self):
+        return f'{self.venue_id}/{self.day}/{self.user_id}'
+
+class LookupVersion(db.Model):
+    """Version of a cached lookup table (Style, Tag), bumped whenever its rows change"""
+    # every worker compares these with its own copy, see climbunity_app/lookups.py
+    name = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __str__(self):
+        return f'{self.name} v{self.version}'
+
+    def __repr__(self):
+        return f'{self.name} v{self.version}'
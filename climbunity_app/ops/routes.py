@@ -0,0 +1,65 @@
+import threading
+import time
+from flask import Blueprint, Response, current_app, jsonify
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import QueuePool
+from climbunity_app.extensions import db
+from climbunity_app.metrics import metrics_registry
+
+ops = Blueprint("ops", __name__)
+
+# last database ping, shared by every request in this process
+_last_ping = {'checked_at': None, 'ok': False, 'error': None}
+_ping_lock = threading.Lock()
+
+def database_ping():
+    """Whether `SELECT 1` succeeds, cached for READINESS_CACHE_SECONDS."""
+    ttl = current_app.config['READINESS_CACHE_SECONDS']
+    with _ping_lock:
+        checked_at = _last_ping['checked_at']
+        if checked_at is not None and time.monotonic() - checked_at < ttl:
+            return _last_ping['ok'], _last_ping['error']
+        try:
+            with db.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            ok, error = True, None
+        except SQLAlchemyError as exception:
+            ok, error = False, exception.__class__.__name__
+        _last_ping.update(checked_at=time.monotonic(), ok=ok, error=error)
+        return ok, error
+
+def pool_usage(pool):
+    """Fraction of the pool's connections (including overflow) checked out, None if unbounded."""
+    if not isinstance(pool, QueuePool) or pool._max_overflow < 0:
+        return None
+    return pool.checkedout() / max(pool.size() + pool._max_overflow, 1)
+
+##########################################
+#           Routes                       #
+##########################################
+
+# liveness: the process is up and serving, never touches the database
+@ops.route('/healthz')
+def healthz():
+    return jsonify(status='ok')
+
+# readiness: the database answers and the pool has room, safe to send traffic
+@ops.route('/readyz')
+def readyz():
+    usage = pool_usage(db.engine.pool)
+    pool_ok = usage is None or usage < current_app.config['READINESS_MAX_POOL_USAGE']
+    # a saturated pool would make the ping itself queue for a connection
+    database_ok, error = database_ping() if pool_ok else (_last_ping['ok'], _last_ping['error'])
+    body = dict(
+        status='ok' if database_ok and pool_ok else 'unavailable',
+        database='ok' if database_ok else error,
+        pool_usage=None if usage is None else round(usage, 2),
+    )
+    return jsonify(body), 200 if database_ok and pool_ok else 503
+
+# scraped by Prometheus, see climbunity_app/metrics.py for what is exported
+@ops.route('/metrics')
+def metrics():
+    return Response(generate_latest(metrics_registry()), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,230 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from prometheus_client import CollectorRegistry, generate_latest, multiprocess
+from flask_sqlalchemy import get_state
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+from climbunity_app import create_app
+from climbunity_app.extensions import db, bcrypt
+from climbunity_app.cache import page_cache
+from climbunity_app.fragments import fragment_cache
+from climbunity_app.lookups import reset_lookups
+from climbunity_app.models import User
+from climbunity_app.metrics import POOL_CHECKOUTS, POOL_OVERFLOW_OPENED
+from climbunity_app.pool import InstrumentedQueuePool, pool_options
+from climbunity_app.ops import routes as ops_routes
+from climbunity_app.testing import assert_max_queries
+
+"""
+Run these tests with the command:
+python3 -m unittest discover
+"""
+
+# gunicorn's fork hooks, in a child process so the config's app is built from these settings
+DISPOSE_IN_MASTER = '''
+import os
+import runpy
+from unittest.mock import patch
+from sqlalchemy.engine import Engine
+hooks = runpy.run_path('gunicorn.conf.py')
+disposed = []
+with patch.object(Engine, 'dispose', lambda engine: disposed.append(os.path.basename(engine.url.database))):
+    hooks['dispose_engines']()
+print(' '.join(sorted(disposed)))
+'''
+
+#################################################
+# Setup
+#################################################
+
+app = create_app()
+
+def sample_value(metric, suffix=''):
+    """Current value of an unlabelled prometheus_client metric."""
+    for collected in metric.collect():
+        for sample in collected.samples:
+            if sample.name == collected.name + suffix:
+                return sample.value
+
+def create_user():
+    password_hash = bcrypt.generate_password_hash('password123').decode('utf-8')
+    user = User(
+        username='me1',
+        password=password_hash,
+        email='test123@test.com',
+        first_name='Test',
+        last_name='User',
+        address='123 Test. St',
+        has_gear=True
+        )
+    db.session.add(user)
+    db.session.commit()
+
+# run in a child process with PROMETHEUS_MULTIPROC_DIR set, like a gunicorn worker
+RECORD_IN_WORKER = '''
+from climbunity_app.metrics import REQUEST_LATENCY, REQUESTS_IN_FLIGHT
+REQUEST_LATENCY.labels('main.homepage', 'GET', 200).observe(0.01)
+REQUESTS_IN_FLIGHT.inc()
+'''
+
+# the database URL refuses connections, so any query while starting up fails the script
+START_WITHOUT_DATABASE = '''
+import sys
+import climbunity_app.extensions
+assert 'climbunity_app.models' not in sys.modules, 'importing the package loaded the models'
+import app
+assert app.app.test_client().get('/healthz').status_code == 200
+'''
+
+#################################################
+# Tests
+#################################################
+
+class OpsTests(unittest.TestCase):
+
+    def setUp(self):
+        """Executed prior to each test."""
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['DEBUG'] = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        app.config['READINESS_CACHE_SECONDS'] = 2
+        ops_routes._last_ping['checked_at'] = None
+        self.app = app.test_client()
+        self.context = app.app_context()
+        self.context.push()
+        db.drop_all()
+        db.create_all()
+        page_cache.clear()
+        fragment_cache.clear()
+        reset_lookups()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_pool_options_from_config(self):
+        """Test that the DB_POOL_* settings become engine options."""
+        config = dict(app.config, DB_POOL_MODE='queue', DB_POOL_SIZE=7, DB_MAX_OVERFLOW=3)
+        options = pool_options(config)
+        self.assertIs(options['poolclass'], InstrumentedQueuePool)
+        self.assertEqual(options['pool_size'], 7)
+        self.assertEqual(options['max_overflow'], 3)
+        self.assertEqual(options['pool_pre_ping'], app.config['DB_POOL_PRE_PING'])
+
+        config['DB_POOL_MODE'] = 'pgbouncer'
+        self.assertEqual(pool_options(config), {'poolclass': NullPool})
+
+    def test_pool_metrics(self):
+        """Test that checkouts and overflow connections are counted."""
+        engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=1)
+        checkouts = sample_value(POOL_CHECKOUTS, '_total')
+        overflow = sample_value(POOL_OVERFLOW_OPENED, '_total')
+
+        first = engine.connect()
+        second = engine.connect()
+        second.close()
+        first.close()
+
+        self.assertEqual(sample_value(POOL_CHECKOUTS, '_total'), checkouts + 2)
+        self.assertEqual(sample_value(POOL_OVERFLOW_OPENED, '_total'), overflow + 1)
+
+    def test_metrics_endpoint(self):
+        """Test that /metrics serves the pool metrics in Prometheus text format."""
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('text/plain', response.content_type)
+        response_text = response.get_data(as_text=True)
+        self.assertIn('db_pool_checkouts_total', response_text)
+        self.assertIn('db_pool_checkout_wait_seconds_bucket', response_text)
+
+    def test_request_metrics(self):
+        """Test that requests, templates and bcrypt show up on /metrics by endpoint."""
+        create_user()
+        self.app.get('/')
+        self.app.post('/login', data={'username': 'me1', 'password': 'password123'})
+
+        response_text = self.app.get('/metrics').get_data(as_text=True)
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="main.homepage",le="0.005",method="GET",status="200"}', response_text)
+        self.assertIn('http_request_duration_seconds_count{endpoint="auth.login",method="POST",status="302"}', response_text)
+        self.assertIn('http_requests_in_flight', response_text)
+        self.assertIn('http_response_size_bytes_count{endpoint="main.homepage"}', response_text)
+        self.assertIn('http_request_db_time_share_count{endpoint="main.homepage"}', response_text)
+        self.assertIn('template_render_seconds_count{template="home.html"}', response_text)
+        self.assertIn('bcrypt_seconds_count{operation="check"}', response_text)
+
+    def test_metrics_aggregate_across_processes(self):
+        """Test that samples written by separate worker processes add up."""
+        with tempfile.TemporaryDirectory() as parent:
+            metrics_dir = os.path.join(parent, 'prometheus_multiproc') # not there yet, as in a fresh container
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=metrics_dir)
+            for _ in range(2):
+                subprocess.run([sys.executable, '-c', RECORD_IN_WORKER], env=env, check=True)
+
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry, path=metrics_dir)
+            output = generate_latest(registry).decode('utf-8')
+        self.assertIn('http_request_duration_seconds_count{endpoint="main.homepage",method="GET",status="200"} 2.0', output)
+
+    def test_healthz(self):
+        """Test that the liveness probe answers without touching the database."""
+        with assert_max_queries(self, 0):
+            response = self.app.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'status': 'ok'})
+
+    def test_create_app_runs_no_sql(self):
+        """Test that building an app neither queries nor opens a connection."""
+        with assert_max_queries(self, 0):
+            fresh = create_app({'SQLALCHEMY_DATABASE_URI': 'postgresql://climbunity@127.0.0.1:9/climbunity'})
+        self.assertEqual(get_state(fresh).connectors, {})
+        self.assertIn('main', fresh.blueprints)
+        self.assertIn('create-db', fresh.cli.list_commands(None))
+
+    def test_startup_is_side_effect_free(self):
+        """Test that importing the package and booting app.py work with the database unreachable."""
+        env = dict(os.environ, DATABASE_URL='postgresql://climbunity@127.0.0.1:9/climbunity', DATABASE_REPLICA_URLS='')
+        result = subprocess.run([sys.executable, '-c', START_WITHOUT_DATABASE], env=env, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    def test_fork_hooks_dispose_replica_engines(self):
+        """Test that the gunicorn fork hooks empty the read replicas' pools as well as the primary's."""
+        env = dict(os.environ, DATABASE_URL='sqlite:///primary.db',
+            DATABASE_REPLICA_URLS='sqlite:///replica-a.db,sqlite:///replica-b.db')
+        env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+        result = subprocess.run([sys.executable, '-c', DISPOSE_IN_MASTER], env=env, capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.split(), ['primary.db', 'replica-a.db', 'replica-b.db'])
+
+    def test_readyz_caches_database_ping(self):
+        """Test that the readiness probe pings the database at most once per TTL."""
+        with assert_max_queries(self, 1):
+            first = self.app.get('/readyz')
+            second = self.app.get('/readyz')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.get_json()['database'], 'ok')
+
+    def test_readyz_database_down(self):
+        """Test that the readiness probe fails when the database is unreachable."""
+        app.config['READINESS_CACHE_SECONDS'] = 0
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:////nonexistent/climbunity/database.db'
+        response = self.app.get('/readyz')
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.get_json()['status'], 'unavailable')
+
+    def test_pool_usage(self):
+        """Test that pool usage counts overflow connections towards saturation."""
+        engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=1)
+        self.assertEqual(ops_routes.pool_usage(engine.pool), 0)
+        first = engine.connect()
+        self.assertEqual(ops_routes.pool_usage(engine.pool), 0.5)
+        second = engine.connect()
+        self.assertEqual(ops_routes.pool_usage(engine.pool), 1.0)
+        second.close()
+        first.close()
+        self.assertIsNone(ops_routes.pool_usage(create_engine('sqlite://', poolclass=NullPool).pool))
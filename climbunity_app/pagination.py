@@ -0,0 +1,65 @@
+"""Keyset (seek) pagination helpers.
+
+Instead of OFFSET, each page remembers the sort key of its last row and the
+next page asks for rows strictly "after" it, so every page is an index range
+scan no matter how deep the visitor pages.
+"""
+import base64
+import json
+from datetime import date, datetime
+from sqlalchemy import and_, or_
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'Cannot encode {value!r} in a cursor')
+
+def encode_cursor(*values):
+    """Pack the sort key of the last row on a page into an opaque url-safe token."""
+    raw = json.dumps(values, default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, *converters):
+    """Unpack a cursor made by `encode_cursor`.
+
+    `converters` are applied positionally (e.g. `date.fromisoformat, int`).
+    Returns None for a missing or malformed cursor so callers can fall back to
+    the first page.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if len(values) != len(converters):
+            return None
+        return [
+            None if value is None else convert(value)
+            for convert, value in zip(converters, values)
+        ]
+    except (ValueError, TypeError):
+        return None
+
+def keyset_filter(columns, values, descending=False):
+    """Build the "row comes after (values)" condition for an ORDER BY on `columns`.
+
+    Equivalent to the row-value comparison `(c1, c2) > (v1, v2)` (or `<` when
+    descending), spelled out so it works on every backend we run on.
+    """
+    clauses = []
+    for position, (column, value) in enumerate(zip(columns, values)):
+        equal_prefix = [columns[i] == values[i] for i in range(position)]
+        beyond = column < value if descending else column > value
+        clauses.append(and_(*equal_prefix, beyond))
+    return or_(*clauses)
+
+def seek(query, columns, cursor_values, limit, descending=False):
+    """Return `(rows, has_more)` for one keyset page of `query`.
+
+    The query must already be ordered by `columns`. One extra row is fetched
+    to know whether a next page exists without a COUNT.
+    """
+    if cursor_values is not None:
+        query = query.filter(keyset_filter(columns, cursor_values, descending))
+    rows = query.limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
@@ -0,0 +1,200 @@
+"""Climbing partner suggestions.
+
+Every climber is boiled down to a few compact numpy arrays, rebuilt at most
+every PARTNER_INDEX_SECONDS:
+
+- the styles they climb, as a bitset (one bit per style id), so shared
+  styles are a popcount of an AND
+- whether they own gear
+- the venues they've climbed or booked at, as sorted inverted lists
+  (venue -> climbers), so shared venues are one bincount over the climbers
+  at the few venues the asking climber visits
+- their average sport and boulder difficulty (see climbunity_app/grades.py)
+
+Scoring one climber against everyone is then a handful of vectorised
+operations over those arrays instead of joins per candidate.
+"""
+import threading
+import time
+import numpy as np
+from flask import current_app
+from sqlalchemy import func
+from climbunity_app.extensions import db
+from climbunity_app.grades import BOULDER, SPORT
+from climbunity_app.models import (Appointment, Ascent, Route, SendType, User,
+    appointment_guest_lists, user_styles_table)
+
+# how much each signal counts towards a score out of 1
+WEIGHTS = {'styles': 0.35, 'gear': 0.15, 'venues': 0.25, 'grade': 0.25}
+# shared venues beyond this don't make a better match
+VENUE_SATURATION = 3
+# difficulty gap (YDS number / V grade) at which grade proximity has fallen to ~37%
+GRADE_FALLOFF = 1.5
+
+class PartnerIndex(object):
+    """Per-climber feature arrays, row i describing user `user_ids[i]`."""
+
+    def __init__(self, user_ids, has_gear, style_bits, venue_pairs, grades):
+        self.user_ids = user_ids
+        self.has_gear = has_gear
+        self.gear_scores = has_gear.astype(np.float32) * np.float32(WEIGHTS['gear'])
+        self.style_bits = style_bits
+        self.style_counts = popcount(style_bits)
+        self.grades = np.asfortranarray(grades) # columns: sport, boulder; NaN when unknown
+        # venue_pairs is an (n x 2) array of (row, venue); keep it twice, grouped by venue and by row
+        rows, venues = venue_pairs.T
+        venues = np.unique(venues, return_inverse=True)[1].astype(np.int64)
+        by_venue = np.lexsort((rows, venues))
+        self.venue_rows = rows[by_venue]
+        self.venue_offsets = np.searchsorted(venues[by_venue], np.arange(venues.max(initial=-1) + 2))
+        by_row = np.lexsort((venues, rows))
+        self.row_venues = venues[by_row]
+        self.row_offsets = np.searchsorted(rows[by_row], np.arange(len(user_ids) + 1))
+        self.rows = {user_id: row for row, user_id in enumerate(user_ids.tolist())}
+        self.built_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def shared_venues(self, row):
+        """How many venues each climber shares with the climber at `row`."""
+        venues = self.row_venues[self.row_offsets[row]:self.row_offsets[row + 1]]
+        if not len(venues):
+            return np.zeros(len(self), dtype=np.int64)
+        climbers = np.concatenate([self.venue_rows[self.venue_offsets[venue]:self.venue_offsets[venue + 1]]
+            for venue in venues.tolist()])
+        return np.bincount(climbers, minlength=len(self))
+
+def _bitset(count, pairs, words):
+    """A (rows x words) uint64 bitset with `bit` set in `row` for each (row, bit) pair."""
+    array = np.zeros((count, words), dtype=np.uint64)
+    if pairs:
+        row_index, bit = np.array(pairs, dtype=np.int64).T
+        np.bitwise_or.at(array, (row_index, bit // 64), np.left_shift(np.uint64(1), (bit % 64).astype(np.uint64)))
+    return array
+
+def popcount(words):
+    """Set bits per row of a (rows x words) uint64 array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    # SWAR popcount, for numpy releases without bitwise_count
+    words = words - ((words >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    words = (words & np.uint64(0x3333333333333333)) + ((words >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    words = (words + (words >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((words * np.uint64(0x0101010101010101)) >> np.uint64(56)).sum(axis=1, dtype=np.int64)
+
+def build_partner_index():
+    """Load every climber's features in five grouped queries."""
+    users = db.session.query(User.id, User.has_gear).order_by(User.id).all()
+    user_ids = np.array([user.id for user in users], dtype=np.int64)
+    has_gear = np.array([bool(user.has_gear) for user in users], dtype=bool)
+    rows = {user_id: row for row, user_id in enumerate(user_ids.tolist())}
+    count = len(users)
+
+    style_pairs = [(rows[user_id], style_id) for user_id, style_id in
+        db.session.query(user_styles_table.c.user_id, user_styles_table.c.style_id)
+        if user_id in rows and style_id is not None]
+    max_style = max((style_id for _, style_id in style_pairs), default=0)
+    style_words = max_style // 64 + 1
+    style_bits = _bitset(count, style_pairs, style_words)
+
+    climbed = db.session.query(Ascent.user_id, Route.venue_id) \
+        .join(Route, Route.id == Ascent.route_id).distinct()
+    booked = db.session.query(appointment_guest_lists.c.user_id, Appointment.venue_id) \
+        .join(Appointment, Appointment.id == appointment_guest_lists.c.appointment_id).distinct()
+    venue_pairs = {(rows[user_id], venue_id) for query in (climbed, booked)
+        for user_id, venue_id in query if user_id in rows}
+    venue_pairs = np.array(sorted(venue_pairs), dtype=np.int64).reshape(-1, 2)
+
+    grades = np.full((count, 2), np.nan, dtype=np.float32)
+    averages = db.session.query(Ascent.user_id, Route.grade_scale, func.avg(Route.grade_difficulty)) \
+        .join(Route, Route.id == Ascent.route_id) \
+        .filter(Route.grade_difficulty != None, Ascent.send_type != SendType.ABANDON) \
+        .group_by(Ascent.user_id, Route.grade_scale)
+    for user_id, scale, average in averages:
+        if user_id in rows and scale in (SPORT, BOULDER):
+            grades[rows[user_id], 0 if scale == SPORT else 1] = average
+    return PartnerIndex(user_ids, has_gear, style_bits, venue_pairs, grades)
+
+_index = {'current': None}
+_index_lock = threading.Lock()
+
+def partner_index():
+    """The process's PartnerIndex, rebuilt when older than PARTNER_INDEX_SECONDS.
+
+    While one request rebuilds a stale index, the others keep using the old one.
+    """
+    index = _index['current']
+    ttl = current_app.config['PARTNER_INDEX_SECONDS']
+    if index is not None and time.monotonic() - index.built_at < ttl:
+        return index
+    if index is not None and not _index_lock.acquire(blocking=False):
+        return index
+    if index is None:
+        _index_lock.acquire()
+    try:
+        if _index['current'] is index:
+            _index['current'] = build_partner_index()
+        return _index['current']
+    finally:
+        _index_lock.release()
+
+def score_partners(index, row):
+    """Scores (0..1) of every climber in `index` as a partner for the climber at `row`, with the parts."""
+    # style Jaccard: shared / (mine + theirs - shared)
+    shared_styles = popcount(index.style_bits & index.style_bits[row])
+    either_styles = index.style_counts + index.style_counts[row] - shared_styles
+    scores = shared_styles.astype(np.float32)
+    np.divide(scores, either_styles, out=scores, where=either_styles > 0)
+    scores *= WEIGHTS['styles']
+
+    # somebody has to bring a rope
+    if index.has_gear[row]:
+        scores += WEIGHTS['gear']
+    else:
+        scores += index.gear_scores
+
+    shared_venues = index.shared_venues(row)
+    scores += np.minimum(shared_venues, VENUE_SATURATION).astype(np.float32) * (WEIGHTS['venues'] / VENUE_SATURATION)
+
+    # closeness in whichever discipline both climb (fmin skips the NaNs), 0 when there's none
+    gap = np.fmin(np.abs(index.grades[:, 0] - index.grades[row, 0]), np.abs(index.grades[:, 1] - index.grades[row, 1]))
+    gap *= np.float32(-1 / GRADE_FALLOFF)
+    grade_score = np.exp(gap, out=gap)
+    grade_score[np.isnan(grade_score)] = 0
+    scores += grade_score * np.float32(WEIGHTS['grade'])
+    return scores, shared_styles, shared_venues
+
+def suggest_partners(user_id, limit=10, style_id=None):
+    """The best `limit` partners for `user_id`, best first.
+
+    Returns a list of `(user_id, score, shared_styles, shared_venues)`, limited
+    to climbers of `style_id` when given; empty for an unknown user or style.
+    """
+    index = partner_index()
+    row = index.rows.get(user_id)
+    if row is None or len(index) < 2:
+        return []
+    scores, shared_styles, shared_venues = score_partners(index, row)
+    scores[row] = -np.inf # not yourself
+    if style_id is not None:
+        word, bit = divmod(style_id, 64)
+        if style_id < 1 or word >= index.style_bits.shape[1]: # no such style, and no wrapping round to the end
+            return []
+        has_style = (index.style_bits[:, word] >> np.uint64(bit)) & np.uint64(1)
+        scores[has_style == 0] = -np.inf
+    limit = min(limit, len(index) - 1)
+    top = np.argpartition(-scores, limit - 1)[:limit]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return [
+        (int(index.user_ids[candidate]), float(scores[candidate]),
+            int(shared_styles[candidate]), int(shared_venues[candidate]))
+        for candidate in top if np.isfinite(scores[candidate])
+    ]
+
+def partner_suggestions(user_id, limit=10, style_id=None):
+    """`suggest_partners` with the users loaded in one query, as `(user, score, shared_styles, shared_venues)`."""
+    suggestions = suggest_partners(user_id, limit, style_id)
+    users = {user.id: user for user in
+        User.query.filter(User.id.in_([partner_id for partner_id, *_ in suggestions]))} if suggestions else {}
+    return [(users[partner_id], *parts) for partner_id, *parts in suggestions if partner_id in users]
@@ -0,0 +1,60 @@
+"""Connection pool configuration and instrumentation.
+
+The DB_POOL_* settings in Config are turned into create_engine options here,
+and the pool reports checkouts, wait time and overflow to climbunity_app.metrics.
+"""
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.pool import NullPool, Pool, QueuePool
+from climbunity_app.metrics import (POOL_CHECKED_OUT, POOL_CHECKOUT_WAIT, POOL_CHECKOUTS,
+    POOL_OVERFLOW, POOL_OVERFLOW_OPENED, POOL_SIZE, POOL_TIMEOUTS)
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times how long callers wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        POOL_SIZE.set(self.size())
+
+    def _do_get(self):
+        overflow_before = self.overflow()
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+        if self.overflow() > overflow_before and self.overflow() > 0:
+            POOL_OVERFLOW_OPENED.inc()
+        POOL_OVERFLOW.set(max(self.overflow(), 0))
+        return connection
+
+    def _do_return_conn(self, conn):
+        super()._do_return_conn(conn)
+        POOL_OVERFLOW.set(max(self.overflow(), 0))
+
+def pool_options(config):
+    """create_engine keyword arguments for a server database (not SQLite)."""
+    if config['DB_POOL_MODE'] == 'pgbouncer':
+        # PgBouncer in transaction mode does the pooling: keep no idle connections
+        # of our own, so nothing session-scoped can outlive a transaction
+        return {'poolclass': NullPool}
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+@event.listens_for(Pool, 'checkout')
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+    POOL_CHECKOUTS.inc()
+    POOL_CHECKED_OUT.inc()
+
+@event.listens_for(Pool, 'checkin')
+def count_checkin(dbapi_connection, connection_record):
+    POOL_CHECKED_OUT.dec()
@@ -0,0 +1,126 @@
+"""Per-request SQL accounting: statement counts, DB time, slow queries and N+1 hints.
+
+Every statement executed through any engine is timed. While a request is in
+flight its statements are tallied on `g.query_stats`; at the end of the request
+the totals go to climbunity_app.metrics, and a statement shape repeated
+N_PLUS_ONE_THRESHOLD times or more is logged as a probable N+1.
+
+`capture_queries()` collects statements outside of that lifecycle, which is what
+the test helper `assert_max_queries` in climbunity_app/testing.py uses.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from climbunity_app.metrics import DB_N_PLUS_ONE, DB_SLOW_STATEMENTS, DB_STATEMENTS, DB_TIME
+
+logger = logging.getLogger('climbunity.sql')
+
+_captures = threading.local()
+
+_WHITESPACE = re.compile(r'\s+')
+_PLACEHOLDER_LIST = re.compile(r'\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)*\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+def statement_shape(statement):
+    """Normalize a statement so executions differing only in values compare equal."""
+    shape = _WHITESPACE.sub(' ', statement).strip()
+    shape = _LITERAL.sub('?', shape)
+    return _PLACEHOLDER_LIST.sub('(?)', shape)
+
+class QueryStats(object):
+    """Statements seen during one request (or one `capture_queries` block)."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = []
+        self.shapes = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements.append(statement)
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated_shapes(self, threshold):
+        """Statement shapes executed at least `threshold` times, most repeated first."""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+    def __len__(self):
+        return self.count
+
+@contextmanager
+def capture_queries():
+    """Collect every statement run on this thread inside the block into a QueryStats."""
+    stats = QueryStats()
+    stack = _captures.__dict__.setdefault('stack', [])
+    stack.append(stats)
+    try:
+        yield stats
+    finally:
+        stack.remove(stats)
+
+def _active_stats():
+    active = list(getattr(_captures, 'stack', ()))
+    if has_app_context():
+        request_stats = g.get('query_stats')
+        if request_stats is not None:
+            active.append(request_stats)
+    return active
+
+def _setting(name, default):
+    return current_app.config.get(name, default) if has_app_context() else default
+
+def _endpoint():
+    return (request.endpoint or 'unmatched') if has_request_context() else 'none'
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['query_start'].pop()
+    for stats in _active_stats():
+        stats.record(statement, duration)
+    if duration * 1000 >= _setting('SLOW_QUERY_MS', 200):
+        DB_SLOW_STATEMENTS.labels(_endpoint()).inc()
+        logger.warning('Slow query (%.1f ms) on %s: %s', duration * 1000, _endpoint(),
+            _WHITESPACE.sub(' ', statement)[:1000])
+
+@event.listens_for(Engine, 'handle_error')
+def discard_statement_timer(exception_context):
+    starts = exception_context.connection.info.get('query_start') if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+def init_query_stats(app):
+    """Tally statements per request on `app` and report them when the request ends."""
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+
+    @app.after_request
+    def report_query_stats(response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+        endpoint = _endpoint()
+        DB_STATEMENTS.labels(endpoint).observe(stats.count)
+        DB_TIME.labels(endpoint).inc(stats.duration)
+        repeated = stats.repeated_shapes(app.config['N_PLUS_ONE_THRESHOLD'])
+        if repeated:
+            DB_N_PLUS_ONE.labels(endpoint).inc()
+            for shape, count in repeated:
+                logger.warning('Probable N+1 on %s: %d x %s', endpoint, count, shape[:1000])
+        if app.config['QUERY_STATS_HEADERS']:
+            response.headers['X-DB-Statements'] = str(stats.count)
+            response.headers['X-DB-Time-Ms'] = f'{stats.duration * 1000:.2f}'
+        return response
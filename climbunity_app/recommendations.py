@@ -0,0 +1,224 @@
+"""Precomputed "routes you might like", from who climbed, rated and projected what.
+
+A batch job turns ascents and project lists into a sparse climber x route
+preference matrix and computes item-item cosine similarities between route
+columns with scipy, keeping the top RECOMMENDATIONS_PER_ROUTE neighbours of
+each route in RouteRecommendation. Pages only read those rows.
+
+Preferences are implicit and all positive: a rated ascent counts (rating + 1) / 6,
+an unrated ascent or a project 0.5, and the strongest signal wins when a
+climber has several. Similarities are shrunk towards zero when few climbers
+are behind them (overlap / (overlap + SIMILARITY_SHRINKAGE)), and pairs with
+fewer than RECOMMENDATION_MIN_OVERLAP climbers in common are dropped.
+
+Logging or deleting an ascent and changing a project list queue the route in
+RecommendationRefresh; `flask refresh-recommendations` recomputes just those
+routes and patches their new scores into the other routes' lists.
+"""
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, case, desc
+from climbunity_app.extensions import db
+from climbunity_app.models import (Ascent, RecommendationRefresh, Route, RouteRecommendation, Venue,
+    project_lists_table)
+
+PROJECT_PREFERENCE = 0.5
+UNRATED_PREFERENCE = 0.5
+SIMILARITY_SHRINKAGE = 2.0
+# routes whose similarities are computed per sparse product, bounds peak memory
+CHUNK = 2000
+INSERT_CHUNK = 10000
+
+def _preferences():
+    """(user_ids, route_ids, values) arrays, one entry per climber and route."""
+    ascents = db.session.query(
+        Ascent.user_id, Ascent.route_id,
+        func.max(case([(Ascent.send_rating == None, UNRATED_PREFERENCE)],
+            else_=(Ascent.send_rating + 1) / 6.0)),
+    ).group_by(Ascent.user_id, Ascent.route_id).all()
+    projects = db.session.query(project_lists_table.c.user_id, project_lists_table.c.route_id) \
+        .filter(project_lists_table.c.user_id != None, project_lists_table.c.route_id != None).all()
+    entries = np.array([(user_id, route_id, value) for user_id, route_id, value in ascents]
+        + [(user_id, route_id, PROJECT_PREFERENCE) for user_id, route_id in projects], dtype=np.float64).reshape(-1, 3)
+    user_ids, route_ids, values = entries[:, 0].astype(np.int64), entries[:, 1].astype(np.int64), entries[:, 2]
+    # a projected route that's also been climbed keeps the stronger signal
+    order = np.lexsort((route_ids, user_ids))
+    user_ids, route_ids, values = user_ids[order], route_ids[order], values[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (user_ids[1:] != user_ids[:-1]) | (route_ids[1:] != route_ids[:-1])
+    starts = np.flatnonzero(first)
+    values = np.maximum.reduceat(values, starts) if len(starts) else values
+    return user_ids[starts], route_ids[starts], values
+
+def preference_matrix():
+    """The climber x route preference matrix (CSC) and the route id of each column."""
+    from scipy import sparse # only the batch jobs need scipy, keep it out of every worker's startup
+    user_ids, route_ids, values = _preferences()
+    users, user_index = np.unique(user_ids, return_inverse=True)
+    routes, route_index = np.unique(route_ids, return_inverse=True)
+    matrix = sparse.csc_matrix((values, (user_index, route_index)), shape=(len(users), len(routes)))
+    return matrix, routes
+
+def _similarity_rows(matrix, columns, min_overlap):
+    """(column, neighbour columns, scores) for each of `columns`, every neighbour with a positive score."""
+    from scipy import sparse
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0))).ravel()
+    normalised = (matrix @ sparse.diags(1 / np.where(norms > 0, norms, 1))).tocsc()
+    binary = matrix.copy()
+    binary.data[:] = 1
+    for start in range(0, len(columns), CHUNK):
+        chunk = columns[start:start + CHUNK]
+        similarity = (normalised[:, chunk].T @ normalised).tocsr()
+        overlap = (binary[:, chunk].T @ binary).tocsr()
+        # every preference is positive, so both products have the same sparsity pattern
+        similarity.sort_indices()
+        overlap.sort_indices()
+        similarity.data *= overlap.data / (overlap.data + SIMILARITY_SHRINKAGE)
+        similarity.data[overlap.data < min_overlap] = 0
+        for row, column in enumerate(chunk.tolist()):
+            begin, end = similarity.indptr[row], similarity.indptr[row + 1]
+            neighbours, scores = similarity.indices[begin:end], similarity.data[begin:end]
+            keep = (neighbours != column) & (scores > 0)
+            yield column, neighbours[keep], scores[keep]
+
+def _top(neighbours, scores, limit):
+    """The best `limit` of (neighbours, scores), as (neighbour, score) pairs, best first."""
+    if len(scores) > limit:
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        neighbours, scores = neighbours[top], scores[top]
+    order = np.lexsort((neighbours, -scores))
+    return list(zip(neighbours[order].tolist(), scores[order].tolist()))
+
+def route_neighbours(matrix, columns, limit, min_overlap):
+    """Top `limit` neighbours of each column in `columns`, as (column, neighbour, rank, score) tuples."""
+    return [
+        (column, neighbour, rank, score)
+        for column, neighbours, scores in _similarity_rows(matrix, columns, min_overlap)
+        for rank, (neighbour, score) in enumerate(_top(neighbours, scores, limit), 1)
+    ]
+
+def _store(route_ids, neighbours):
+    """Replace the stored neighbours of `route_ids` (caller commits)."""
+    table = RouteRecommendation.__table__
+    for start in range(0, len(route_ids), INSERT_CHUNK):
+        db.session.execute(table.delete().where(table.c.route_id.in_(route_ids[start:start + INSERT_CHUNK])))
+    for start in range(0, len(neighbours), INSERT_CHUNK):
+        db.session.execute(table.insert(), neighbours[start:start + INSERT_CHUNK])
+
+def _recompute(matrix, routes, columns):
+    """RouteRecommendation rows for the routes at `columns`."""
+    config = current_app.config
+    neighbours = route_neighbours(matrix, columns, config['RECOMMENDATIONS_PER_ROUTE'],
+        config['RECOMMENDATION_MIN_OVERLAP'])
+    return [dict(route_id=int(routes[column]), similar_route_id=int(routes[neighbour]), rank=rank, score=score)
+        for column, neighbour, rank, score in neighbours]
+
+def rebuild_recommendations():
+    """Recompute every route's neighbours from scratch. Returns how many routes have some."""
+    matrix, routes = preference_matrix()
+    rows = _recompute(matrix, routes, np.arange(len(routes)))
+    db.session.execute(RouteRecommendation.__table__.delete())
+    db.session.execute(RecommendationRefresh.__table__.delete())
+    _store([], rows)
+    db.session.commit()
+    return len({row['route_id'] for row in rows})
+
+def queue_recommendation_refresh(route_id):
+    """Mark a route's recommendations stale (caller commits)."""
+    db.session.execute(RecommendationRefresh.__table__.insert().values(route_id=route_id))
+
+def _stored_neighbours(route_ids):
+    """{route_id: [(similar_route_id, score), ...] best first} for `route_ids`."""
+    stored = {route_id: [] for route_id in route_ids}
+    route_ids = sorted(route_ids)
+    for start in range(0, len(route_ids), INSERT_CHUNK):
+        rows = db.session.query(RouteRecommendation.route_id, RouteRecommendation.similar_route_id,
+                RouteRecommendation.score) \
+            .filter(RouteRecommendation.route_id.in_(route_ids[start:start + INSERT_CHUNK])) \
+            .order_by(RouteRecommendation.route_id, RouteRecommendation.rank)
+        for route_id, similar_route_id, score in rows:
+            stored[route_id].append((similar_route_id, score))
+    return stored
+
+def refresh_recommendations():
+    """Bring recommendations up to date with the ascents and projects queued since the last run.
+
+    Only the queued routes' columns of the preference matrix changed, so only
+    their similarities did: their own neighbour lists are recomputed, and their
+    new scores are merged into every other route's stored list (similarity is
+    symmetric). A queued route that drops out of another route's top list can
+    leave that list one short until the next rebuild. Returns how many routes'
+    lists were rewritten.
+    """
+    last_queued = db.session.query(func.max(RecommendationRefresh.id)).scalar()
+    if last_queued is None:
+        return 0
+    queued = {route_id for route_id, in db.session.query(RecommendationRefresh.route_id)
+        .filter(RecommendationRefresh.id <= last_queued).distinct()}
+    config = current_app.config
+    limit = config['RECOMMENDATIONS_PER_ROUTE']
+    matrix, routes = preference_matrix()
+    positions = {route_id: column for column, route_id in enumerate(routes.tolist())}
+    columns = np.array(sorted(positions[route_id] for route_id in queued if route_id in positions), dtype=np.int64)
+
+    rewritten = {route_id: [] for route_id in queued} # queued routes nobody climbs any more lose theirs
+    scores_to_queued = {}
+    for column, neighbours, scores in _similarity_rows(matrix, columns, config['RECOMMENDATION_MIN_OVERLAP']):
+        route_id = int(routes[column])
+        neighbour_ids = routes[neighbours]
+        rewritten[route_id] = _top(neighbour_ids, scores, limit)
+        for neighbour_id, score in zip(neighbour_ids.tolist(), scores.tolist()):
+            scores_to_queued.setdefault(neighbour_id, {})[route_id] = score
+
+    # every other route that lists a queued route now, or scores against one
+    listing = {route_id for route_id, in db.session.query(RouteRecommendation.route_id)
+        .filter(RouteRecommendation.similar_route_id.in_(sorted(queued))).distinct()}
+    for route_id, neighbours in _stored_neighbours((listing | set(scores_to_queued)) - queued).items():
+        merged = [(similar_route_id, score) for similar_route_id, score in neighbours if similar_route_id not in queued]
+        merged.extend(scores_to_queued.get(route_id, {}).items())
+        merged.sort(key=lambda neighbour: (-neighbour[1], neighbour[0]))
+        if merged[:limit] != neighbours:
+            rewritten[route_id] = merged[:limit]
+
+    _store(sorted(rewritten), [
+        dict(route_id=route_id, similar_route_id=similar_route_id, rank=rank, score=score)
+        for route_id, neighbours in rewritten.items()
+        for rank, (similar_route_id, score) in enumerate(neighbours, 1)
+    ])
+    db.session.execute(RecommendationRefresh.__table__.delete().where(RecommendationRefresh.id <= last_queued))
+    db.session.commit()
+    return len(rewritten)
+
+def similar_routes(route_id, limit):
+    """The route's stored neighbours, best first, as (route, venue_name, score) rows."""
+    return db.session.query(Route, Venue.name.label('venue_name'), RouteRecommendation.score) \
+        .join(RouteRecommendation, RouteRecommendation.similar_route_id == Route.id) \
+        .join(Venue, Venue.id == Route.venue_id) \
+        .filter(RouteRecommendation.route_id == route_id) \
+        .order_by(RouteRecommendation.rank) \
+        .limit(limit) \
+        .all()
+
+def recommended_routes(user_id, limit):
+    """Routes neighbouring the ones a climber has climbed or projected, which they haven't, best first.
+
+    Sums the stored similarity of each candidate to all of the climber's routes;
+    returns (route, venue_name, score) rows.
+    """
+    climbed = db.session.query(Ascent.route_id.label('route_id')).filter(Ascent.user_id == user_id)
+    projected = db.session.query(project_lists_table.c.route_id.label('route_id')) \
+        .filter(project_lists_table.c.user_id == user_id)
+    own_routes = climbed.union(projected).subquery()
+    score = func.sum(RouteRecommendation.score).label('score')
+    candidates = db.session.query(RouteRecommendation.similar_route_id.label('route_id'), score) \
+        .filter(RouteRecommendation.route_id.in_(db.session.query(own_routes.c.route_id)),
+            ~RouteRecommendation.similar_route_id.in_(db.session.query(own_routes.c.route_id))) \
+        .group_by(RouteRecommendation.similar_route_id) \
+        .order_by(desc(score), RouteRecommendation.similar_route_id) \
+        .limit(limit) \
+        .subquery()
+    return db.session.query(Route, Venue.name.label('venue_name'), candidates.c.score) \
+        .join(candidates, candidates.c.route_id == Route.id) \
+        .join(Venue, Venue.id == Route.venue_id) \
+        .order_by(desc(candidates.c.score), Route.id) \
+        .all()
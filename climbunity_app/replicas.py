@@ -0,0 +1,161 @@
+"""Send the read-only page views to database replicas.
+
+DATABASE_REPLICA_URLS (comma separated) adds one SQLAlchemy bind per replica,
+"replica1", "replica2", .... Views decorated with `reads_from_replica` run
+their GET/HEAD requests against one of them, picked per request; everything
+else, and any flush or INSERT/UPDATE/DELETE issued even during such a
+request, stays on the primary.
+
+- Read your writes: after a visitor's own POST (or any other non-GET request)
+  their reads stay on the primary for REPLICA_STICKY_SECONDS, tracked in their
+  session cookie, so they never see the page from before their change.
+- Lag: each worker checks each replica at most every REPLICA_CHECK_SECONDS
+  and skips one that is unreachable or more than REPLICA_MAX_LAG_SECONDS
+  behind (Postgres replay lag; other databases only need to answer).
+- Failure: a view whose replica query fails is marked down and the view runs
+  again on the primary.
+- Caches: pages rendered for the anonymous page cache, and the lookup tables
+  (see lookups.py), are always read from the primary, since they are kept
+  longer than any lag.
+
+Where each decorated request went is counted on /metrics as `db_read_routing`.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_app_context, request, session
+from flask_sqlalchemy import SignallingSession, get_state
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from sqlalchemy.sql.dml import UpdateBase
+from climbunity_app.metrics import DB_READ_ROUTING
+
+SAFE_METHODS = ('GET', 'HEAD')
+STICKY_KEY = '_db_primary_until'
+
+POSTGRES_LAG = text(
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() IS NULL OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+    'THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+def replica_binds(app):
+    """The bind keys of the configured replicas."""
+    return sorted(key for key in app.config.get('SQLALCHEMY_BINDS') or {} if key.startswith('replica'))
+
+class RoutingSession(SignallingSession):
+    """Session that reads from `g.db_replica` while a replica-routed view runs, and writes to the primary."""
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('db_replica') if has_app_context() else None
+        if replica is not None and not self._flushing and not isinstance(clause, UpdateBase):
+            return get_state(self.app).db.get_engine(self.app, bind=replica)
+        return super().get_bind(mapper, clause)
+
+##########################################
+#           Replica health               #
+##########################################
+
+_health = {} # bind key -> (checked_at, usable)
+_health_lock = threading.Lock()
+
+def replica_lag(engine):
+    """Seconds `engine`'s replica is behind its primary (0 when the database can't tell)."""
+    with engine.connect() as connection:
+        if engine.dialect.name == 'postgresql':
+            return float(connection.execute(POSTGRES_LAG).scalar() or 0)
+        connection.execute(text('SELECT 1'))
+        return 0.0
+
+def replica_usable(bind):
+    """Whether a replica answers and keeps up, cached per worker for REPLICA_CHECK_SECONDS."""
+    config = current_app.config
+    now = time.monotonic()
+    with _health_lock:
+        checked_at, usable = _health.get(bind, (None, False))
+        if checked_at is not None and now - checked_at < config['REPLICA_CHECK_SECONDS']:
+            return usable
+    engine = get_state(current_app).db.get_engine(current_app, bind=bind)
+    try:
+        usable = replica_lag(engine) <= config['REPLICA_MAX_LAG_SECONDS']
+    except SQLAlchemyError:
+        usable = False
+    with _health_lock:
+        _health[bind] = (now, usable)
+    return usable
+
+def mark_replica_down(bind):
+    """Skip a replica until its next check."""
+    with _health_lock:
+        _health[bind] = (time.monotonic(), False)
+
+def reset_replica_health():
+    with _health_lock:
+        _health.clear()
+
+##########################################
+#           Routing                      #
+##########################################
+
+def pick_replica():
+    """(bind key or None, reason) for this request's reads."""
+    binds = replica_binds(current_app)
+    if not binds:
+        return None, 'no_replicas'
+    if session.get(STICKY_KEY, 0) > time.time():
+        return None, 'sticky'
+    if g.get('page_cache_tags') is not None:
+        # a page going into the cache outlives any replica lag, render it from the primary
+        return None, 'page_cache'
+    usable = [bind for bind in binds if replica_usable(bind)]
+    if not usable:
+        return None, 'unavailable'
+    return random.choice(usable), 'replica'
+
+def reads_from_replica(view):
+    """Run a view's GET/HEAD requests on a replica when one is usable, see the module docstring."""
+    @wraps(view)
+    def routed_view(**kwargs):
+        if request.method not in SAFE_METHODS:
+            return view(**kwargs)
+        replica, reason = pick_replica()
+        if replica is None:
+            DB_READ_ROUTING.labels('primary', reason).inc()
+            return view(**kwargs)
+        db = get_state(current_app).db
+        g.db_replica = replica
+        try:
+            response = view(**kwargs)
+        except DBAPIError:
+            # the replica went away mid-request: forget it for a while and read from the primary
+            db.session.rollback()
+            mark_replica_down(replica)
+            DB_READ_ROUTING.labels('primary', 'replica_failed').inc()
+            g.db_replica = None
+            return view(**kwargs)
+        finally:
+            g.db_replica = None
+        DB_READ_ROUTING.labels(replica, 'replica').inc()
+        return response
+    return routed_view
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside the block, even in a replica-routed view."""
+    replica = g.get('db_replica') if has_app_context() else None
+    if replica is not None:
+        g.db_replica = None
+    try:
+        yield
+    finally:
+        if replica is not None:
+            g.db_replica = replica
+
+def init_replicas(app):
+    @app.after_request
+    def stick_to_primary(response):
+        # only the visitor who wrote needs to read it back right away
+        if request.method not in SAFE_METHODS and replica_binds(app) and response.status_code < 500:
+            session[STICKY_KEY] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+        return response
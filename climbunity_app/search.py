@@ -0,0 +1,190 @@
+"""Route search by venue, grade, style and tag.
+
+Filters are set-based subqueries on the association tables, which are indexed
+both ways round (style/tag first to find routes, route first to find
+labels), and results are keyset-paginated on an indexed sort key:
+RouteStats.rating_average, the route set date or the normalised grade
+difficulty (see climbunity_app/grades.py).
+
+Routes are searched through their RouteStats row; run `flask rebuild-route-stats`
+after importing routes that were created without one.
+"""
+import threading
+import time
+from datetime import date
+from flask import current_app
+from sqlalchemy import and_, exists, func, literal_column, select
+from climbunity_app.extensions import db
+from climbunity_app.grades import SCALES, parse_grade
+from climbunity_app.models import Route, RouteStats, Style, Tag, Venue, route_styles_table, route_tags_table
+from climbunity_app.pagination import decode_cursor, encode_cursor, seek
+
+# stands in for routes without a set date, so they sort last; spelled as a
+# literal so the expression matches the ix_route_set_date expression index
+SET_DATE_EPOCH = date(1970, 1, 1)
+SET_DATE_SORT = func.coalesce(Route.route_set_date, literal_column("'1970-01-01'"))
+
+SORT_CHOICES = [
+    ('rating', 'Highest rated'),
+    ('newest', 'Most recently set'),
+    ('hardest', 'Hardest first'),
+    ('easiest', 'Easiest first'),
+]
+
+FACET_LIMIT = 20
+FACET_CACHE_SIZE = 256
+
+# facet counts per filter combination, shared by every request in this process
+_facet_cache = {}
+_facet_lock = threading.Lock()
+
+def search_args(args):
+    """Read `(filters, sort)` from a query string such as request.args.
+
+    `venue`, repeated `style` / `tag` ids, exact `grade` values (repeated or
+    comma separated), a `scale` (sport or boulder) and a `min_grade` /
+    `max_grade` range in any grading system, which also picks the scale.
+    Anything that doesn't parse, and a range bound from the other scale, is ignored.
+    """
+    scale = args.get('scale') if args.get('scale') in SCALES else None
+    bounds = [parse_grade(args.get('min_grade')), parse_grade(args.get('max_grade'))]
+    if scale is None:
+        scale = next((bound.scale for bound in bounds if bound), None)
+    low, high = [bound.difficulty if bound and bound.scale == scale else None for bound in bounds]
+    filters = dict(
+        venue_id=args.get('venue', type=int),
+        style_ids=sorted(set(args.getlist('style', type=int))),
+        tag_ids=sorted(set(args.getlist('tag', type=int))),
+        grades=sorted({grade.strip() for value in args.getlist('grade') for grade in value.split(',') if grade.strip()}),
+        grade_scale=scale,
+        min_difficulty=low,
+        max_difficulty=high,
+    )
+    sort = args.get('sort')
+    if sort not in dict(SORT_CHOICES):
+        sort = 'rating'
+    return filters, sort
+
+def filter_routes(query, venue_id=None, style_ids=(), tag_ids=(), grades=(),
+        grade_scale=None, min_difficulty=None, max_difficulty=None, correlated=True):
+    """Narrow a query over Route to routes at `venue_id`, with any of `style_ids`, all of `tag_ids`,
+    one of `grades` and a difficulty between `min_difficulty` and `max_difficulty` on `grade_scale`.
+
+    `correlated` style/tag checks probe the (route_id, ...) indexes once per
+    candidate route, which suits a sorted, limited page; otherwise they are
+    `IN (subquery)` ranges of the (style_id/tag_id, route_id) indexes, which
+    suits counting every match.
+    """
+    if venue_id is not None:
+        query = query.filter(Route.venue_id == venue_id)
+    if grades:
+        query = query.filter(Route.grade.in_(grades))
+    if grade_scale is not None:
+        query = query.filter(Route.grade_scale == grade_scale)
+    if min_difficulty is not None:
+        query = query.filter(Route.grade_difficulty >= min_difficulty)
+    if max_difficulty is not None:
+        query = query.filter(Route.grade_difficulty <= max_difficulty)
+    if style_ids:
+        if correlated:
+            query = query.filter(exists().where(and_(
+                route_styles_table.c.route_id == Route.id,
+                route_styles_table.c.style_id.in_(style_ids))))
+        else:
+            query = query.filter(Route.id.in_(select([route_styles_table.c.route_id])
+                .where(route_styles_table.c.style_id.in_(style_ids))))
+    for tag_id in tag_ids:
+        if correlated:
+            query = query.filter(exists().where(and_(
+                route_tags_table.c.route_id == Route.id,
+                route_tags_table.c.tag_id == tag_id)))
+        else:
+            query = query.filter(Route.id.in_(select([route_tags_table.c.route_id])
+                .where(route_tags_table.c.tag_id == tag_id)))
+    return query
+
+def _sort_key(sort):
+    """The columns a sort orders by, whether it's descending, and how to read them back from a cursor."""
+    if sort == 'newest':
+        return [SET_DATE_SORT, Route.id], True, (date.fromisoformat, int)
+    if sort in ('hardest', 'easiest'):
+        return [Route.grade_difficulty, Route.id], sort == 'hardest', (float, int)
+    return [RouteStats.rating_average, RouteStats.route_id], True, (float, int)
+
+def _cursor_values(row, sort):
+    if sort == 'newest':
+        return row.Route.route_set_date or SET_DATE_EPOCH, row.Route.id
+    if sort in ('hardest', 'easiest'):
+        return row.Route.grade_difficulty, row.Route.id
+    return row.rating_average, row.Route.id
+
+def search_routes(filters, sort='rating', cursor=None, limit=20):
+    """One page of routes matching `filters`.
+
+    Sorting by difficulty leaves out routes whose grade didn't parse, and only
+    compares like with like when `filters` pick a scale.
+    Returns `(rows, next_cursor)`; each row has `Route`, `venue_name`,
+    `rating_average` and `ascent_count`, and `next_cursor` is None on the last page.
+    """
+    query = db.session.query(
+        Route,
+        Venue.name.label('venue_name'),
+        RouteStats.rating_average,
+        RouteStats.ascent_count,
+    ).join(RouteStats, RouteStats.route_id == Route.id) \
+        .join(Venue, Venue.id == Route.venue_id)
+    query = filter_routes(query, **filters)
+    columns, descending, converters = _sort_key(sort)
+    if sort in ('hardest', 'easiest'):
+        query = query.filter(Route.grade_difficulty != None)
+    query = query.order_by(*[column.desc() if descending else column for column in columns])
+    rows, has_more = seek(query, columns, decode_cursor(cursor, *converters), limit, descending=descending)
+    next_cursor = encode_cursor(*_cursor_values(rows[-1], sort)) if has_more else None
+    return rows, next_cursor
+
+def _label_counts(table, column, model, label, matching):
+    # count on the association table alone (an index-only scan), then label the top few
+    count = func.count().label('count')
+    counted = db.session.query(column.label('id'), count).group_by(column)
+    if matching is not None:
+        counted = counted.filter(table.c.route_id.in_(matching))
+    counted = counted.order_by(count.desc(), column).limit(FACET_LIMIT).subquery()
+    return db.session.query(model.id, label.label('label'), counted.c.count) \
+        .join(counted, counted.c.id == model.id) \
+        .order_by(counted.c.count.desc(), model.id) \
+        .all()
+
+def search_facets(filters):
+    """How many matching routes have each style, tag and grade (top FACET_LIMIT of each).
+
+    Counting scans every matching association row, so results are cached for
+    ROUTE_FACETS_CACHE_SECONDS per filter combination.
+    """
+    key = tuple((name, tuple(value) if isinstance(value, list) else value) for name, value in sorted(filters.items()))
+    ttl = current_app.config['ROUTE_FACETS_CACHE_SECONDS']
+    with _facet_lock:
+        cached = _facet_cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+    facets = _count_facets(filters)
+    with _facet_lock:
+        if len(_facet_cache) >= FACET_CACHE_SIZE:
+            _facet_cache.pop(next(iter(_facet_cache)))
+        _facet_cache[key] = (time.monotonic(), facets)
+    return facets
+
+def _count_facets(filters):
+    matching = None
+    if any(filters.values()):
+        matching = filter_routes(db.session.query(Route.id), correlated=False, **filters).statement
+    grade_count = func.count(Route.id)
+    grades = filter_routes(db.session.query(Route.grade.label('label'), grade_count.label('count')), correlated=False, **filters) \
+        .group_by(Route.grade) \
+        .order_by(grade_count.desc(), Route.grade) \
+        .limit(FACET_LIMIT) \
+        .all()
+    return {
+        'styles': _label_counts(route_styles_table, route_styles_table.c.style_id, Style, Style.style, matching),
+        'tags': _label_counts(route_tags_table, route_tags_table.c.tag_id, Tag, Tag.tag, matching),
+        'grades': grades,
+    }
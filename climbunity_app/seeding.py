@@ -0,0 +1,178 @@
+"""Deterministic synthetic data for load testing, run with `flask seed --scale 100k`.
+
+A scale is a number of ascents; everything else is sized from it:
+
+- a venue per 10k ascents (at least 3), whose popularity falls off with rank
+- a route per 20 ascents, 60% boulders (V0-V10) and 40% sport (5.7-5.13),
+  with 0-3 tags and the matching style, set on a date in the two years before
+  the reference date by one of the climbers
+- a climber per 25 ascents, each with a home venue where 80% of their ascents
+  are, 1-3 styles, and a 30% chance of a short project list
+- ascents spread over climbers with a long tail (a few log most of them),
+  skewed towards each venue's popular routes, about a third unrated, sent in
+  the two years before the reference date
+- an appointment per 5 climbers at the creator's home venue, with 0-3 guests
+
+The reference date is SEED_DATE unless another is given (the endpoint benchmark
+passes today, so the leaderboards' 30 and 7 day windows aren't empty); the same
+scale, seed and date always produce the same rows. Rows are bulk inserted
+through the models' tables, so the derived data the ORM would normally keep
+up (grade columns, RouteStats, leaderboards, lookup versions) is filled in
+here as well.
+Every climber is `climber<N>` with the password SEED_PASSWORD.
+"""
+import random
+from collections import Counter
+from itertools import accumulate
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import func
+from climbunity_app.extensions import bcrypt, db
+from climbunity_app.grades import parse_grade
+from climbunity_app.leaderboards import rebuild_leaderboards
+from climbunity_app.lookups import LOOKUP_MODELS, bump_lookup_versions
+from climbunity_app.models import (Appointment, Ascent, Route, SendType, Style, Tag, User, Venue,
+    appointment_guest_lists, project_lists_table, route_styles_table, route_tags_table, user_styles_table)
+from climbunity_app.stats import rebuild_route_stats
+
+SCALES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+SEED_PASSWORD = 'climbunity'
+SEED_DATE = date(2024, 6, 1)
+CHUNK = 10000
+
+STYLES = ['boulder', 'sport', 'trad', 'toprope']
+TAGS = ['crimpy', 'slopey', 'pinchy', 'juggy', 'pockets', 'slab', 'vertical', 'overhang', 'roof', 'arete',
+    'dihedral', 'crack', 'dyno', 'mantle', 'heel hook', 'toe hook', 'compression', 'technical', 'pumpy',
+    'powerful', 'reachy', 'morpho', 'sharp', 'polished', 'classic']
+# grades with how common they are on a typical wall
+BOULDER_GRADES = [('V0', 8), ('V1', 10), ('V2', 12), ('V3', 14), ('V4', 14), ('V5', 12), ('V6', 10),
+    ('V7', 7), ('V8', 5), ('V9', 3), ('V10', 2)]
+SPORT_GRADES = [('5.7', 5), ('5.8', 7), ('5.9', 9), ('5.10a', 9), ('5.10b', 9), ('5.10c', 8), ('5.10d', 8),
+    ('5.11a', 7), ('5.11b', 6), ('5.11c', 5), ('5.11d', 4), ('5.12a', 3), ('5.12b', 2), ('5.12c', 2),
+    ('5.13a', 1)]
+SEND_TYPES = [(SendType.REDPOINT, 40), (SendType.FLASH, 20), (SendType.ONSIGHT, 15), (SendType.SEND, 15),
+    (SendType.ABANDON, 10)]
+RATINGS = [(None, 35), (1, 4), (2, 10), (3, 22), (4, 20), (5, 9)]
+COMMENTS = ['Sandbagged!', 'Soft for the grade.', 'Great movement.', 'Crux is all about the feet.',
+    'Took a few sessions.', 'Loved the top out.', 'Tweaky on the crimps.', 'Best route in the gym.']
+ADJECTIVES = ['Silent', 'Crimson', 'Hidden', 'Angry', 'Lazy', 'Electric', 'Lunar', 'Golden', 'Wild', 'Frozen']
+NOUNS = ['Arete', 'Crimp', 'Dragon', 'Ladder', 'Monkey', 'Pinch', 'Roof', 'Slab', 'Storm', 'Traverse']
+
+def _choices(rng, weighted, k):
+    values, weights = zip(*weighted)
+    return rng.choices(values, weights, k=k)
+
+def _insert(table, rows):
+    for start in range(0, len(rows), CHUNK):
+        db.session.execute(table.insert(), rows[start:start + CHUNK])
+
+def _reset_sequences(models):
+    # explicit ids leave Postgres' serial sequences behind, the next app insert would collide
+    if db.session.get_bind().dialect.name == 'postgresql':
+        for model in models:
+            db.session.execute(f"SELECT setval(pg_get_serial_sequence('{model.__tablename__}', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 1) FROM \"{model.__tablename__}\"))")
+
+def dataset_size(ascents):
+    """How many of each row a seed of `ascents` ascents creates."""
+    users = max(20, ascents // 25)
+    return dict(
+        venues=max(3, ascents // 10000),
+        routes=max(30, ascents // 20),
+        users=users,
+        ascents=ascents,
+        appointments=max(5, users // 5),
+    )
+
+def seed_database(ascents, seed=20, today=SEED_DATE):
+    """Fill an empty database with `ascents` ascents and everything around them, dated up to `today`.
+
+    Returns the row counts.
+    """
+    if db.session.query(func.count(User.id)).scalar() or db.session.query(func.count(Venue.id)).scalar():
+        raise ValueError('The database already has users or venues, seed an empty one.')
+    rng = random.Random(seed)
+    size = dataset_size(ascents)
+
+    _insert(Style.__table__, [dict(id=id, style=style) for id, style in enumerate(STYLES, 1)])
+    _insert(Tag.__table__, [dict(id=id, tag=tag) for id, tag in enumerate(TAGS, 1)])
+    _insert(Venue.__table__, [dict(id=id, name=f'Gym {id}', address=f'{id} Boulder Avenue',
+        open_hours='6am - 11pm', description='Synthetic venue') for id in range(1, size['venues'] + 1)])
+    venue_ids = list(range(1, size['venues'] + 1))
+    # cumulative weights, so each weighted pick is a bisect rather than a pass over the weights
+    venue_weights = list(accumulate(1 / rank for rank in venue_ids))
+
+    password = bcrypt.generate_password_hash(SEED_PASSWORD).decode('utf-8')
+    home_venues = rng.choices(venue_ids, cum_weights=venue_weights, k=size['users'])
+    for start in range(0, size['users'], CHUNK):
+        ids = range(start + 1, min(start + CHUNK, size['users']) + 1)
+        _insert(User.__table__, [dict(id=id, username=f'climber{id}', password=password,
+            email=f'climber{id}@example.com', first_name='Climber', last_name=str(id),
+            address=f'{id} Chalk Street', has_gear=rng.random() < 0.55, is_admin=False) for id in ids])
+        _insert(user_styles_table, [dict(user_id=id, style_id=style_id) for id in ids
+            for style_id in rng.sample(range(1, len(STYLES) + 1), rng.randint(1, 3))])
+
+    # routes, each venue's numbered by popularity so rng.choices can skew towards the first
+    venue_routes = {venue_id: [] for venue_id in venue_ids}
+    route_rows, route_style_rows, route_tag_rows = [], [], []
+    for id in range(1, size['routes'] + 1):
+        venue_id = rng.choices(venue_ids, cum_weights=venue_weights)[0]
+        venue_routes[venue_id].append(id)
+        boulder = rng.random() < 0.6
+        grade = _choices(rng, BOULDER_GRADES if boulder else SPORT_GRADES, 1)[0]
+        parsed = parse_grade(grade)
+        route_rows.append(dict(id=id, venue_id=venue_id, setter_id=rng.randint(1, size['users']),
+            name=f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {id}', grade=grade,
+            grade_scale=parsed.scale, grade_difficulty=parsed.difficulty,
+            route_set_date=today - timedelta(days=rng.randint(0, 730))))
+        route_style_rows.append(dict(route_id=id, style_id=1 if boulder else 2))
+        route_tag_rows.extend(dict(route_id=id, tag_id=tag_id)
+            for tag_id in rng.sample(range(1, len(TAGS) + 1), rng.randint(0, 3)))
+    _insert(Route.__table__, route_rows)
+    _insert(route_styles_table, route_style_rows)
+    _insert(route_tags_table, route_tag_rows)
+    all_routes = [id for routes in venue_routes.values() for id in routes]
+    route_weights = {venue_id: list(accumulate(1 / (rank ** 0.8) for rank in range(1, len(routes) + 1)))
+        for venue_id, routes in venue_routes.items()}
+
+    # ascents: a few very active climbers and a long tail, mostly at their home venue
+    activity = [rng.paretovariate(2) for _ in home_venues]
+    counts = Counter(rng.choices(range(1, size['users'] + 1), activity, k=ascents))
+    ascent_rows, project_rows = [], []
+    for user_id, home in enumerate(home_venues, 1):
+        for _ in range(counts[user_id]):
+            if venue_routes[home] and rng.random() < 0.8:
+                route_id = rng.choices(venue_routes[home], cum_weights=route_weights[home])[0]
+            else:
+                route_id = rng.choice(all_routes)
+            rating = _choices(rng, RATINGS, 1)[0]
+            ascent_rows.append(dict(user_id=user_id, route_id=route_id,
+                send_date=today - timedelta(days=rng.randint(0, 730)),
+                send_type=_choices(rng, SEND_TYPES, 1)[0].name, send_rating=rating,
+                send_comments=rng.choice(COMMENTS) if rng.random() < 0.1 else None))
+        if rng.random() < 0.3:
+            project_rows.extend(dict(user_id=user_id, route_id=route_id)
+                for route_id in sorted(set(rng.choices(venue_routes[home] or all_routes, k=rng.randint(1, 3)))))
+        if len(ascent_rows) >= CHUNK:
+            _insert(Ascent.__table__, ascent_rows)
+            ascent_rows = []
+    _insert(Ascent.__table__, ascent_rows)
+    _insert(project_lists_table, project_rows)
+
+    guest_rows = []
+    appointment_rows = []
+    for id in range(1, size['appointments'] + 1):
+        creator = rng.randint(1, size['users'])
+        appointment_rows.append(dict(id=id, created_by=creator, venue_id=home_venues[creator - 1],
+            appointment_datetime=datetime.combine(today + timedelta(days=rng.randint(1, 60)),
+                time(rng.randint(6, 21), rng.choice([0, 15, 30, 45])))))
+        guests = {creator} | {rng.randint(1, size['users']) for _ in range(rng.randint(0, 3))}
+        guest_rows.extend(dict(user_id=user_id, appointment_id=id) for user_id in sorted(guests))
+    _insert(Appointment.__table__, appointment_rows)
+    _insert(appointment_guest_lists, guest_rows)
+
+    _reset_sequences([Style, Tag, Venue, User, Route, Ascent, Appointment])
+    bump_lookup_versions(db.session, LOOKUP_MODELS)
+    db.session.commit()
+    rebuild_route_stats()
+    rebuild_leaderboards()
+    return size
@@ -0,0 +1,72 @@
+// Typeahead for the ModelSelectField widgets (climbunity_app/fields.py):
+// typing in .typeahead-input queries the field's data-search-url and picking a
+// result adds it to the <select> that is actually submitted.
+(function () {
+    var DEBOUNCE_MS = 200;
+
+    function addOption(select, id, label) {
+        if (!select.multiple) {
+            select.innerHTML = '';
+        }
+        var existing = select.querySelector('option[value="' + id + '"]');
+        if (existing) {
+            existing.selected = true;
+            return;
+        }
+        var option = document.createElement('option');
+        option.value = id;
+        option.textContent = label;
+        option.selected = true;
+        select.appendChild(option);
+    }
+
+    function showResults(box, results, nextCursor) {
+        var list = box.querySelector('.typeahead-results');
+        list.innerHTML = '';
+        results.forEach(function (result) {
+            var item = document.createElement('li');
+            item.textContent = result.label;
+            item.dataset.id = result.id;
+            list.appendChild(item);
+        });
+        if (nextCursor) {
+            var more = document.createElement('li');
+            more.className = 'typeahead-more';
+            more.textContent = 'More...';
+            more.dataset.cursor = nextCursor;
+            list.appendChild(more);
+        }
+    }
+
+    function search(box, cursor) {
+        var input = box.querySelector('.typeahead-input');
+        var url = box.dataset.searchUrl + '?q=' + encodeURIComponent(input.value);
+        if (cursor) {
+            url += '&cursor=' + encodeURIComponent(cursor);
+        }
+        fetch(url, {credentials: 'same-origin'})
+            .then(function (response) { return response.json(); })
+            .then(function (page) { showResults(box, page.results, page.next_cursor); });
+    }
+
+    document.addEventListener('input', function (event) {
+        var input = event.target;
+        if (!input.classList || !input.classList.contains('typeahead-input')) { return; }
+        var box = input.closest('.typeahead');
+        clearTimeout(box.typeaheadTimer);
+        box.typeaheadTimer = setTimeout(function () { search(box); }, DEBOUNCE_MS);
+    });
+
+    document.addEventListener('click', function (event) {
+        var item = event.target.closest('.typeahead-results li');
+        if (!item) { return; }
+        var box = item.closest('.typeahead');
+        if (item.dataset.cursor) {
+            search(box, item.dataset.cursor);
+            return;
+        }
+        addOption(box.querySelector('select'), item.dataset.id, item.textContent);
+        box.querySelector('.typeahead-results').innerHTML = '';
+        box.querySelector('.typeahead-input').value = '';
+    });
+})();
@@ -0,0 +1,84 @@
+"""Incremental bookkeeping for RouteStats.
+
+Every ascent logged or deleted through the app adjusts its route's counters
+with a single relative UPDATE in the same transaction, so the route page reads
+one row instead of walking every Ascent on the route.
+"""
+from sqlalchemy import Float, case, cast, func
+from climbunity_app.extensions import db
+from climbunity_app.models import Ascent, Route, RouteStats, SendType, SEND_TYPE_COLUMNS
+
+stats_table = RouteStats.__table__
+
+def _send_type(value):
+    # unflushed ascents still hold the raw form value (the enum name)
+    if value is None or isinstance(value, SendType):
+        return value
+    return SendType[value]
+
+def _rating(value):
+    return None if value is None or value == '' else int(value)
+
+def _ascent_deltas(ascent, step):
+    """Which counters an ascent contributes to, each moved by `step` (+1 or -1)."""
+    deltas = {'ascent_count': step}
+    rating = _rating(ascent.send_rating)
+    if rating is not None:
+        deltas['rating_count'] = step
+        deltas['rating_sum'] = step * rating
+        if 0 <= rating <= 5:
+            deltas[f'rating_{rating}'] = step
+    send_type = _send_type(ascent.send_type)
+    if send_type is not None:
+        deltas[SEND_TYPE_COLUMNS[send_type]] = step
+    return deltas
+
+def _average(rating_sum, rating_count):
+    return case([(rating_count > 0, cast(rating_sum, Float) / rating_count)], else_=0.0)
+
+def _apply(route_id, deltas, create_missing):
+    values = {column: stats_table.c[column] + delta for column, delta in deltas.items()}
+    if 'rating_count' in deltas:
+        # SET expressions all see the old row, so average the updated totals explicitly
+        values['rating_average'] = _average(values['rating_sum'], values['rating_count'])
+    result = db.session.execute(
+        stats_table.update()
+        .where(stats_table.c.route_id == route_id)
+        .values(values)
+    )
+    if result.rowcount == 0 and create_missing:
+        # route created before stats existed; `flask rebuild-route-stats` backfills the rest
+        average = deltas['rating_sum'] / deltas['rating_count'] if deltas.get('rating_count') else 0.0
+        db.session.execute(stats_table.insert().values(route_id=route_id, rating_average=average, **deltas))
+
+def record_ascent(ascent):
+    """Add a newly logged ascent to its route's stats (caller commits)."""
+    _apply(ascent.route_id, _ascent_deltas(ascent, 1), create_missing=True)
+
+def discard_ascent(ascent):
+    """Remove a deleted ascent from its route's stats (caller commits)."""
+    _apply(ascent.route_id, _ascent_deltas(ascent, -1), create_missing=False)
+
+def _count_where(condition):
+    return func.coalesce(func.sum(case([(condition, 1)], else_=0)), 0)
+
+def rebuild_route_stats():
+    """Recompute every route's stats from the Ascent table in one set-based pass."""
+    aggregates = db.session.query(
+        Route.id,
+        func.count(Ascent.id),
+        func.count(Ascent.send_rating),
+        func.coalesce(func.sum(Ascent.send_rating), 0),
+        _average(func.sum(Ascent.send_rating), func.count(Ascent.send_rating)),
+        *[_count_where(Ascent.send_rating == rating) for rating in range(6)],
+        *[_count_where(Ascent.send_type == send_type) for send_type in SEND_TYPE_COLUMNS],
+    ).outerjoin(Ascent, Ascent.route_id == Route.id).group_by(Route.id)
+    columns = [
+        'route_id', 'ascent_count', 'rating_count', 'rating_sum', 'rating_average',
+        *[f'rating_{rating}' for rating in range(6)],
+        *SEND_TYPE_COLUMNS.values(),
+    ]
+    db.session.execute(stats_table.delete())
+    db.session.execute(stats_table.insert().from_select(columns, aggregates.statement))
+    db.session.commit()
+    return db.session.query(func.count(stats_table.c.route_id)).scalar()
@@ -0,0 +1,16 @@
+"""Helpers for the test suites."""
+from contextlib import contextmanager
+from climbunity_app.querystats import capture_queries
+
+@contextmanager
+def assert_max_queries(testcase, budget):
+    """Fail `testcase` if the block runs more than `budget` SQL statements.
+
+        with assert_max_queries(self, 4):
+            self.app.get('/users')
+    """
+    with capture_queries() as stats:
+        yield stats
+    if stats.count > budget:
+        statements = '\n'.join(f'  {statement}' for statement in stats.statements)
+        testcase.fail(f'{stats.count} queries run, budget was {budget}:\n{statements}')
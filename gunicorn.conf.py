@@ -0,0 +1,90 @@
+"""Gunicorn settings for running Climbunity in production.
+
+    gunicorn --config gunicorn.conf.py app:app
+
+Every setting can be overridden through the environment, see the README's
+"Running in production" section for the worker models and how to compare them.
+"""
+import glob
+import logging
+import multiprocessing
+import os
+
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'threaded': 'gthread',
+    'gthread': 'gthread',
+    'gevent': 'gevent',
+}
+
+worker_mode = os.getenv('GUNICORN_WORKER_CLASS', 'sync').lower()
+if worker_mode not in WORKER_CLASSES:
+    raise ValueError(f'GUNICORN_WORKER_CLASS must be one of {", ".join(WORKER_CLASSES)}, not {worker_mode!r}')
+worker_class = WORKER_CLASSES[worker_mode]
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5002')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4 if worker_class == 'gthread' else 1))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 100)) # gevent only
+
+# import the app once in the master so workers share its pages copy-on-write;
+# gevent has to monkey patch before the app imports anything, so it defaults to off there
+preload_app = os.getenv('GUNICORN_PRELOAD', 'false' if worker_class == 'gevent' else 'true').lower() == 'true'
+
+# recycle workers after a jittered number of requests so leaks can't accumulate,
+# letting in-flight requests finish first
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# heartbeat files on tmpfs, docker's overlay filesystem can stall workers
+worker_tmp_dir = os.getenv('GUNICORN_WORKER_TMP_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else None)
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+# workers write their metrics to PROMETHEUS_MULTIPROC_DIR and /metrics adds them up;
+# start from a clean directory, before a preloaded app creates its own files
+metrics_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+if metrics_dir:
+    os.makedirs(metrics_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(metrics_dir, '*.db')):
+        os.remove(stale)
+
+def dispose_engines():
+    """Drop every pooled DB connection held by this process, the read replicas' included."""
+    from app import app
+    from climbunity_app.extensions import db
+    from climbunity_app.replicas import replica_binds
+    with app.app_context():
+        for bind in [None, *replica_binds(app)]:
+            db.get_engine(app, bind=bind).dispose()
+
+def child_exit(server, worker):
+    # drop a dead worker's live gauges (in-flight requests, pool checkouts)
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+def pre_fork(server, worker):
+    # building the app doesn't connect, but empty the master's pool anyway
+    # so no psycopg2 socket is ever inherited by a worker
+    if preload_app:
+        dispose_engines()
+
+def post_fork(server, worker):
+    # belt and braces: start every worker with an empty pool of its own
+    if preload_app:
+        dispose_engines()
+
+def post_worker_init(worker):
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            logging.getLogger('gunicorn.error').warning(
+                'psycogreen is not installed, psycopg2 calls will block the gevent loop')
+        else:
+            patch_psycopg()